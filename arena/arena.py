@@ -9,9 +9,20 @@ import threading
 import subprocess
 import os
 import os.path
+import itertools
+import multiprocessing
 
 from mm18.server import server
-from mm18.game.game_controller import game_running, get_winners
+from mm18.server.game_registry import MMGameRegistry
+from mm18.game.game_controller import game_started, game_running, get_winners
+
+# Teams in each game of a tournament
+GAME_SIZE = 4
+# Tournament games are served on consecutive ports starting here
+TOURNAMENT_BASE_PORT = 7000
+# Points a team scores for finishing first, second, third and fourth among
+# the teams of a tournament game
+RANK_POINTS = [3, 2, 1, 0]
 
 # Component functions
 def update_teams(teams):
@@ -62,8 +73,10 @@ def start_server(server_addr, server_port, game_log):
 	server.server_instance = serve
 	thread = threading.Thread(target=serve.serve_forever)
 	thread.start()
+	return serve
 
 def run_clients(teams, address):
+	processes = []
 	for team in teams:
 		path = "./client"
 		print "Starting client for team", team
@@ -76,17 +89,19 @@ def run_clients(teams, address):
 		team_cwd = os.getcwd() + '/' + str(team)
 
 		# We tell the server the name to give the player
-		server.global_client_manager.set_next_team(int(team))
+		client_manager = server.game_registry.lobby().client_manager
+		client_manager.set_next_team(int(team))
 
 		# And open the subproecess
 		os.chdir(str(team))
-		subprocess.Popen([path, address], stdout=outfile, stderr=errfile)
+		processes.append(subprocess.Popen([path, address],
+			stdout=outfile, stderr=errfile))
 		os.chdir('../')
 
 		# Wait for the server to connect before continuing
 		cycles = 0
 		while True:
-			if server.global_client_manager.get_set_status():
+			if client_manager.get_set_status():
 				break
 			if cycles >= 5:
 				print "ERROR: Team", team, "timed out on connect"
@@ -94,18 +109,175 @@ def run_clients(teams, address):
 			cycles += 1
 			time.sleep(1)
 
-def print_game_results():
+	return processes
+
+def wait_for_results():
+	# The last client to connect starts the game, which may not have
+	# happened yet
+	while not game_started():
+		time.sleep(1)
 	while True:
 		if not game_running():
 			break
 		time.sleep(1)
-	results = get_winners()
+	return get_winners()
+
+def print_game_results():
+	results = wait_for_results()
 	for place in sorted(results):
 		print "Place", place, "is team", results[place]
 
 # Competition control functions
-def run_competition():
-	pass
+
+def round_robin_games(teams):
+	"""Every team meets every other team in at least one game.
+
+	The teams are paired off for len(teams) - 1 rounds by the circle
+	method, which pairs every two teams in exactly one round, and each round
+	plays its pairs GAME_SIZE / 2 to a game. Every team plays one game a
+	round, so no two teams meet more than len(teams) - 1 times, and there
+	are about len(teams) ** 2 / 4 games rather than one for every group of
+	GAME_SIZE teams. With an odd number of teams, the team left over each
+	round joins the last game. A game of the same teams as an earlier one
+	is only played once.
+	"""
+	teams = list(teams)
+	if len(teams) % 2:
+		teams.append(None)
+	games = []
+	played = set()
+	for round in range(len(teams) - 1):
+		pairs = [[teams[i], teams[-1 - i]] for i in range(len(teams) / 2)]
+		spare = [team for pair in pairs if None in pair
+			for team in pair if team is not None]
+		pairs = [pair for pair in pairs if None not in pair]
+		per_game = GAME_SIZE / 2
+		round_games = [sum(pairs[i:i + per_game], [])
+			for i in range(0, len(pairs), per_game)]
+		if spare and round_games:
+			if len(round_games[-1]) + len(spare) > GAME_SIZE:
+				# Split the last game's pairs so the spare team has company
+				round_games.append(round_games[-1][2:])
+				round_games[-2] = round_games[-2][:2]
+			round_games[-1] += spare
+		for game in round_games:
+			key = frozenset(game)
+			if key not in played:
+				played.add(key)
+				games.append(game)
+		# Keep the first team where it is and rotate the rest
+		teams.insert(1, teams.pop())
+	return games
+
+def swiss_games(teams, standings):
+	"""Pair teams with similar scores for the next round.
+
+	Teams are ranked by points so far, ties broken by name, and split in
+	rank order into as few games as hold them, as even in size as they can
+	be, so when the teams don't divide into games of GAME_SIZE some games
+	are smaller but none has fewer than two teams. A lone team has no one
+	to play and sits the round out.
+	"""
+	ranked = sorted(teams, key=lambda team: (-standings[team]['points'], team))
+	count = -(-len(ranked) // GAME_SIZE)
+	games = [ranked[i * len(ranked) / count:(i + 1) * len(ranked) / count]
+		for i in range(count)]
+	return [game for game in games if len(game) > 1]
+
+def play_match(match):
+	"""Play one tournament game on its own server port and log file.
+
+	Runs in a pool worker process, which gets a fresh copy of the server
+	and game controller globals for every match. Returns the match with the
+	results from the engine, or None for the results if the game did not
+	run, so the worker never dies with a game unaccounted for.
+	"""
+	index, teams, server_addr, server_port, log_dir = match
+	if len(teams) < 2:
+		raise ValueError("Match %d needs at least 2 teams" % index)
+	game_log = os.path.join(log_dir, "game-%04d.mmlog" % index)
+	full_addr = server_addr + ":" + str(server_port)
+	print "Match", index, "on", full_addr + ":", ", ".join(teams)
+
+	server.game_registry = MMGameRegistry(len(teams))
+	serve = start_server(server_addr, server_port, game_log)
+	processes = []
+	results = None
+	try:
+		processes = run_clients(teams, full_addr)
+		results = wait_for_results()
+	except SystemExit:
+		print "ERROR: Match", index, "could not start"
+	finally:
+		for process in processes:
+			if process.poll() is None:
+				process.kill()
+		serve.shutdown()
+	return (index, teams, results)
+
+def score_match(standings, teams, results):
+	for team in teams:
+		standings[team]['games'] += 1
+	if results is None:
+		return
+	# The engine places players from 4th up whatever the size of the game,
+	# so a game of fewer teams has no 4th, or even no 1st, place. Score by
+	# the order of the places instead.
+	for rank, place in enumerate(sorted(results)):
+		team = str(results[place])
+		if team in standings:
+			standings[team]['points'] += RANK_POINTS[rank]
+			if rank == 0:
+				standings[team]['wins'] += 1
+
+def print_leaderboard(standings, names):
+	print "Leaderboard"
+	ranked = sorted(standings, key=lambda team: (-standings[team]['points'], team))
+	for rank, team in enumerate(ranked):
+		record = standings[team]
+		print "%3d. %-30s %4d points %3d wins %3d games" % (rank + 1,
+			names.get(team, team), record['points'], record['wins'],
+			record['games'])
+
+def run_competition(server_addr, base_port, log_dir, teams, rounds=None,
+		processes=None):
+	"""Run a tournament between many teams over a pool of processes.
+
+	With rounds of None every team meets every other team (round robin,
+	see round_robin_games), otherwise that many Swiss rounds are played, pairing teams with
+	similar scores each round. Games within a round run in parallel, each
+	with its own server port and log file in log_dir.
+
+	Returns the standings, a dict of team to points, wins and games.
+	"""
+	names = update_teams(teams)
+	standings = dict((team, {'points': 0, 'wins': 0, 'games': 0})
+		for team in teams)
+	if not os.path.isdir(log_dir):
+		os.makedirs(log_dir)
+
+	# A new process per match, so no server state leaks between games
+	pool = multiprocessing.Pool(processes, maxtasksperchild=1)
+	played = 0
+	try:
+		if rounds is None:
+			schedule = [round_robin_games(teams)]
+		else:
+			schedule = [None] * rounds
+		for games in schedule:
+			if games is None:
+				games = swiss_games(teams, standings)
+			matches = [(played + i, game, server_addr, base_port + played + i,
+				log_dir) for i, game in enumerate(games)]
+			played += len(matches)
+			for index, game, results in pool.imap_unordered(play_match, matches):
+				score_match(standings, game, results)
+	finally:
+		pool.close()
+		pool.join()
+
+	print_leaderboard(standings, names)
+	return standings
 
 def main(server_addr, server_port, game_log, teams):
 	# First, pull in the latest code for the teams to run
@@ -126,6 +298,20 @@ def main(server_addr, server_port, game_log, teams):
 	print_game_results()
 
 if __name__ == '__main__':
+	if len(sys.argv) > 1 and sys.argv[1] == 'tournament':
+		# arena.py tournament LOG_DIR ROUNDS TEAM...
+		# ROUNDS is the number of Swiss rounds, or "all" for round robin,
+		# where every team meets every other team
+		if len(sys.argv) < 4 + GAME_SIZE:
+			print "Error, need a log directory, rounds and at least", \
+				GAME_SIZE, "teams"
+			sys.exit(1)
+		log_dir = os.path.abspath(sys.argv[2])
+		rounds = None if sys.argv[3] == 'all' else int(sys.argv[3])
+		run_competition('localhost', TOURNAMENT_BASE_PORT, log_dir,
+			sys.argv[4:], rounds)
+		sys.exit(0)
+
 	if len(sys.argv) > 1:
 		game_log = os.path.abspath(sys.argv[1])
 	else:
@@ -0,0 +1,374 @@
+#! /usr/bin/env python
+
+"""Load generator for the MechMania 18 server.
+
+Plays many virtual clients against a running server to see how it holds up.
+Each virtual client is the Python client's Client on a thread of its own,
+with its own requests session, so it keeps its connection open between
+requests on a server that allows it (run.py --server event). Clients join
+games GAME_SIZE at a time, so every client connected fills up games across
+the server, and each then makes requests picked at random from an action
+mix until the time is up or its game ends.
+
+At the end it reports the latency percentiles and errors of each action,
+and the tick overruns of every game from /metrics, which the first client in
+each game polls while it plays.
+"""
+
+import argparse
+import imp
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+from mm18.game import constants
+from mm18.game.scheduler import monotonic
+
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+	'clients', 'python')
+# Players in each game the server hosts
+GAME_SIZE = 4
+# The status a request the game refused, like a purchase without the
+# resources for it, is answered with
+REFUSED = 409
+# The status requests are answered with once their game is over
+GAME_OVER = 404
+
+def load_client():
+	"""The Client class from the Python client, which needs requests."""
+
+	# The client imports its helpers from its own directory
+	if CLIENT_DIR not in sys.path:
+		sys.path.insert(0, CLIENT_DIR)
+	return imp.load_source('mmclient', os.path.join(CLIENT_DIR, 'client')).Client
+
+# Actions, each making one request for a virtual client and returning the
+# decoded reply
+
+def send_unit(bot):
+	"""Sends a level 0 unit at a random opponent, like the example client."""
+
+	return bot.client.attack(0, bot.rng.randint(-1, 1),
+		bot.rng.choice(bot.opponents), bot.rng.choice(constants.DIRECTIONS))
+
+def churn_tower(bot):
+	"""Builds a tower next to the path, or sells one already built."""
+
+	if bot.towers and bot.rng.random() < .5:
+		tower = bot.towers.pop(bot.rng.randrange(len(bot.towers)))
+		return bot.post('/tower/%d/sell' % tower)
+	reply = bot.post('/tower/create',
+		position=bot.rng.choice(bot.towerSquares))
+	if reply.get('status') == 200:
+		bot.towers.append(reply['towerID'])
+	return reply
+
+def poll_board(bot):
+	"""Fetches what changed on a random board since it was last fetched."""
+
+	player = bot.rng.choice(bot.players)
+	since = bot.versions.get(player)
+	if since is None:
+		reply = bot.post('/board/%d' % player)
+	else:
+		reply = bot.post('/board/%d' % player, since=since)
+	if 'version' in reply:
+		bot.versions[player] = reply['version']
+	return reply
+
+def game_status(bot):
+	"""Fetches every player's health."""
+
+	return bot.client.game_status()
+
+ACTIONS = {
+	'units': send_unit,
+	'towers': churn_tower,
+	'board': poll_board,
+	'status': game_status,
+}
+
+# Action mixes by name, as weights of each action
+MIXES = {
+	'units': 'units=1',
+	'towers': 'towers=1',
+	'polling': 'board=1',
+	'mixed': 'board=4,units=2,towers=1,status=1',
+}
+
+def parse_mix(mix):
+	"""Reads an action mix.
+
+	mix -- the name of one of MIXES, or action=weight pairs separated by
+	commas, like "board=4,units=1"
+
+	Returns a list of (action name, weight) pairs. Raises ValueError if the
+	mix doesn't make sense.
+	"""
+
+	mix = MIXES.get(mix, mix)
+	weights = []
+	for part in mix.split(','):
+		name, equals, weight = part.partition('=')
+		name = name.strip()
+		if name not in ACTIONS:
+			raise ValueError("Unknown action %r, pick from %s" %
+				(name, ', '.join(sorted(ACTIONS))))
+		weight = float(weight) if equals else 1.0
+		if weight < 0:
+			raise ValueError("Negative weight for %s" % name)
+		weights.append((name, weight))
+	if not sum(weight for name, weight in weights):
+		raise ValueError("The mix has no weight")
+	return weights
+
+def percentile(ordered, fraction):
+	"""The value a fraction of a sorted list is at or below."""
+
+	if not ordered:
+		return 0
+	index = int(round(fraction * (len(ordered) - 1)))
+	return ordered[index]
+
+class Recorder():
+	"""Requests made by every virtual client, by action."""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		# Latencies in seconds, and the count of each status, by action
+		self.latencies = {}
+		self.statuses = {}
+		# Requests that got no decoded reply, by action
+		self.failures = {}
+		# The latest /metrics of each game, by the client polling it
+		self.metrics = {}
+
+	def record(self, action, seconds, status):
+		with self.lock:
+			self.latencies.setdefault(action, []).append(seconds)
+			statuses = self.statuses.setdefault(action, {})
+			statuses[status] = statuses.get(status, 0) + 1
+
+	def fail(self, action, seconds):
+		with self.lock:
+			self.latencies.setdefault(action, []).append(seconds)
+			self.failures[action] = self.failures.get(action, 0) + 1
+
+	def report(self, elapsed):
+		"""The requests and the games' ticks as a dict."""
+
+		actions = {}
+		total = errors = 0
+		for action, latencies in sorted(self.latencies.iteritems()):
+			latencies = sorted(latencies)
+			statuses = self.statuses.get(action, {})
+			failed = self.failures.get(action, 0)
+			# Refusals are the game's rules at work, not the server failing
+			erred = failed + sum(count for status, count in statuses.iteritems()
+				if status not in (200, REFUSED, GAME_OVER))
+			actions[action] = {
+				'requests': len(latencies),
+				'statuses': dict((str(status), count)
+					for status, count in statuses.iteritems()),
+				'failures': failed,
+				'error_rate': erred / float(len(latencies)),
+				'p50': percentile(latencies, .5),
+				'p90': percentile(latencies, .9),
+				'p99': percentile(latencies, .99),
+				'max': latencies[-1],
+			}
+			total += len(latencies)
+			errors += erred
+
+		ticks = sum(stats['ticks']['count'] for stats in self.metrics.values())
+		overruns = sum(stats['overruns'] for stats in self.metrics.values())
+		late = sum(stats.get('scheduler', {}).get('late', 0)
+			for stats in self.metrics.values())
+		return {
+			'seconds': elapsed,
+			'requests': total,
+			'requests_per_sec': total / elapsed if elapsed else 0,
+			'error_rate': errors / float(total) if total else 0,
+			'actions': actions,
+			'games': len(self.metrics),
+			'ticks': ticks,
+			'overruns': overruns,
+			'overrun_rate': overruns / float(ticks) if ticks else 0,
+			'late_ticks': late,
+		}
+
+class VirtualClient():
+	"""One simulated player, making requests on a thread of its own."""
+
+	def __init__(self, Client, endpoint, mix, recorder, seed, binary=False):
+		self.client = Client(endpoint, binary)
+		self.actions = [ACTIONS[name] for name, weight in mix]
+		self.names = [name for name, weight in mix]
+		self.weights = [weight for name, weight in mix]
+		self.recorder = recorder
+		self.rng = random.Random(seed)
+		self.players = []
+		self.opponents = []
+		self.towerSquares = []
+		self.towers = []
+		self.versions = {}
+		self.gameOver = False
+
+	def post(self, path, **payload):
+		payload['id'] = self.client.player_id
+		payload['auth'] = self.client.auth
+		return self.client.post(path, payload)
+
+	def join(self):
+		"""Connects, waiting for the game to start, and looks at the board."""
+
+		self.client.connect()
+		status = self.client.game_status()
+		self.players = [int(player) for player, health in status['players']]
+		self.opponents = [player for player in self.players
+			if player != self.client.player_id] or self.players
+		layout = self.post('/board/%d/layout' % self.client.player_id)
+		paths = set(tuple(square) for square in layout['paths'])
+		base = set(tuple(square) for square in layout['base'])
+		self.towerSquares = sorted(set((x + dx, y + dy) for x, y in paths
+			for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))
+			if 0 <= x + dx < layout['width'] and 0 <= y + dy < layout['height'])
+			- paths - base)
+
+	def play(self, deadline, think, metrics_interval):
+		"""Makes requests until the deadline or the end of the game.
+
+		think -- seconds to wait between requests
+		metrics_interval -- seconds between polls of /metrics, or None not
+		to poll them
+		"""
+
+		nextMetrics = monotonic()
+		while not self.gameOver and monotonic() < deadline:
+			if metrics_interval is not None and monotonic() >= nextMetrics:
+				reply = self.request('metrics',
+					lambda bot: bot.post('/metrics'))
+				if reply is not None and reply.get('status') == 200:
+					with self.recorder.lock:
+						self.recorder.metrics[id(self)] = reply
+				nextMetrics += metrics_interval
+			index = self.choose()
+			self.request(self.names[index], self.actions[index])
+			if think:
+				time.sleep(think)
+
+	def choose(self):
+		point = self.rng.random() * sum(self.weights)
+		for index, weight in enumerate(self.weights):
+			point -= weight
+			if point < 0:
+				return index
+		return len(self.weights) - 1
+
+	def request(self, name, action):
+		start = monotonic()
+		try:
+			reply = action(self)
+		except Exception:
+			# Refused connections, timeouts, replies that aren't JSON
+			self.recorder.fail(name, monotonic() - start)
+			return None
+		status = reply.get('status', 200)
+		self.recorder.record(name, monotonic() - start, status)
+		if status == GAME_OVER:
+			self.gameOver = True
+		return reply
+
+def run(endpoint, clients, mix, seconds, think=0, metrics_interval=1,
+		binary=False, out=sys.stdout):
+	"""Plays the virtual clients against a server.
+
+	Returns the report, see Recorder.report.
+	"""
+
+	Client = load_client()
+	recorder = Recorder()
+	bots = [VirtualClient(Client, endpoint, mix, recorder, "loadgen-%d" % i,
+		binary) for i in range(clients)]
+
+	# Nobody is answered until their game fills up, so everyone connects at
+	# once
+	joiners = [threading.Thread(target=bot.join) for bot in bots]
+	for thread in joiners:
+		thread.daemon = True
+		thread.start()
+	for thread in joiners:
+		thread.join()
+	joined = [bot for bot in bots if bot.players]
+	print >>out, "%d of %d clients joined" % (len(joined), clients)
+
+	start = monotonic()
+	deadline = start + seconds
+	players = [threading.Thread(target=bot.play, args=(deadline, think,
+		metrics_interval if bot.client.player_id == 1 else None))
+		for bot in joined]
+	for thread in players:
+		thread.daemon = True
+		thread.start()
+	for thread in players:
+		thread.join()
+	return recorder.report(monotonic() - start)
+
+def print_report(report, out=sys.stdout):
+	print >>out, "%-10s %9s %8s %9s %9s %9s %9s" % ('action', 'requests',
+		'errors', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms')
+	for action, stats in sorted(report['actions'].iteritems()):
+		print >>out, "%-10s %9d %7.2f%% %9.2f %9.2f %9.2f %9.2f" % (action,
+			stats['requests'], stats['error_rate'] * 100, stats['p50'] * 1000,
+			stats['p90'] * 1000, stats['p99'] * 1000, stats['max'] * 1000)
+	print >>out, "%d requests in %.1fs, %.1f a second, %.2f%% errors" % (
+		report['requests'], report['seconds'], report['requests_per_sec'],
+		report['error_rate'] * 100)
+	print >>out, "%d games, %d ticks, %.2f%% overran, %d started late" % (
+		report['games'], report['ticks'], report['overrun_rate'] * 100,
+		report['late_ticks'])
+
+def main():
+	parser = argparse.ArgumentParser(
+		description='Simulates many clients against a MechMania 18 server.')
+	parser.add_argument('--server', default='localhost:6969',
+		help='Address of the server')
+	parser.add_argument('--clients', type=int, default=100,
+		help='Virtual clients to play, a multiple of %d so every game fills '
+			'up' % GAME_SIZE)
+	parser.add_argument('--mix', default='mixed',
+		help='What the clients do: one of %s, or action=weight pairs like '
+			'"board=4,units=1" with actions from %s' % (
+				', '.join(sorted(MIXES)), ', '.join(sorted(ACTIONS))))
+	parser.add_argument('--seconds', type=float, default=60,
+		help='How long to make requests for, once every game has started')
+	parser.add_argument('--think', type=float, default=0,
+		help='Seconds each client waits between requests')
+	parser.add_argument('--metrics-interval', type=float, default=1,
+		help='Seconds between polls of each game\'s /metrics')
+	parser.add_argument('--binary', action='store_true',
+		help='Talk MessagePack instead of JSON')
+	parser.add_argument('--output',
+		help='File to write the report to as JSON')
+	args = parser.parse_args()
+
+	if args.clients <= 0 or args.clients % GAME_SIZE:
+		parser.error('--clients must be a positive multiple of %d' % GAME_SIZE)
+	try:
+		mix = parse_mix(args.mix)
+	except ValueError, e:
+		parser.error(str(e))
+
+	report = run('http://' + args.server, args.clients, mix, args.seconds,
+		args.think, args.metrics_interval, args.binary)
+	print_report(report)
+	if args.output:
+		with open(args.output, 'w') as reportFile:
+			json.dump(report, reportFile, indent=2, sort_keys=True)
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
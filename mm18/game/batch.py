@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+
+import random
+
+import constants
+from engine import Engine
+
+## @file batch.py
+#  Runs many independent games in one process, without the server.
+#
+#  A strategy plays one player. It is any callable taking
+#  (engine, player_id, rng) that the runner calls once before every tick,
+#  where it can make whatever Engine calls a client could make over HTTP,
+#  such as engine.unit_create or engine.tower_create. rng is a
+#  random.Random seeded from the game's seed, so a batch played twice with
+#  the same seeds gives the same results.
+#
+#  The engines all load their boards through BoardLayout, so they share one
+#  parsed layout per board file.
+
+## Plays one game to the end.
+#  @param strategies A list of strategies, one per player
+#  @param seed The seed for the game's random numbers
+#  @param max_ticks Stop the game after this many ticks even if it isn't over
+#  @return a dict describing the result, see run_batch
+def run_game(strategies, seed, max_ticks=None):
+	engine = Engine(mode=constants.TURBO)
+	players = []
+	for index, strategy in enumerate(strategies):
+		player = engine.add_player(index + 1)
+		rng = random.Random("%s-%d" % (seed, index))
+		players.append((player, strategy, rng))
+
+	while engine.running:
+		if max_ticks is not None and engine.currTick >= max_ticks:
+			break
+		for player, strategy, rng in players:
+			if not player.isDead():
+				strategy(engine, player.name, rng)
+		engine.step()
+
+	return {
+		'seed': seed,
+		'ticks': engine.currTick,
+		'results': dict(engine.results),
+		'players': dict((player.name, {
+			'strategy': strategy_name(strategy),
+			'health': player.health,
+			'resources': player.resources
+		}) for player, strategy, rng in players)
+	}
+
+## Plays one game per seed with the same strategies.
+#  @param strategies A list of strategies, one per player
+#  @param seeds The seeds of the games to play
+#  @param max_ticks Stop each game after this many ticks even if it isn't over
+#  @return a list with a dict per game, in the order of seeds, with the seed,
+#          the number of ticks played, the placements from Engine.results
+#          and each player's strategy name, final health and resources
+def run_batch(strategies, seeds, max_ticks=None):
+	return [run_game(strategies, seed, max_ticks)
+			for seed in seeds]
+
+def strategy_name(strategy):
+	return getattr(strategy, '__name__', repr(strategy))
+
+# Example strategies
+
+## Does nothing.
+def idle(engine, player_id, rng):
+	pass
+
+## Sends a level 0 unit at a random opponent down a random path, the way the
+#  example Python client does.
+def random_attacker(engine, player_id, rng):
+	targets = [other for other in engine.get_player_ids()
+			if other != player_id and not engine.get_player(other).isDead()]
+	if targets:
+		engine.unit_create(player_id, 0, 0, rng.choice(targets),
+				rng.choice(constants.DIRECTIONS))
+
+## Builds towers on random squares next to its paths and upgrades them when
+#  it can.
+def tower_builder(engine, player_id, rng):
+	player = engine.get_player(player_id)
+	board = player.board
+	towers = board.getTowers()
+	if towers and rng.random() < 0.5:
+		tower = towers[rng.choice(towers.keys())]
+		if tower.upgrade <= player.allowedUpgrade:
+			engine.tower_upgrade(tower.ID, player_id)
+	else:
+		x, y = rng.choice(board.path)
+		position = (x + rng.choice((-1, 1)), y)
+		if board.validPosition(position):
+			engine.tower_create(player_id, position)
@@ -0,0 +1,349 @@
+#! /usr/bin/env python
+
+import bisect
+import json
+import mmap
+import struct
+
+import constants
+
+## @file binary_log.py
+#  A compact binary game log, holding the same actions as the JSON one.
+#
+#  The log starts with MAGIC, followed by one record per action. A record is
+#  a byte saying which action it is, then the action's fields in the order
+#  RECORDS lists them. Each field is a type byte and the value: integers as
+#  varints, strings as their UTF-8 length and bytes, lists as their length
+#  and items. Consecutive advances with nothing in between are one ADVANCE
+#  record of the first tick and how many ticks there are, so the quiet
+#  stretches of a game take a few bytes rather than a line per tick. An
+#  action the format doesn't know is kept as a JSON record.
+#
+#  The records end with an index of where the log is at every
+#  LOG_INDEX_INTERVAL ticks or so, as the number of entries and each entry's
+#  tick and offset in the file, both as the difference from the entry before.
+#  The file ends with TRAILER, the offset of the index and MAGIC again. A log
+#  cut short, by a crash say, has no index, and is read up to the last whole
+#  record.
+
+MAGIC = 'MM18LOG\x01'
+TRAILER = struct.Struct('<Q8s')
+
+# The file name suffix the engine writes binary logs for
+BINARY_LOG_SUFFIX = '.mmlog'
+
+JSON_RECORD = 0
+ADVANCE = 1
+# Record types by action, with the fields they hold
+RECORDS = {
+	'start': (2, ('tick',)),
+	'add_player': (3, ('id',)),
+	'tower_create': (4, ('owner_id', 'coords')),
+	'tower_sell': (5, ('tower_id', 'owner_id')),
+	'tower_specialize': (6, ('tower_id', 'owner_id', 'spec')),
+	'tower_upgrade': (7, ('tower_id', 'owner_id')),
+	'unit_create': (8, ('owner_id', 'level', 'spec', 'target_id',
+		'direction')),
+}
+_ACTIONS = dict((code, (action, fields))
+	for action, (code, fields) in RECORDS.iteritems())
+
+# Field types
+_INT = 0
+_NEGATIVE_INT = 1
+_STRING = 2
+_LIST = 3
+_NONE = 4
+_TRUE = 5
+_FALSE = 6
+_FLOAT = 7
+
+_double = struct.Struct('<d')
+
+def _varint(n, write):
+	while n >= 0x80:
+		write(chr(n & 0x7f | 0x80))
+		n >>= 7
+	write(chr(n))
+
+def _value(value, write):
+	if value is None:
+		write(chr(_NONE))
+	elif value is True:
+		write(chr(_TRUE))
+	elif value is False:
+		write(chr(_FALSE))
+	elif isinstance(value, (int, long)):
+		if value >= 0:
+			write(chr(_INT))
+			_varint(value, write)
+		else:
+			write(chr(_NEGATIVE_INT))
+			_varint(-value - 1, write)
+	elif isinstance(value, float):
+		write(chr(_FLOAT))
+		write(_double.pack(value))
+	elif isinstance(value, basestring):
+		if isinstance(value, unicode):
+			value = value.encode('utf-8')
+		write(chr(_STRING))
+		_varint(len(value), write)
+		write(value)
+	elif isinstance(value, (list, tuple)):
+		write(chr(_LIST))
+		_varint(len(value), write)
+		for item in value:
+			_value(item, write)
+	else:
+		raise TypeError("Can't log %r" % (value,))
+
+def _read_varint(data, offset):
+	n = 0
+	shift = 0
+	while True:
+		byte = ord(data[offset])
+		offset += 1
+		n |= (byte & 0x7f) << shift
+		if byte < 0x80:
+			return (n, offset)
+		shift += 7
+
+def _read_value(data, offset):
+	kind = ord(data[offset])
+	offset += 1
+	if kind == _INT:
+		return _read_varint(data, offset)
+	elif kind == _NEGATIVE_INT:
+		n, offset = _read_varint(data, offset)
+		return (-n - 1, offset)
+	elif kind == _STRING:
+		length, offset = _read_varint(data, offset)
+		end = offset + length
+		if end > len(data):
+			raise IndexError("string runs past the end")
+		return (data[offset:end].decode('utf-8'), end)
+	elif kind == _LIST:
+		length, offset = _read_varint(data, offset)
+		items = []
+		for i in xrange(length):
+			item, offset = _read_value(data, offset)
+			items.append(item)
+		return (items, offset)
+	elif kind == _NONE:
+		return (None, offset)
+	elif kind == _TRUE:
+		return (True, offset)
+	elif kind == _FALSE:
+		return (False, offset)
+	elif kind == _FLOAT:
+		return (_double.unpack(data[offset:offset + 8])[0], offset + 8)
+	raise ValueError("Unknown field type %d" % kind)
+
+
+## Encodes log entries as a binary log, for a LogWriter.
+#  Advances are held back until something else happens, to be written as
+#  one record, so the bytes returned lag behind the entries given.
+class BinaryLogEncoder(object):
+
+	## @param index_interval Least ticks between entries in the index
+	def __init__(self, index_interval=constants.LOG_INDEX_INTERVAL):
+		self.index_interval = index_interval
+		# Where the log is, in bytes and in ticks
+		self.offset = 0
+		self.tick = 0
+		self.index = []
+		self._chunks = [MAGIC]
+		self._pending = len(MAGIC)
+		self._run = None
+
+	## Encodes entries.
+	#  @param entries A list of entry dicts, like Engine.log_action makes
+	#  @return the bytes to write
+	def encode(self, entries):
+		for entry in entries:
+			action = entry.get('action')
+			if action == 'advance' and self._continues_run(entry):
+				if self._run is None:
+					self._run = [entry['tick'], 1]
+				else:
+					self._run[1] += 1
+				continue
+			self._end_run()
+			self._record(entry)
+		return self._take()
+
+	## Encodes any held back advances.
+	#  @return the bytes to write
+	def flush(self):
+		self._end_run()
+		return self._take()
+
+	## Finishes the log with its index.
+	#  @return the last bytes to write
+	def finish(self):
+		self._end_run()
+		index_offset = self.offset + self._pending
+		write = self._chunks.append
+		_varint(len(self.index), write)
+		lastTick = lastOffset = 0
+		for tick, offset in self.index:
+			_varint(tick - lastTick, write)
+			_varint(offset - lastOffset, write)
+			lastTick, lastOffset = tick, offset
+		write(TRAILER.pack(index_offset, MAGIC))
+		return self._take()
+
+	def _continues_run(self, entry):
+		tick = entry.get('tick')
+		if len(entry) != 2 or not isinstance(tick, (int, long)):
+			return False
+		if self._run is None:
+			return tick == self.tick + 1
+		return tick == self._run[0] + self._run[1]
+
+	def _end_run(self):
+		if self._run is None:
+			return
+		first, count = self._run
+		self._run = None
+		chunks = [chr(ADVANCE)]
+		_varint(first, chunks.append)
+		_varint(count, chunks.append)
+		self._add(chunks)
+		self.tick = first + count - 1
+
+	def _record(self, entry):
+		chunks = []
+		write = chunks.append
+		action = entry.get('action')
+		code, fields = RECORDS.get(action, (None, ()))
+		if code is not None and len(entry) == len(fields) + 1 and \
+				all(field in entry for field in fields):
+			write(chr(code))
+			for field in fields:
+				_value(entry[field], write)
+		else:
+			write(chr(JSON_RECORD))
+			_value(json.dumps(entry), write)
+		self._add(chunks)
+		if action in ('start', 'advance') and \
+				isinstance(entry.get('tick'), (int, long)):
+			self.tick = entry['tick']
+
+	# Adds a record, and an index entry for where it starts if one is due
+	def _add(self, chunks):
+		if not self.index or \
+				self.tick >= self.index[-1][0] + self.index_interval:
+			self.index.append((self.tick, self.offset + self._pending))
+		record = ''.join(chunks)
+		self._chunks.append(record)
+		self._pending += len(record)
+
+	def _take(self):
+		data = ''.join(self._chunks)
+		self._chunks = []
+		self._pending = 0
+		self.offset += len(data)
+		return data
+
+
+## Whether a file is a binary log.
+def is_binary_log(path):
+	with open(path, 'rb') as log:
+		return log.read(len(MAGIC)) == MAGIC
+
+
+## A binary log, read through mmap so only the parts read are loaded.
+class BinaryLog(object):
+
+	## Opens a log.
+	#  Raises ValueError if the file isn't a binary log.
+	def __init__(self, path):
+		with open(path, 'rb') as log:
+			try:
+				self._data = mmap.mmap(log.fileno(), 0,
+						access=mmap.ACCESS_READ)
+			except ValueError:
+				# Empty files can't be mapped
+				raise ValueError("%s is not a binary log" % path)
+		if self._data[:len(MAGIC)] != MAGIC:
+			self._data.close()
+			raise ValueError("%s is not a binary log" % path)
+		self._end, self.index = self._read_index()
+		# Whether the log was finished with its index, rather than cut short
+		self.complete = self._end != len(self._data)
+
+	## The actions in the log, as the entry dicts they were logged as.
+	#  @param tick Only the actions after the game reached this tick
+	#  @return an iterator of the entries
+	def entries(self, tick=0):
+		position = bisect.bisect_right(self.index, (tick, len(self._data)))
+		if position:
+			current, offset = self.index[position - 1]
+		else:
+			current, offset = (0, len(MAGIC))
+		return self._entries(offset, current, tick)
+
+	def close(self):
+		self._data.close()
+
+	def _entries(self, offset, current, tick):
+		data = self._data
+		end = self._end
+		while offset < end:
+			try:
+				entries, offset = self._read_record(data, offset)
+			except (IndexError, ValueError, struct.error):
+				# The end of a log cut short
+				return
+			for entry in entries:
+				action = entry['action']
+				if action == 'advance':
+					current = entry['tick']
+					if current <= tick:
+						continue
+				elif action == 'start':
+					current = entry['tick']
+				if current >= tick:
+					yield entry
+
+	def _read_record(self, data, offset):
+		code = ord(data[offset])
+		offset += 1
+		if code == ADVANCE:
+			first, offset = _read_varint(data, offset)
+			count, offset = _read_varint(data, offset)
+			if offset > len(data):
+				raise IndexError("record runs past the end")
+			return ([{'action': u'advance', 'tick': tick}
+					for tick in xrange(first, first + count)], offset)
+		elif code == JSON_RECORD:
+			encoded, offset = _read_value(data, offset)
+			return ([json.loads(encoded)], offset)
+		elif code in _ACTIONS:
+			action, fields = _ACTIONS[code]
+			entry = {'action': unicode(action)}
+			for field in fields:
+				entry[field], offset = _read_value(data, offset)
+			if offset > len(data):
+				raise IndexError("record runs past the end")
+			return ([entry], offset)
+		raise ValueError("Unknown record type %d" % code)
+
+	def _read_index(self):
+		data = self._data
+		if len(data) < len(MAGIC) + TRAILER.size:
+			return (len(data), [])
+		index_offset, magic = TRAILER.unpack(data[-TRAILER.size:])
+		if magic != MAGIC or index_offset > len(data) - TRAILER.size:
+			return (len(data), [])
+		count, offset = _read_varint(data, index_offset)
+		index = []
+		tick = position = 0
+		for i in xrange(count):
+			tickDelta, offset = _read_varint(data, offset)
+			offsetDelta, offset = _read_varint(data, offset)
+			tick += tickDelta
+			position += offsetDelta
+			index.append((tick, position))
+		return (index_offset, index)
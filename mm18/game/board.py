@@ -1,11 +1,11 @@
 #! /usr/bin/env python
 
 import constants
-import json
-import os
-from collections import deque, defaultdict
+from collections import defaultdict, deque
 from path import Path
-import itertools
+from layout import BoardLayout
+from tower import Tower
+from units import Unit
 
 ## @file board.py
 
@@ -21,147 +21,76 @@ class Board:
 	#  The base list contains the tuple locations of the base - unordered.
 	#  The path list contains the tuple locations of the path,
 	#  ordered starting with those closest to the base and working outwards.
+	#  Both lists come from the board's BoardLayout, which may be shared with
+	#  other boards, so the board only owns its towers and units.
 	#  @param base A list of tuples that represent the base location
 	#  @param path A list of tuples that represent the path locations (ordered in orderPathsByClosest method)
 	#  @param width An optional arguement, the width of the board
 	#  @param height An optional arguement, the height of the board
-	def __init__(self, base, path, width=constants.BOARD_SIDE, height=constants.BOARD_SIDE):
-		self.base = base
-		self.path = self.orderPathSquaresByClosest(base, path)
+	#  @param layout An optional BoardLayout to use instead of building one
+	#  from base and path
+	def __init__(self, base, path, width=constants.BOARD_SIDE, height=constants.BOARD_SIDE, layout=None):
+		if layout is None:
+			layout = BoardLayout(base, path, width, height)
+		self.layout = layout
+
+		self.base = layout.base
+		self.path = layout.path
 		
-		self.width = width
-		self.height = height
+		self.width = layout.width
+		self.height = layout.height
 		
 		self.tower = {}
+		# Tower positions by tower ID, kept alongside self.tower
+		self.towerPositions = {}
 		self.hitList = defaultdict(list)
+		# Towers are appended to all their hitList buckets at once, so every
+		# bucket is in the order given by the count of towers added so far
+		# when each was last added, which is kept as the tower's hitOrder
+		self.hitCount = 0
+
+		self.coverage = layout.coverage
+		self.startPos = layout.startPos
 
-		self.startPos = 4*[None]
-		for x,y in self.path:
-			if y is 0:
-				self.startPos[constants.NORTH] = (x,y)
-			elif x is self.width - 1:
-				self.startPos[constants.EAST] = (x,y)
-			elif y is self.height - 1:
-				self.startPos[constants.SOUTH] = (x,y)
-			elif x is 0:
-				self.startPos[constants.WEST] = (x,y)
-
-		pathList = self.findPaths()
 		self.paths={}
-		# The Path class takes paths starting at the base, so reverse
-		for path in pathList:
-			if path is not None:
-				path.reverse()
 		for direction in constants.DIRECTIONS:
-			self.paths[direction]=Path(pathList[direction])
-		
+			self.paths[direction]=Path(layout.basePaths[direction])
+
+		# The version is bumped by every change to the towers or units, so
+		# clients can ask for what changed since a version. Each tower
+		# remembers the version it last changed at, sold towers the version
+		# they were removed at.
+		self.version = 0
+		self.towerVersions = {}
+		self.removedTowers = {}
+		self.unitsVersion = 0
+		self._hadUnits = False
+
+	## Creates an empty board on a layout.
+	#  @param layout The BoardLayout to use
+	@staticmethod
+	def fromLayout(layout):
+		return Board(layout.base, layout.path, layout=layout)
 
-	## Reads in json for the board layout from a file and sorts it into two lists
-	#  one for base positions and the other for path positions
+	## Creates an empty board from a board file.
+	#  The file is only read the first time, later boards share its layout.
+	#  @param filename The board file, relative to this package
 	@staticmethod
 	def jsonLoad(filename):
-		filePath = os.path.join(os.path.dirname(__file__), filename)
-		data =json.load(open(filePath))
-		
-		bases = data['bases']
-		baseList = [tuple(pair) for pair in bases]
-		
-		paths = data['paths']
-		pathList = [tuple(pair) for pair in paths]
-		
-		width = data['width']
-		height = data['height']
-
-		return Board(baseList, pathList)
+		return Board.fromLayout(BoardLayout.load(filename))
 
-	## Breadth-first search method that takes the unordered list of path locations
-	#  and sorts them by how far from the base they are.
+	## Sorts the unordered list of path locations by how far from the base
+	#  they are, see BoardLayout.orderPathSquaresByClosest.
 	#  @param baseList A list that contains the base locations
 	#  @param pathList A list that contains the paths to the base in no order
 	def orderPathSquaresByClosest(self, baseList, pathList):
-		pathQueue = deque(baseList)
-		outPath = []
-		while pathQueue:
-			x,y = pathQueue.popleft()
-			if (x,y) not in outPath:
-				if (x, y + 1) in pathList:
-					pathQueue.append((x, y + 1))
-				if (x, y - 1) in pathList:
-					pathQueue.append((x, y - 1))
-				if (x + 1, y) in pathList:
-					pathQueue.append((x + 1, y))
-				if (x - 1, y) in pathList:
-					pathQueue.append((x - 1, y))
-				if (x,y) not in baseList:
-					outPath.append((x,y))
-		return outPath
-
-	## Depth-first search method that uses a list of path locations to build a
-	#  list of paths, where each path starts at a starting path square (on the
-	#  edge of the board) and ends at the base.
-	#  TODO: make sure that paths end at a base
-	def findPaths(self):
-		paths = []
-		
-		northStack = self.startPos[constants.NORTH]
-		eastStack = self.startPos[constants.EAST]
-		southStack = self.startPos[constants.SOUTH]
-		westStack = self.startPos[constants.WEST]
-		
-		if northStack:
-			self.findPathsRecurse([northStack], paths)
-		else:
-			paths.append(None)
-		if eastStack:
-			self.findPathsRecurse([eastStack], paths)
-		else:
-			paths.append(None)
-		if southStack:
-			self.findPathsRecurse([southStack], paths)
-		else:
-			paths.append(None)
-		if westStack:
-			self.findPathsRecurse([westStack], paths)
-		else:
-			paths.append(None)
+		return BoardLayout.orderPathSquaresByClosest(baseList, frozenset(pathList))
 
-		return paths
-	
-	## The helper function to findPaths, it actually travels down the paths via a
-	#  depth first search and adds a completed path the the paths list when it
-	#  cannot go any farther.
-	def findPathsRecurse(self, pathStack, paths):
-		pathEnds = True
-		x,y = pathStack[-1]
-		north = (x, y+1)
-		if north not in pathStack and north in self.path:
-			pathEnds = False
-			pathStack.append(north)
-			self.findPathsRecurse(pathStack, paths)
-
-		east = (x+1, y)
-		if east not in pathStack and east in self.path:
-			pathEnds = False
-			pathStack.append(east)
-			self.findPathsRecurse(pathStack, paths)
-		
-		south = (x, y-1)
-		if south not in pathStack and south in self.path:
-			pathEnds = False
-			pathStack.append(south)
-			self.findPathsRecurse(pathStack, paths)
-		
-		west = (x-1, y)
-		if west not in pathStack and west in self.path:
-			pathEnds = False
-			pathStack.append(west)
-			self.findPathsRecurse(pathStack, paths)
-		
-		if pathEnds:
-			paths.append(pathStack[:])
-		
-		pathStack.pop()
-		return paths
+	## A list of paths, where each path starts at a starting path square (on
+	#  the edge of the board) and ends at the base.
+	def findPaths(self):
+		return [list(path) if path is not None else None
+				for path in self.layout.edgePaths]
 
 	## Check whether the position of the object being inserted is a valid placement on the board.
 	#  Will contain error handling for invalid positions.
@@ -169,13 +98,8 @@ class Board:
 	def validPosition(self, position):
 		x,y=position
 		
-		for house in self.base:
-			if house==(x,y):
-				return 0
-
-		for road in self.path:
-			if road==(x,y):
-				return 0
+		if (x,y) in self.layout.baseSet or (x,y) in self.layout.pathSet:
+			return 0
 
 		if position in self.tower:
 			return 0
@@ -187,9 +111,11 @@ class Board:
 	#  @param item An object, most likely a tower
 	#  @param position A tuple for the position of the object
 	def addItem(self, item, position):
-		if self.validPosition(position) and self.getItem(position) == None and position not in self.base and position not in self.path:
+		if self.validPosition(position) and self.getItem(position) == None:
 			self.tower[position] = item
 			self.addToHitList(item, position)
+			self.towerPositions[item.ID] = position
+			self.towerChanged(item)
 			return True
 		else:
 			return False
@@ -206,51 +132,70 @@ class Board:
 	#  @param position A tuple containing object position
 	def removeItem(self, position):
 		if self.getItem(position) != None:
-			self.removeFromHitList(self.tower[position])
-			del self.tower[position]
-			
+			item = self.tower.pop(position)
+			self.removeFromHitList(item)
+			del self.towerPositions[item.ID]
+			del self.towerVersions[item.ID]
+			self.removedTowers[item.ID] = self.bumpVersion()
+
+	## Starts a new version of the board.
+	#  @return the new version
+	def bumpVersion(self):
+		self.version += 1
+		return self.version
+
+	## Marks a tower on the board as changed, such as by an upgrade.
+	#  @param tower The tower
+	def towerChanged(self, tower):
+		self.towerVersions[tower.ID] = self.bumpVersion()
+
+	## Marks the units as changed after they moved, unless there were none
+	#  to move.
+	#  @param hasUnits Whether there are units on the board now
+	def unitsMoved(self, hasUnits):
+		if hasUnits or self._hadUnits:
+			self.unitsVersion = self.bumpVersion()
+		self._hadUnits = hasUnits
 
 	## Adds a tower to all the appropriate places of the hitList
+	#  The tower remembers the buckets it was added to, so it can be removed
+	#  again without searching the whole hitList.
 	#  @param self The board
 	#  @param tower The tower to add to the hitList
 	def addToHitList(self, tower, position):
-		tX, tY = position
-
-		tXLower = tX - constants.TOWER_RANGE[tower.upgrade]
-		if tXLower < 0:
-			tXLower = 0
-
-		tXUpper = tX + constants.TOWER_RANGE[tower.upgrade]
-		if tXUpper >= constants.BOARD_SIDE:
-			txUpper = constants.BOARD_SIDE - 1
-
-		tYLower = tY - constants.TOWER_RANGE[tower.upgrade]
-		if tYLower < 0:
-			tYLower = 0
-
-		tYUpper = tY + constants.TOWER_RANGE[tower.upgrade]
-		if tYUpper >= constants.BOARD_SIDE:
-			tYUpper = constants.BOARD_SIDE - 1
-		
-		for elem in self.path:
-			elemX, elemY = elem
-			if elemX >= tXLower and elemX <= tXUpper:
-				if elemY >= tYLower and elemY <= tYUpper:
-					self.hitList[elem].append(tower)
+		towerRange = constants.TOWER_RANGE[tower.upgrade]
+		squares = self.coverage.get((position, towerRange))
+		if squares is None:
+			squares = BoardLayout.coveredSquares(self.path, position, towerRange)
+
+		for elem in squares:
+			bucket = self.hitList[elem]
+			bucket.append(tower)
+			tower.hitBuckets.append(bucket)
+		tower.hitOrder = self.hitCount
+		self.hitCount += 1
 
 	## Removes a certain tower from all places of the hitlist
 	#  @param self The board
 	#  @param tower The tower to be removed
 	def removeFromHitList(self, tower):
-		for elem, i in self.hitList.iteritems():
-			if tower in self.hitList[elem]:
-				self.hitList[elem].remove(tower)
+		for bucket in tower.hitBuckets:
+			bucket.remove(tower)
+		tower.hitBuckets = []
+
+	## Re-adds a tower to the hitList, after its range may have changed.
+	#  This also moves the tower to the back of every bucket it sits in.
+	#  @param tower The tower to refresh
+	#  @param position A tuple for the position of the tower
+	def refreshHitList(self, tower, position):
+		self.removeFromHitList(tower)
+		self.addToHitList(tower, position)
 	
+	## Gets the position of a tower on this board
+	#  @param tower_id The ID of the tower
+	#  @return A tuple for the position of the tower or None if it isn't here
 	def getTowerPosition(self, tower_id):
-		for pos, tower in self.tower.iteritems():
-			if tower.ID == tower_id:
-				return pos
-		return None
+		return self.towerPositions.get(tower_id)
 
 	## Goes through the paths, and if there is an enemy unit, attack it.
 	#  @param self The board
@@ -258,25 +203,32 @@ class Board:
 	def fireTowers(self):
 		attacks = []
 		deaths = []
+		if not self.tower:
+			return attacks, deaths
 		used = set()
-		for pos, unit in self.units():
-			for tower in self.hitList[pos]:
-				if unit.health <= 0:
-					break
-				if tower not in used:
-					used.add(tower)
-					tower.fire(unit)
-					attacks.append({
-						'tower': tower,
-						'tower_pos': self.getTowerPosition(tower.ID),
-						'unit': unit,
-						'unit_pos': pos
-					})
+		for direction in constants.DIRECTIONS:
+			path = self.paths[direction]
+			if not path.occupants:
+				continue
+			for pos, unit in path.units():
+				for tower in self.hitList[pos]:
 					if unit.health <= 0:
-						deaths.append({
+						break
+					if tower not in used:
+						used.add(tower)
+						tower.fire(unit)
+						attacks.append({
+							'tower': tower,
+							'tower_pos': self.towerPositions[tower.ID],
 							'unit': unit,
 							'unit_pos': pos
 						})
+						if unit.health <= 0:
+							deaths.append({
+								'unit': unit,
+								'unit_pos': pos
+							})
+							path.remove(unit)
 		return attacks, deaths
 
 	## Queue's the unit at the entrance of the path it is supposed to take.
@@ -289,18 +241,16 @@ class Board:
 				return True
 		return False
 
-	## Return a generator of pairs of unit and position on the board,
-	#  in order of increasing distance from the base
+	## Return a list of pairs of position and unit on the board, path by
+	#  path, in order of increasing distance from the base.
+	#  Units killed on the way are taken off their path, so they are left
+	#  out. Only the paths with units on are looked at.
 	def units(self):
-
 		units = []
-		
 		for direction in constants.DIRECTIONS:
-			path= self.paths[direction]
-			for x in range (0, len(path.path)):
-				if(path.moving[x] != None):
-					units.append((path.path[x], path.moving[x]))
-
+			path = self.paths[direction]
+			if path.occupants:
+				units.extend(path.units())
 		return units
 
 	def get_adjacent(self, pos, choices):
@@ -316,16 +266,93 @@ class Board:
 	# @return: damage to be dealt to the player
 	def moveUnits(self):
 		units = []
+		hasUnits = False
 		for path in self.paths.itervalues():
 			unit = path.advance()
-			pos = self.get_adjacent(path.path[0], self.base)
 			if unit is not None and unit.health > 0:
 				units.append({
 					'unit': unit,
-					'base_pos': pos
+					'base_pos': self.get_adjacent(path.path[0], self.base)
 				})
+			hasUnits = hasUnits or bool(path.occupants)
+		self.unitsMoved(hasUnits)
 		return units
 
 	## Return the tower list
 	def getTowers(self):
 		return self.tower
+
+	## The state of the towers and units on the board, for Engine.snapshot.
+	#  @return a tuple of the towers in hitList order as (ID, position,
+	#          upgrade, specialisation, cost), the paths by direction as
+	#          (direction, moving, waiting) where moving is None for a
+	#          direction without a path or each slot's unit or None, and
+	#          waiting the queued units, with each unit as (owner, level,
+	#          specialisation, health), then the board's versions
+	def snapshot(self):
+		towers = sorted(self.tower.iteritems(),
+				key=lambda (position, tower): tower.hitOrder)
+		paths = []
+		for direction in constants.DIRECTIONS:
+			path = self.paths[direction]
+			moving = None
+			if path.moving is not None:
+				moving = tuple(unitState(unit) if unit is not None else None
+						for unit in path.moving)
+			paths.append((direction, moving,
+					tuple(unitState(unit) for unit in path.waiting)))
+		return (tuple((tower.ID, position, tower.upgrade,
+					tower.specialisation, tower.cost)
+					for position, tower in towers),
+				tuple(paths),
+				(self.version, tuple(sorted(self.towerVersions.iteritems())),
+					tuple(sorted(self.removedTowers.iteritems())),
+					self.unitsVersion, self._hadUnits))
+
+	## Puts back the towers and units from a snapshot on an empty board.
+	#  @param state The board's state from snapshot
+	#  @param owner The Player owning the board
+	#  @param players The Players units may belong to, by name
+	def restore(self, state, owner, players):
+		towers, paths, versions = state
+		for ID, position, upgrade, specialisation, cost in towers:
+			tower = Tower(owner, ID)
+			tower.upgrade = upgrade
+			tower.specialisation = specialisation
+			tower.cost = cost
+			self.addItem(tower, position)
+
+		for direction, moving, waiting in paths:
+			path = self.paths[direction]
+			if moving is not None:
+				path.moving = deque(restoreUnit(unit, players)
+						if unit is not None else None for unit in moving)
+			path.waiting = deque(restoreUnit(unit, players)
+					for unit in waiting)
+		self.unitsPlaced()
+
+		version, towerVersions, removedTowers, unitsVersion, hadUnits = \
+				versions
+		self.version = version
+		self.towerVersions = dict(towerVersions)
+		self.removedTowers = dict(removedTowers)
+		self.unitsVersion = unitsVersion
+		self._hadUnits = hadUnits
+
+	## Called after the units on the paths were replaced, by restore.
+	def unitsPlaced(self):
+		for path in self.paths.itervalues():
+			path.placed()
+
+## The state of a unit, see Board.snapshot.
+def unitState(unit):
+	return (unit.owner, unit.level, unit.specialisation, unit.health)
+
+## Recreates a unit from its state.
+#  @param state The unit's state from unitState
+#  @param players The Players by name, to find the unit's owner in
+def restoreUnit(state, players):
+	owner, level, specialisation, health = state
+	unit = Unit(level, specialisation, players[owner])
+	unit.health = health
+	return unit
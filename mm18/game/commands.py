@@ -0,0 +1,100 @@
+#! /usr/bin/env python
+
+import sys
+import threading
+import traceback
+
+## @file commands.py
+#  Commands queued for the engine thread to run.
+#
+#  Anything that changes the game from outside the engine, like a client
+#  building a tower, is queued on the Engine as a command rather than made
+#  directly from the thread that wants it. The engine runs the queued
+#  commands at the start of each tick, in the order they were queued, so
+#  nothing changes the boards while a tick is played. Whoever queued the
+#  command gets a CommandFuture to wait on for its result.
+
+
+## Raised by a command the engine will never run, because the game ended.
+class EngineStopped(Exception):
+	pass
+
+
+## The result of a queued command, filled in once the engine has run it.
+class CommandFuture(object):
+
+	## Creates a future for calling func(*args).
+	def __init__(self, func, args):
+		self.func = func
+		self.args = args
+		self._condition = threading.Condition()
+		self._done = False
+		self._result = None
+		self._exc_info = None
+		self._callbacks = []
+
+	## Runs the command, on the engine thread.
+	def run(self):
+		try:
+			result = self.func(*self.args)
+		except Exception:
+			self.set_exception(sys.exc_info())
+		else:
+			self.set_result(result)
+
+	## Whether the command has run or failed.
+	def done(self):
+		return self._done
+
+	## Waits for the command to run.
+	#  @param timeout Seconds to wait, or None to wait as long as it takes
+	#  @return what the command returned, or raises what it raised
+	def result(self, timeout=None):
+		with self._condition:
+			if not self._done:
+				self._condition.wait(timeout)
+			if not self._done:
+				raise RuntimeError("Command did not run in time")
+		if self._exc_info is not None:
+			raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+		return self._result
+
+	## Calls fn with this future once it is done, on the thread finishing it,
+	#  or straight away if it already is.
+	def add_done_callback(self, fn):
+		with self._condition:
+			if not self._done:
+				self._callbacks.append(fn)
+				return
+		self._call(fn)
+
+	def set_result(self, result):
+		self._finish(result, None)
+
+	## Fails the command.
+	#  @param exc_info The exception, or a sys.exc_info() tuple to keep its
+	#  traceback
+	def set_exception(self, exc_info):
+		if not isinstance(exc_info, tuple):
+			exc_info = (type(exc_info), exc_info, None)
+		self._finish(None, exc_info)
+
+	def _finish(self, result, exc_info):
+		with self._condition:
+			if self._done:
+				return
+			self._result = result
+			self._exc_info = exc_info
+			self._done = True
+			callbacks = self._callbacks
+			self._callbacks = []
+			self._condition.notify_all()
+		for fn in callbacks:
+			self._call(fn)
+
+	def _call(self, fn):
+		# A broken callback mustn't take the engine thread down with it
+		try:
+			fn(self)
+		except Exception:
+			traceback.print_exc()
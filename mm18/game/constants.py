@@ -7,6 +7,41 @@ TICK_TIME = .01
 # Currently set to 2 minutes
 MAX_RUNTIME = 2 * 60 * 100
 
+"""Engine run modes"""
+# Play a tick every TICK_TIME, so a game lasts MAX_RUNTIME * TICK_TIME
+REALTIME = 'realtime'
+# Advance as fast as the CPU allows, for batch and regression runs
+TURBO = 'turbo'
+# Advance once every living player has acknowledged the current tick
+LOCKSTEP = 'lockstep'
+ENGINE_MODES = [REALTIME, TURBO, LOCKSTEP]
+
+"""Realtime tick policies, for ticks that run late"""
+# Play the late ticks back to back until the game is back on time
+CATCH_UP = 'catchup'
+# Drop the late ticks and wait for the next one due
+SKIP = 'skip'
+# Slow the game down to the pace the ticks are taking
+DEGRADE = 'degrade'
+TICK_POLICIES = [CATCH_UP, SKIP, DEGRADE]
+TICK_POLICY = CATCH_UP
+# Most late ticks played back to back before the rest are dropped
+MAX_CATCH_UP = 10
+# Longest time, in seconds, lockstep waits for acknowledgements on a tick
+LOCKSTEP_TIMEOUT = 1
+# Most commands that can wait for the next tick before new ones are refused
+COMMAND_QUEUE_SIZE = 1024
+# Ticks kept for clients subscribed to a game to catch up on
+TICK_FEED_SIZE = 256
+# Most log entries waiting to be written before the engine waits for the disk
+LOG_QUEUE_SIZE = 65536
+# Least time, in seconds, between fsyncs of the game log
+LOG_FSYNC_INTERVAL = 1
+# Least ticks between the entries in a binary log's index
+LOG_INDEX_INTERVAL = 100
+# Ticks between the checkpoints a replay keeps to seek with
+CHECKPOINT_INTERVAL = 500
+
 """TOWERS"""
 BASE_TOWER_DAMAGE = 1
 # Maximum upgrade level for towers and units
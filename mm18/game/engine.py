@@ -3,30 +3,48 @@
 import json
 import time
 import threading
+import Queue
 
 import constants
 from board import Board
+from commands import CommandFuture, EngineStopped
+from tick_feed import TickFeed
+from response_cache import ResponseCache
+from log_writer import LogWriter
+from metrics import EngineMetrics, STATS_SUFFIX
 from player import Player
+from scheduler import TickScheduler
 from units import Unit
 
 class Engine():
 
 	@staticmethod
-	def spawn_game(players, game_log):
+	def spawn_game(players, game_log, mode=constants.REALTIME,
+			policy=constants.TICK_POLICY):
 		log = None
+		stats = None
 		if game_log != None and game_log != "":
-			log = open(game_log, "w+")
-		engine = Engine(log)
+			log = LogWriter(game_log)
+			stats = game_log + STATS_SUFFIX
+		engine = Engine(log, mode, stats_file=stats, policy=policy)
 		for player in players:
 			engine.add_player(player)
 		engine.log_start()
 
 		thread = threading.Thread(target=engine.run)
+		engine.thread = thread
 		thread.start()
 		return engine
 
-	def __init__(self, log_file=None):
+	def __init__(self, log_file=None, mode=constants.REALTIME, stats_file=None,
+			policy=constants.TICK_POLICY):
+		if mode not in constants.ENGINE_MODES:
+			raise ValueError("Unknown engine mode: %s" % mode)
+		# Written from a thread of its own, so logging never waits on disk
+		if log_file is not None and not isinstance(log_file, LogWriter):
+			log_file = LogWriter(log_file)
 		self.log_file = log_file
+		self.mode = mode
 
 		#generate players and boards
 		self.players = {}
@@ -41,12 +59,41 @@ class Engine():
 		#a unique identifier
 		self.currID = 0
 
+		# Every standing tower by ID, as a tuple (owner id, position, tower)
+		self.towers = {}
+
+		# Held while a tick is played or commands are run, so anything
+		# reading the game from another thread sees it between ticks
+		self.lock = threading.RLock()
+
+		# Commands waiting for the start of the next tick, and the thread
+		# running the game that runs them
+		self.commands = Queue.Queue(constants.COMMAND_QUEUE_SIZE)
+		self.thread = None
+
+		# The ticks played, for clients subscribed to the game
+		self.feed = TickFeed()
+
+		# Encoded responses to clients' requests, see game_controller
+		self.responses = ResponseCache()
+
+		# How long ticks take, written to stats_file when the game ends
+		self.metrics = EngineMetrics()
+		self.stats_file = stats_file
+
+		# When each tick starts in realtime mode, and what happens when
+		# ticks run late
+		self.scheduler = TickScheduler(policy=policy)
+
+		# The last tick each player acknowledged, by name, used by lockstep
+		self._acked = {}
+		self._ack_condition = threading.Condition()
+
 	def log_action(self, action_type, **kwargs):
 		if self.log_file:
 			entry = dict(kwargs)
 			entry['action'] = action_type
-			action = json.dumps(entry)
-			self.log_file.write(action + '\n')
+			self.log_file.write(entry)
 
 	def log_start(self):
 		self.log_action('start', tick=self.currTick)
@@ -65,45 +112,188 @@ class Engine():
 		return player
 
 	def run(self):
-		turns=0
+		self.thread = threading.current_thread()
+		self.scheduler.start()
 		while self.running:
-			startTime = time.time()
-			self.advance()
+			self.step()
+			if not self.running:
+				break
+			if self.mode == constants.REALTIME:
+				self.scheduler.wait()
+			elif self.mode == constants.LOCKSTEP:
+				self.wait_for_acks()
+
+		self.feed.close()
+		print "Game complete"
+
+	## Play one tick and end the game if it is over.
+	#  This is what run does every tick, without any pacing, so games can be
+	#  driven directly as fast as they will go.
+	#  @return the summary of the tick from advance
+	def step(self):
+		with self.lock:
+			start = time.time()
+			self.run_commands()
+			commandsDone = time.time()
+			summary = self.advance()
+			advanced = time.time()
 			self.check_running()
-			timePassed = time.time() - startTime
-			if timePassed < constants.TICK_TIME:
-				time.sleep(constants.TICK_TIME - timePassed)
-			turns=turns+1
-			if turns > constants.MAX_RUNTIME:
-				print "Breaking a tie"
-				# Handle a tie
-				alivePlayers = []
-				for player in self.players.itervalues():
-					if not player.isDead():
-						alivePlayers.append(player)
-				scores = [(((player.resources + 1) * (player.health)), player.name) \
-						for player in alivePlayers]
-				print scores
-				scores = sorted(scores)
-				for score in scores:
-					# Going in ascending order, so lower scores first
-					place = 4 - len(self.results)
-					self.results[place] = score[1]
-				self.endGame()
+			checked = time.time()
+			if self.feed.subscribed:
+				self.feed.publish(self.currTick, self.tick_delta(summary))
+			end = time.time()
+
+			self.metrics.phase('commands', commandsDone - start)
+			self.metrics.phase('check', checked - advanced)
+			self.metrics.phase('publish', end - checked)
+			self.metrics.tick(end - start)
+		return summary
 
-		print "Game complete"
+	## The engine's metrics, served at /metrics and written to the stats
+	#  file, see EngineMetrics.report.
+	#  @return the metrics as a dict, with the tick, the mode, whether the
+	#          game is running, the commands waiting, how far behind the log
+	#          is, and in realtime mode how many ticks ran late, see
+	#          TickScheduler.report
+	def stats(self):
+		stats = self.metrics.report()
+		stats['tick'] = self.currTick
+		stats['mode'] = self.mode
+		if self.mode == constants.REALTIME:
+			stats['scheduler'] = self.scheduler.report()
+		stats['running'] = self.running
+		stats['queued_commands'] = self.commands.qsize()
+		if self.log_file:
+			stats['log'] = {
+				'queued': self.log_file.queued(),
+				'stalls': self.log_file.stalls,
+			}
+		return stats
+
+	## Writes the stats to the stats file, if there is one.
+	def write_stats(self):
+		if self.stats_file:
+			with open(self.stats_file, 'w') as statsFile:
+				json.dump(self.stats(), statsFile, indent=2, sort_keys=True)
+
+	## The compact delta of a tick published to the TickFeed.
+	#  Every unit moves one square along its path each tick, so only the
+	#  units entering a path are listed, not every move.
+	#  @param summary The summary of the tick from advance
+	#  @return a dict with the tick, whether the game is still running, and a
+	#          dict by player id of the player's health and whatever happened
+	#          on their board: units entering a path (spawns) as [direction,
+	#          owner, level, specialisation], units reaching the base (damages)
+	#          as [owner, damage], towers firing (attacks) as [tower id,
+	#          [x, y] of the unit hit] and units killed (deaths) as [owner,
+	#          [x, y]]
+	def tick_delta(self, summary):
+		boards = {}
+		for player in self.players.itervalues():
+			board = {'health': player.health}
+			boards[player.name] = board
+			events = summary.get(player.name)
+			if not events:
+				continue
+
+			spawns = []
+			for direction, path in player.board.paths.iteritems():
+				if path.moving and path.moving[-1] is not None:
+					unit = path.moving[-1]
+					spawns.append([direction, unit.owner, unit.level,
+						unit.specialisation])
+			if spawns:
+				board['spawns'] = spawns
+			if events.get('damages'):
+				board['damages'] = [[damage['unit'].owner,
+					damage['unit'].finalDamage()] for damage in events['damages']]
+			if events.get('attacks'):
+				board['attacks'] = [[attack['tower'].ID, attack['unit_pos']]
+					for attack in events['attacks']]
+			if events.get('deaths'):
+				board['deaths'] = [[death['unit'].owner, death['unit_pos']]
+					for death in events['deaths']]
+		return {'tick': self.currTick, 'running': self.running,
+			'boards': boards}
+
+	## Queue a command to run at the start of the next tick.
+	#  Commands run on the thread running the game, in the order they were
+	#  queued. A game nobody is running, like one driven with step, or a
+	#  command queued by another command, runs the command straight away.
+	#  @param func The function to call
+	#  @param args The arguments to call it with
+	#  @return a CommandFuture for the result
+	#  @throws Queue.Full if too many commands are already waiting
+	def submit(self, func, *args):
+		future = CommandFuture(func, args)
+		if not self.running:
+			future.set_exception(EngineStopped())
+		elif self.thread is None or self.thread is threading.current_thread():
+			with self.lock:
+				future.run()
+		else:
+			self.commands.put_nowait(future)
+			if not self.running:
+				# The game ended while we queued it, and may have missed it
+				self.fail_commands()
+			elif self.mode == constants.LOCKSTEP:
+				# Run it now if we are waiting on acknowledgements
+				with self._ack_condition:
+					self._ack_condition.notify_all()
+		return future
+
+	## Run the commands queued so far.
+	def run_commands(self):
+		with self.lock:
+			depth = self.commands.qsize()
+			self.metrics.commands(depth)
+			for i in range(depth):
+				try:
+					future = self.commands.get_nowait()
+				except Queue.Empty:
+					break
+				future.run()
+
+	## Fail every queued command, once the game is over.
+	def fail_commands(self):
+		while True:
+			try:
+				future = self.commands.get_nowait()
+			except Queue.Empty:
+				break
+			future.set_exception(EngineStopped())
+
+	## Place the players still alive when time runs out, by score.
+	def breakTie(self):
+		print "Breaking a tie"
+		# Handle a tie
+		alivePlayers = []
+		for player in self.players.itervalues():
+			if not player.isDead():
+				alivePlayers.append(player)
+		scores = [(((player.resources + 1) * (player.health)), player.name) \
+				for player in alivePlayers]
+		print scores
+		scores = sorted(scores)
+		for score in scores:
+			# Going in ascending order, so lower scores first
+			place = 4 - len(self.results)
+			self.results[place] = score[1]
+		self.endGame()
 
 	def advance(self):
 		self.currTick = self.currTick + 1
 		if self.currTick % constants.SUPPLY_TIME == 0:
+			start = time.time()
 			self.supply()
+			self.metrics.phase('supply', time.time() - start)
 
 		# Create a dict that will contain a summary of all events
 		# that occurr in the tick on each Player's Board
 		summary = {}
 		for player in self.players.itervalues():
 			if not player.isDead():
-				summary[player.name] = player.advance()
+				summary[player.name] = player.advance(self.metrics)
 			else:
 				if player.name not in self._marked_players:
 					# Mark the player in 4th, 3rd, 2nd, or 1st place
@@ -125,8 +315,53 @@ class Engine():
 					if not player.isDead():
 						self.results[1] = player.name
 			self.endGame()
-		if self.currTick > constants.MAX_RUNTIME:
-			self.endGame()
+		elif self.currTick > constants.MAX_RUNTIME:
+			# Out of time, so whoever is left is placed by score, which
+			# ends the game
+			self.breakTie()
+
+	## Acknowledge that a player has seen the current tick.
+	#  Only meaningful in lockstep mode, where the engine waits for every
+	#  living player to acknowledge a tick before advancing to the next.
+	#  @param player_id The acknowledging player
+	#  @param tick The tick being acknowledged, or None for the current one
+	#  @return True if the acknowledgement counted towards the current tick
+	def ack(self, player_id, tick=None):
+		with self._ack_condition:
+			if tick is None:
+				tick = self.currTick
+			elif tick != self.currTick:
+				# Stale, or for a tick not reached yet
+				return False
+			# Kept with the tick, as the tick may still advance before the
+			# engine stops waiting, and this must not count for the next one
+			self._acked[str(player_id)] = tick
+			self._ack_condition.notify_all()
+			return True
+
+	## Block until every living player has acknowledged the current tick,
+	#  the game ends, or LOCKSTEP_TIMEOUT passes, so a stalled client
+	#  cannot hang the game. Commands queued meanwhile are run as they come,
+	#  so clients waiting on them can go on to acknowledge.
+	def wait_for_acks(self):
+		deadline = time.time() + constants.LOCKSTEP_TIMEOUT
+		with self._ack_condition:
+			while self.running and not self._all_acked():
+				if not self.commands.empty():
+					self._ack_condition.release()
+					try:
+						self.run_commands()
+					finally:
+						self._ack_condition.acquire()
+					continue
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					break
+				self._ack_condition.wait(remaining)
+
+	def _all_acked(self):
+		return all(self._acked.get(player.name) == self.currTick
+				for player in self.players.itervalues() if not player.isDead())
 
 	def supply(self):
 		maxTier = max(player.allowedUpgrade for player in self.players.itervalues())
@@ -135,7 +370,17 @@ class Engine():
 			player.addResources(resources)
 
 	def endGame(self):
+		if not self.running:
+			# Already ended
+			return
 		self.running=False
+		# Wake a lockstep engine waiting on acknowledgements
+		with self._ack_condition:
+			self._ack_condition.notify_all()
+		self.fail_commands()
+		if self.log_file:
+			self.log_file.close()
+		self.write_stats()
 		highScore=0
 		for player in self.players.itervalues():
 			if (player.resources+1)*player.health <= highScore:
@@ -143,6 +388,55 @@ class Engine():
 			else:
 				highScore=(player.resources+1)*player.health
 
+	## A copy of the state of the game, which restore can put back.
+	#  The snapshot is made of tuples of numbers and strings, apart from the
+	#  players' BoardLayouts, which never change, so it shares nothing with
+	#  the game and is quick to make. It has everything that decides how
+	#  the game plays on, but not what is only used while it is hosted, like
+	#  the log, the queued commands or the subscribers.
+	#  @return a tuple of the tick, whether the game is running, the next
+	#          tower ID, the results, the players already placed, and each
+	#          player as (name, layout, resources, health, allowed upgrade,
+	#          units sent, board) where board is from Board.snapshot
+	def snapshot(self):
+		with self.lock:
+			return (self.currTick, self.running, self.currID,
+				tuple(sorted(self.results.iteritems())),
+				tuple(sorted(self._marked_players)),
+				tuple((player.name, player.board.layout, player.resources,
+						player.health, player.allowedUpgrade,
+						player.sentUnits, player.board.snapshot())
+					for name, player in sorted(self.players.iteritems())))
+
+	## Puts the game back to a snapshot, replacing the players and boards.
+	#  @param snapshot What snapshot returned, from this engine or another
+	def restore(self, snapshot):
+		currTick, running, currID, results, marked, players = snapshot
+		with self.lock:
+			self.currTick = currTick
+			self.running = running
+			self.currID = currID
+			self.results = dict(results)
+			self._marked_players = set(marked)
+
+			self.players = {}
+			boards = []
+			for name, layout, resources, health, allowedUpgrade, sentUnits, \
+					board in players:
+				player = Player(name, Board.fromLayout(layout))
+				player.resources = resources
+				player.health = health
+				player.allowedUpgrade = allowedUpgrade
+				player.sentUnits = sentUnits
+				self.players[name] = player
+				boards.append((player, board))
+
+			self.towers = {}
+			for player, board in boards:
+				player.board.restore(board, player, self.players)
+				for position, tower in player.board.tower.iteritems():
+					self.towers[tower.ID] = (player.name, position, tower)
+
 	def generateID(self):
 		retID = self.currID
 		self.currID = self.currID + 1
@@ -162,13 +456,18 @@ class Engine():
 
 	""" This should return the board of player_id """
 	def board_get(self, player_id):
-		return self.get_player(player_id).board
+		player = self.get_player(player_id)
+		if player is None:
+			return None
+		return player.board
 
 	# Tower Class Controls
 
 	""" This should return the tower object that's created """
 	def tower_create(self, owner_id, coords):
 		tower = self.get_player(owner_id).purchaseTower(coords, self.generateID())
+		if tower is not None:
+			self.towers[tower.ID] = (str(owner_id), coords, tower)
 
 		self.log_action('tower_create', owner_id=owner_id, coords=list(coords))
 
@@ -176,21 +475,16 @@ class Engine():
 
 	""" This should return the tower that's been specified"""
 	def tower_get(self, tower_id, owner_id=None):
-		# If an owner id is given, only search that Player's Towers
-		if owner_id:
-			players = [self.get_player(owner_id)]
-		else:
-			players = self.players.values()
-
-		for player in players:
-			board = player.boardIs()
-			towers = board.getTowers()
+		entry = self.towers.get(tower_id)
+		if entry is None:
+			return None
 
-			for tower in towers.itervalues():
-				if tower.getID() == tower_id:
-					return tower
+		# If an owner id is given, only find that Player's Towers
+		owner, position, tower = entry
+		if owner_id is not None and owner != str(owner_id):
+			return None
 
-		return None
+		return tower
 
 	""" This should return the player object relating to owner_id """
 	def tower_sell(self, tower_id, owner_id):
@@ -202,7 +496,8 @@ class Engine():
 		if tower == None:
 			return retPlayer
 
-		retPlayer.sellTower(retPlayer.board.getTowerPosition(tower_id))
+		owner, position, tower = self.towers.pop(tower_id)
+		retPlayer.sellTower(position)
 
 		self.log_action('tower_sell', tower_id=tower_id, owner_id=owner_id)
 
@@ -220,6 +515,7 @@ class Engine():
 			return None
 
 		retTower.specialise(spec)
+		player.board.towerChanged(retTower)
 
 		self.log_action('tower_specialize', tower_id=tower_id,
 			owner_id=owner_id, spec=spec)
@@ -229,14 +525,6 @@ class Engine():
 	""" This should return the tower that's been specified """
 	def tower_upgrade(self, tower_id, owner_id):
 		retTower = self.tower_get(tower_id, owner_id)
-		board = self.board_get(owner_id)
-		towers = board.getTowers()
-		coords = None
-
-		for elem in towers:
-			if towers[elem].ID == tower_id:
-				coords = elem
-
 		if(retTower == None):
 			return None
 
@@ -245,10 +533,15 @@ class Engine():
 		if(player == None):
 			return None
 
-		board.removeFromHitList(retTower)
+		board = player.board
+		owner, coords, tower = self.towers[tower_id]
+
 		retTower.upgradeTower(player)
-		player.refreshTower(coords, retTower)
-		board.addToHitList(retTower, coords)
+		# Re-adding moves the tower to the back of its hitList buckets, which
+		# decides firing order, so do it even when the upgrade fails to keep
+		# that order the same as before
+		board.refreshHitList(retTower, coords)
+		board.towerChanged(retTower)
 
 		self.log_action('tower_upgrade', tower_id=tower_id, owner_id=owner_id)
 
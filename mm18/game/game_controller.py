@@ -1,11 +1,21 @@
 #!/usr/bin/env python
 
 from mm18.game.engine import Engine
-from mm18.game.constants import CONSTANTS_DICT
+from mm18.game.commands import CommandFuture, EngineStopped
+from mm18.game.constants import CONSTANTS_DICT, REALTIME, TICK_POLICY
+from mm18.game.response_cache import ResponseCache
+
+import json as json_module
+import Queue
+import traceback
 ## @file game_controller.py
 
-# A global variable stores the active game engine
-_engine = None
+# The game engines on this server, by game id
+_engines = {}
+# The id of the game started most recently
+_latest_game = None
+# Encoded responses that hold for every game, such as board layouts
+_shared_responses = ResponseCache()
 
 ## Runs the game and facilitates communication between the server, database,
 #  and game logic.
@@ -13,40 +23,140 @@ _engine = None
 #  Basic set of functions for facilitating communication between the server, game
 #  storage, and logic/rules of the game.
 #
-#  Most functions in this file take arguments in the form (regex, **json)
-#  where regex is the parsed regular expression match object (contains things
-#  grabbed from the regular expression), and json is all the keyworded
-#  arguments parsed out of the json sent to the server.
+#  Most functions in this file are called with arguments in the form
+#  (regex, **json) where regex is the parsed regular expression match object
+#  (contains things grabbed from the regular expression), and json is all the
+#  keyworded arguments parsed out of the json sent to the server. The json may
+#  contain the id of the game (game) the request is for, which
+#  require_running_game uses to pass the game's engine to the function as its
+#  first argument, making the definitions (engine, regex, **json).
 #
 #  All functions with (regex, **json) input return a tuple in the form (code,
 #  json), where code is the HTTP status code to respond with, and json is the
-#  response dictionary to serialize and send out to the client.
+#  response dictionary to serialize and send out to the client. Functions
+#  that read or change the game are queued for the engine thread by
+#  queue_command and return a CommandFuture for that tuple instead, so the
+#  thread handling the request never waits for a tick to finish.
 #
-#  The engine must be set with the initalizer before any of these functions will
+#  A game must be started with init_game before any of these functions will
 #  work succesfully.
 
 # Setup functions
 
+## Passes the engine of the game the request is for to the function, which
+#  is called straight away on the thread handling the request. Only for
+#  functions that read nothing a tick changes, or that lock what they read
+#  themselves, since the engine may be playing a tick meanwhile.
 def require_running_game(func):
 	def check_run_and_process(regex, **json):
-		if _engine is None:
-			print "No engine"
-			# Game isn't running, call error handling
-			return respond_for_no_game()
-		elif not game_running():
-			print "Game not running"
-			return respond_for_done_game()
-		else:
-			try:
-				return func(regex, **json)
-			except KeyError:
-				return missing_data()
+		engine, error = running_engine(json)
+		if engine is None:
+			return error
+		return call_with_engine(func, engine, regex, json)
 
+	# Batches call the function with the engine they already found
+	check_run_and_process.with_engine = func
 	return check_run_and_process
 
-def init_game(client_manager, game_log):
-	global _engine
-	_engine = Engine.spawn_game(client_manager.clients, game_log)
+## Like require_running_game, for functions that read or change the game.
+#  Rather than calling the function, it is queued to run on the engine thread
+#  at the start of the next tick, and a CommandFuture for its result is
+#  returned in place of the (code, json) tuple. Pass the future to
+#  command_result once it is done to get the tuple.
+def queue_command(func):
+	def check_run_and_queue(regex, **json):
+		engine, error = running_engine(json)
+		if engine is None:
+			return error
+		try:
+			return engine.submit(call_with_engine, func, engine, regex, json)
+		except Queue.Full:
+			return respond_for_busy_game()
+
+	check_run_and_queue.with_engine = func
+	return check_run_and_queue
+
+## Lets a handler be one of the actions of a batch, see batch_handler. Only
+#  handlers answering straight away are, not ones answering later like
+#  game_subscribe, nor the batch handler itself.
+def batchable(handler):
+	handler.batchable = True
+	return handler
+
+def running_engine(json):
+	engine = get_engine(json.pop('game', None))
+	if engine is None:
+		print "No engine"
+		# Game isn't running, call error handling
+		return (None, respond_for_no_game())
+	elif not engine.running:
+		print "Game not running"
+		return (None, respond_for_done_game())
+	return (engine, None)
+
+def call_with_engine(func, engine, regex, json):
+	try:
+		return func(engine, regex, **json)
+	except KeyError:
+		return missing_data()
+
+## Get the (code, json) tuple a queued function returned
+#  @param future The CommandFuture from queue_command, once it is done
+def command_result(future):
+	try:
+		return future.result()
+	except EngineStopped:
+		return respond_for_done_game()
+	except Exception:
+		traceback.print_exc()
+		return (500, {'error': "Internal server error"})
+
+def init_game(client_manager, game_log, mode=REALTIME, game_id=1,
+		policy=TICK_POLICY):
+	global _latest_game
+	_engines[game_id] = Engine.spawn_game(client_manager.clients, game_log, mode,
+		policy)
+	_latest_game = game_id
+
+def forget_game(game_id):
+	_engines.pop(game_id, None)
+
+def get_engine(game_id=None):
+	if game_id is None:
+		game_id = _latest_game
+	return _engines.get(game_id)
+
+## A response already encoded to JSON, which is sent as it is instead of
+#  encoding a dictionary. It must include the status itself.
+class EncodedJSON(object):
+
+	## @param json The encoded response
+	#  @param data The response dictionary, if there is one, for encoding
+	#  it in other formats
+	def __init__(self, json, data=None):
+		self.json = json
+		self.data = data
+		self._encodings = {}
+
+	## The response in another wire format, encoded once per format.
+	#  @param codec The codec to encode it with, see mm18.server.codec
+	def encoded_as(self, codec):
+		encoding = self._encodings.get(codec.name)
+		if encoding is None:
+			data = self.data
+			if data is None:
+				data = json_module.loads(self.json)
+			encoding = codec.encode(data)
+			self._encodings[codec.name] = encoding
+		return encoding
+
+## Encode a response once, to be sent as it is for as long as it holds
+#  @param code The status code
+#  @param jsonret The response dictionary
+#  @return an EncodedJSON
+def encoded(code, jsonret):
+	jsonret["status"] = code
+	return EncodedJSON(json_module.dumps(jsonret), jsonret)
 
 def respond_for_no_game():
 	output = (404, {'error': "Game is not yet running"})
@@ -56,26 +166,39 @@ def respond_for_done_game():
 	output = (404, {'error': "Game has ended"})
 	return output
 
+def respond_for_busy_game():
+	output = (503, {'error': "Too many commands waiting, try again"})
+	return output
+
 def missing_data():
 	output = (400, {'error': "Valid JSON but missing required input keys"})
 	return output
 
-def game_running():
-	if _engine:
-		return _engine.running
+def invalid_data():
+	output = (400, {'error': "Valid JSON but invalid input"})
+	return output
+
+def game_started(game_id=None):
+	return get_engine(game_id) is not None
+
+def game_running(game_id=None):
+	engine = get_engine(game_id)
+	if engine:
+		return engine.running
 	else:
 		return False
 
-def get_winners():
-	return _engine.results
+def get_winners(game_id=None):
+	return get_engine(game_id).results
 
 ## Engine API hooks
 
 ## Get the status of the currently running game.
 #  @param **json Expected to contain "Request player's ID" (id) and "Request player's authentication token" (auth)
 #  @return a tuple containing the return code and JSON containing "Error message if any" (error) and "List of tuples player ids and their base's health" (players)
-@require_running_game
-def get_game_status(regex, **json):
+@batchable
+@queue_command
+def get_game_status(engine, regex, **json):
 
 	"""Get the status of the currently running game
 
@@ -86,30 +209,76 @@ def get_game_status(regex, **json):
 	JSON Output Expectations:
 
 	"""
-	ids = _engine.get_player_ids()
+	# Health only changes when a tick is played, so every player gets the
+	# same response until the next tick
+	return (200, engine.responses.get("status", engine.currTick,
+		lambda: encoded(200, game_status(engine))))
+
+def game_status(engine):
+	ids = engine.get_player_ids()
 	playerList = []
 	for player_id in ids:
-		playerHealth = _engine.get_player(player_id).healthIs()
+		playerHealth = engine.get_player(player_id).healthIs()
 		currPlayer = (player_id, playerHealth)
 		playerList.append(currPlayer)
 
-	code = 200;
-
 	jsonret = {"players": playerList}
 
+	return jsonret
+
+## Acknowledge the current tick, letting a lockstep game advance
+#  @param **json Expected to contain "Request player's ID" (id) and "Request player's authentication token" (auth), optionally "The tick being acknowledged" (tick)
+#  @return a tuple containing the return code and JSON containing "Error message if any" (error) and "The engine's current tick" (tick)
+@batchable
+@require_running_game
+def game_ack(engine, regex, **json):
+	counted = engine.ack(json["id"], json.get("tick"))
+
+	code = 200
+	error = ""
+
+	if not counted:
+		code = 409
+		error = "Not the current tick"
+
+	jsonret = {"error": error, "tick": engine.currTick}
+
 	return (code, jsonret)
 
+## Wait for the next ticks of the game, instead of polling for them
+#  @param **json Expected to contain "Request player's ID" (id) and "Request player's authentication token" (auth), optionally "The last tick seen" (tick), by default the current one
+#  @return a CommandFuture for a tuple containing the return code and JSON containing "Error message if any" (error), "Whether ticks after the last one seen were already dropped, so the client should fetch the boards again" (missed) and "The deltas of the ticks since the last one seen, see Engine.tick_delta" (ticks), once there is a tick to send
+@require_running_game
+def game_subscribe(engine, regex, **json):
+	after = json.get("tick")
+	if after is None:
+		after = engine.currTick
+	elif not isinstance(after, (int, long)):
+		return (400, {'error': "Tick must be an integer"})
+	response = CommandFuture(None, ())
+
+	# Every tick is already encoded, so just join them up
+	def respond(future):
+		missed, ticks = future.result()
+		response.set_result((200, EncodedJSON(
+			'{"status": 200, "error": "", "missed": %s, "ticks": [%s]}' %
+				('true' if missed else 'false', ','.join(ticks)))))
+
+	engine.feed.subscribe(after).add_done_callback(respond)
+	return response
+
 ## Get the status of the player, don't return anything
 #  that shouldn't be visible to the player
 #  @param **json Expected to contain "Request player's ID" (id) and "Request player's authentication token" (auth)
 #  @return a tuple containing the return code and JSON containing "Error message if any" (error), "Request player's base health" (health)
-@require_running_game
-def get_player_status(regex, **json):
+@batchable
+@queue_command
+def get_player_status(engine, regex, **json):
 
 	playerID = json["id"]
 	playerRequested = int(regex["id"])
 
-	player = _engine.get_player(playerRequested)
+	player = engine.get_player(playerRequested)
 
 	playerHealth = -1
 	playerResources = -1
@@ -134,50 +303,86 @@ def get_player_status(regex, **json):
 	return (code, jsonret)
 
 ## Get the player's board status
-#  @param **json Expected to contain "Request player's ID" (id) and "Request player's authentication token (auth)
-#  @return  a tuple containing the return code and JSON containing "Error message if any" (error), "The list of all towers to be further parsed by the game clients" (towers), and "The list of all units on the board to be further parsed by the game clients" (units)
-@require_running_game
-def board_get(regex, **json):
+#  @param **json Expected to contain "Request player's ID" (id) and "Request player's authentication token (auth), optionally "The board version the client already has" (since)
+#  @return  a tuple containing the return code and JSON containing "Error message if any" (error), "The board's version" (version), "The list of all towers to be further parsed by the game clients" (towers), "The list of all units on the board to be further parsed by the game clients" (units) and "The path squares, which never change, see board_layout" (paths). Given a version still on the board, only what changed since is sent: "The towers added or changed" (towers), "The IDs of the towers removed" (removed) and the units if they changed (units), or just "Nothing changed" (unchanged) if the board is still at that version
+@batchable
+@queue_command
+def board_get(engine, regex, **json):
 
 	playerid = int(regex["id"])
 
-	board = _engine.board_get(playerid)
-	
-	towers = []
-	units = []
-	paths = []
-	
-	code = 409
-	error = "Invalid player ID"
+	board = engine.board_get(playerid)
+	since = json.get("since")
 
-	if board != None :
-		unitsList = board.units()
+	if board == None:
+		jsonret = {"error": "Invalid player ID", "towers": [], "units": [],
+			"paths": []}
+		return (409, jsonret)
 
-		for elem in board.tower:
-			towerCoords = elem
-			towerID = board.tower[elem].ID
-			towerTuple = (towerID, towerCoords)
-			towers.append(towerTuple)
+	if isinstance(since, (int, long)) and 0 <= since <= board.version:
+		return board_changes(board, since)
 
-		for elem in unitsList:
-			unitCoord, unit = elem
-			unitTuple = (unit.owner, unitCoord, unit.level, 
-					unit.specialisation, unit.health)
-			units.append(unitTuple)
+	# The full board is the same until its version changes
+	return (200, engine.responses.get(("board", playerid), board.version,
+		lambda: encoded(200, full_board(board))))
 
-		code = 200
-		error = ""
+def full_board(board):
+	return {"error": "", "towers": board_towers(board, board.towerPositions),
+		"units": board_units(board), "paths": board.path,
+		"version": board.version}
 
-	jsonret = {"error": error, "towers": towers, "units": units, "paths": board.path}
-	return (code, jsonret)
+def board_changes(board, since):
+	if since == board.version:
+		return (200, {"error": "", "version": board.version, "unchanged": True})
+
+	towers = board_towers(board, [towerID for towerID, version
+		in board.towerVersions.iteritems() if version > since])
+	removed = [towerID for towerID, version in board.removedTowers.iteritems()
+		if version > since]
+
+	jsonret = {"error": "", "version": board.version, "towers": towers,
+		"removed": removed}
+	if board.unitsVersion > since:
+		jsonret["units"] = board_units(board)
+	return (200, jsonret)
+
+def board_towers(board, towerIDs):
+	return [(towerID, board.towerPositions[towerID]) for towerID in towerIDs]
+
+def board_units(board):
+	units = []
+	for unitCoord, unit in board.units():
+		unitTuple = (unit.owner, unitCoord, unit.level,
+				unit.specialisation, unit.health)
+		units.append(unitTuple)
+	return units
+
+## Get the parts of the player's board that never change, fetched once
+#  instead of with every board_get
+#  @param **json Expected to contain "Request player's ID" (id) and "Request player's authentication token (auth)
+#  @return  a tuple containing the return code and JSON containing "Error message if any" (error), "The board's width" (width) and "height" (height), "The base squares" (base), "The path squares" (paths) and "The path units take from each direction, from the edge of the board to the base, or None if there is no path that way" (routes)
+@batchable
+@require_running_game
+def board_layout(engine, regex, **json):
+	board = engine.board_get(int(regex["id"]))
+	if board == None:
+		return (409, {"error": "Invalid player ID"})
+
+	# Layouts never change, and boards loaded from the same file share one
+	layout = board.layout
+	return (200, _shared_responses.get(("layout", layout), None,
+		lambda: encoded(200, {"error": "", "width": layout.width,
+			"height": layout.height, "base": layout.base,
+			"paths": layout.path, "routes": layout.edgePaths})))
 
 ## Upgrade a certain tower, if possible
 #  @param **json Expected to contain "Request player's ID" (id) and "Request player's authentication token" (auth)
 #  @return  a tuple containing the return code and JSON containing "Error message if any" (error), "The tower that was upgraded (or just the unupgraded one if the update failed)" (tower), and "The player's updated resources" (resources)
-@require_running_game
-def tower_upgrade(regex, **json):
-	tower = _engine.tower_upgrade(int(regex["id"]), json["id"])
-	player = _engine.get_player(json["id"])
+@batchable
+@queue_command
+def tower_upgrade(engine, regex, **json):
+	tower = engine.tower_upgrade(int(regex["id"]), json["id"])
+	player = engine.get_player(json["id"])
 	code = 200
 	error = ""
 	resources = player.resourcesIs()
@@ -203,10 +408,11 @@ def tower_upgrade(regex, **json):
 ## Specialize a certain tower, if possible
 #  @param **json Expected to contain "Request player's ID" (id) and "Request palyer's authentication token" (auth), and the tower's specialization (spec)
 #  @return  a tuple containing the return code and JSON containing "Error message if any" (error), "The tower that was upgraded (or just the unupgraded one if the update failed)" (tower), and "The player's updated resources" (resources)
-@require_running_game
-def tower_specialize(regex, **json):
-	tower = _engine.tower_specialize(int(regex["id"]), json["id"], json["spec"])
-	player = _engine.get_player(json["id"])
+@batchable
+@queue_command
+def tower_specialize(engine, regex, **json):
+	tower = engine.tower_specialize(int(regex["id"]), json["id"], json["spec"])
+	player = engine.get_player(json["id"])
 	code = 200
 	error = ""
 	resources = player.resourcesIs()
@@ -234,8 +440,9 @@ def tower_specialize(regex, **json):
 ## 
 # @param **json Expected to contain "Request player's ID" (id) and "Request player's authentication token" (auth)
 # @return  a tuple containing the return code and JSON containing "Error message if any" (error) and "Your updated resources count" (resources)
-@require_running_game
-def tower_sell(regex, **json):
+@batchable
+@queue_command
+def tower_sell(engine, regex, **json):
 	playerID = json["id"]
 	towerID = int(regex["id"])
 	code = 200
@@ -243,8 +450,8 @@ def tower_sell(regex, **json):
 	resources = -1
 
 	# if the tower exists, sell it
-	if _engine.tower_get(towerID, playerID) is not None:
-		player = _engine.tower_sell(towerID, playerID)
+	if engine.tower_get(towerID, playerID) is not None:
+		player = engine.tower_sell(towerID, playerID)
 		resources = player.resourcesIs()
 	else:
 		code = 409
@@ -257,9 +464,10 @@ def tower_sell(regex, **json):
 ## 
 # @param **json Expected to contain "Request player's ID" (id) and "Request player's authentication token" (auth)
 # @return  a tuple containing the return code and JSON containing "Error message if any" (error) and "The requested tower (none if it doesn't exist)" (tower)
-@require_running_game
-def tower_get(regex, **json):
-	tower = _engine.tower_get(int(regex["id"]))
+@batchable
+@queue_command
+def tower_get(engine, regex, **json):
+	tower = engine.tower_get(int(regex["id"]))
 	
 	code = 200
 	error = ""
@@ -285,9 +493,10 @@ def tower_get(regex, **json):
 ## 
 # @param **json Expected to contain "Request player's ID" (id), "Request player's authentication token" (auth), "A tuple for the new tower's position" (position), "level of the new tower" (level), and "specification of the new tower" (spec)
 # @return  a tuple containing the return code and JSON containing "Error message if any" (error), "The new tower, or none if it failed" (tower), and "The updated player's resources" (resources)
-@require_running_game
-def tower_create(regex, **json):
-	tower = _engine.tower_create(json["id"], tuple(json["position"]))
+@batchable
+@queue_command
+def tower_create(engine, regex, **json):
+	tower = engine.tower_create(json["id"], tuple(json["position"]))
 
 	code = 200
 	error = ""
@@ -303,7 +512,7 @@ def tower_create(regex, **json):
 		towerSpec = tower.specialisation
 		towerUpgrade = tower.upgrade
 
-	player = _engine.get_player(json["id"])
+	player = engine.get_player(json["id"])
 	resources = player.resourcesIs()
 
 	jsonret = {"error": error, "towerID": towerID,
@@ -315,10 +524,11 @@ def tower_create(regex, **json):
 ## 
 # @param **json Expected to contain "Request player's ID" (id), "Request player's authentication token" (auth), "The unit level" (level), "The unit specialization" (spec), "The target player's id" (target_id), "The path of the enemy board to go on" (path) 
 # @return  a tuple containing the return code and JSON containing "Error message if any" (error) and "The unit (or none if something went wrong)" (unit)
-@require_running_game
-def unit_create(regex, **json):
+@batchable
+@queue_command
+def unit_create(engine, regex, **json):
 	
-	unit = _engine.unit_create(json["id"], json["level"], json["spec"],
+	unit = engine.unit_create(json["id"], json["level"], json["spec"],
 			json["target_id"], json["path"])
 	
 	code = 200
@@ -344,6 +554,77 @@ def unit_create(regex, **json):
 
 	return (code, jsonret)
 
+# The constants never change, so they are only encoded once
+_constants_response = encoded(200, dict(CONSTANTS_DICT))
+
+@batchable
 @require_running_game
-def constants_get(regex, **json):
-	return (200, CONSTANTS_DICT)
+def constants_get(engine, regex, **json):
+	return (200, _constants_response)
+
+## Get the engine's timings, to see how the server is keeping up
+#  @param **json Expected to contain "Request player's ID" (id) and "Request player's authentication token" (auth)
+#  @return a tuple containing the return code and JSON containing "Error message if any" (error) and the stats from Engine.stats
+@batchable
+@queue_command
+def get_metrics(engine, regex, **json):
+	jsonret = engine.stats()
+	jsonret["error"] = ""
+	return (200, jsonret)
+
+## Makes the handler for the batch API, which applies many actions in one
+#  request. The batch is one command for the engine thread, which applies
+#  the actions in order, so they all land in the same tick and nothing runs
+#  in between. An action that fails doesn't stop the ones after it. Only
+#  the calls marked batchable can be actions.
+#  @param route A function taking a path and returning a tuple of the handler
+#  for it and the dictionary of regex groups, or None, like Router.match
+#  @return the handler function
+def batch_handler(route):
+
+	## Apply a list of actions
+	#  @param **json Expected to contain "Request player's ID" (id), "Request player's authentication token" (auth) and "The list of actions" (actions), each a dictionary with "The path of the API call" (call) and the JSON that call expects, without id and auth
+	#  @return a tuple containing the return code and JSON containing "Error message if any" (error) and "The JSON each action returned, with its status, in order" (results)
+	@queue_command
+	def batch(engine, regex, **json):
+		actions = json["actions"]
+		if not isinstance(actions, list) or \
+				not all(isinstance(action, dict) for action in actions):
+			return (400, {'error': "Actions must be a list of dictionaries"})
+
+		results = []
+		for action in actions:
+			code, jsonret = batch_action(engine, route, action, json)
+			if isinstance(jsonret, EncodedJSON):
+				jsonret = json_module.loads(jsonret.json)
+			jsonret['status'] = code
+			results.append(jsonret)
+
+		return (200, {"error": "", "results": results})
+
+	return batch
+
+def batch_action(engine, route, action, json):
+	action = dict(action)
+	path = action.pop("call", None)
+	if not isinstance(path, basestring):
+		return missing_data()
+	match = route(path)
+	if match is None:
+		return (404, {'error': "API call not found"})
+	handler, regex = match
+	if not getattr(handler, 'batchable', False):
+		return (400, {'error': "API call can't be batched"})
+	if not engine.running:
+		return respond_for_done_game()
+
+	# Actions are made by whoever made the batch
+	action["id"] = json["id"]
+	action["auth"] = json["auth"]
+	try:
+		return call_with_engine(handler.with_engine, engine, regex, action)
+	except Exception:
+		# Most likely input of the wrong type, which shouldn't stop the
+		# rest of the batch
+		traceback.print_exc()
+		return invalid_data()
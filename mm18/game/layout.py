@@ -0,0 +1,168 @@
+#! /usr/bin/env python
+
+import constants
+import json
+import os
+import threading
+from collections import deque
+
+## @file layout.py
+
+
+## This is the board layout class.
+#  A layout holds everything about a board that never changes during a game:
+#  the base and path squares, the paths units walk in each direction and the
+#  squares a tower can hit from every position. It is built once per board
+#  file and shared by every Board using that file, so it must never be
+#  modified after it is built.
+class BoardLayout(object):
+
+	## Layouts already loaded, by file name
+	_cache = {}
+	_cacheLock = threading.Lock()
+
+	## Builds a layout from unordered base and path locations.
+	#  @param base A list of tuples that represent the base location
+	#  @param path A list of tuples that represent the path locations
+	#  @param width An optional arguement, the width of the board
+	#  @param height An optional arguement, the height of the board
+	#  @param name An optional name for the layout, the file it came from
+	def __init__(self, base, path, width=constants.BOARD_SIDE, height=constants.BOARD_SIDE, name=None):
+		self.name = name
+		self.width = width
+		self.height = height
+
+		# base and path stay lists for callers comparing against them, the
+		# frozensets are for membership tests
+		self.base = list(base)
+		self.baseSet = frozenset(self.base)
+		self.pathSet = frozenset(path)
+		self.path = BoardLayout.orderPathSquaresByClosest(self.base, self.pathSet)
+
+		self.startPos = 4*[None]
+		for x,y in self.path:
+			if y == 0:
+				self.startPos[constants.NORTH] = (x,y)
+			elif x == self.width - 1:
+				self.startPos[constants.EAST] = (x,y)
+			elif y == self.height - 1:
+				self.startPos[constants.SOUTH] = (x,y)
+			elif x == 0:
+				self.startPos[constants.WEST] = (x,y)
+
+		# Paths from the edge of the board to the base, and the same paths
+		# reversed to start at the base, which is what the Path class takes
+		self.edgePaths = tuple(tuple(path) if path is not None else None
+				for path in self.findPaths())
+		self.basePaths = tuple(path[::-1] if path is not None else None
+				for path in self.edgePaths)
+
+		self.coverage = BoardLayout.buildCoverage(self.path, width, height)
+
+	## Loads the layout in a board file, reusing it if it was already loaded.
+	#  @param filename The board file, relative to this package
+	@staticmethod
+	def load(filename):
+		with BoardLayout._cacheLock:
+			layout = BoardLayout._cache.get(filename)
+			if layout is None:
+				layout = BoardLayout.jsonLoad(filename)
+				BoardLayout._cache[filename] = layout
+			return layout
+
+	## Reads in json for the board layout from a file
+	#  @param filename The board file, relative to this package
+	@staticmethod
+	def jsonLoad(filename):
+		filePath = os.path.join(os.path.dirname(__file__), filename)
+		with open(filePath) as boardFile:
+			data = json.load(boardFile)
+
+		baseList = [tuple(pair) for pair in data['bases']]
+		pathList = [tuple(pair) for pair in data['paths']]
+
+		return BoardLayout(baseList, pathList, data['width'], data['height'],
+				name=filename)
+
+	## Breadth-first search method that takes the unordered path locations
+	#  and sorts them by how far from the base they are.
+	#  @param baseList A list that contains the base locations
+	#  @param pathSet A set that contains the paths to the base in no order
+	@staticmethod
+	def orderPathSquaresByClosest(baseList, pathSet):
+		baseSet = frozenset(baseList)
+		pathQueue = deque(baseList)
+		seen = set()
+		outPath = []
+		while pathQueue:
+			x,y = pathQueue.popleft()
+			if (x,y) not in seen:
+				seen.add((x,y))
+				if (x, y + 1) in pathSet:
+					pathQueue.append((x, y + 1))
+				if (x, y - 1) in pathSet:
+					pathQueue.append((x, y - 1))
+				if (x + 1, y) in pathSet:
+					pathQueue.append((x + 1, y))
+				if (x - 1, y) in pathSet:
+					pathQueue.append((x - 1, y))
+				if (x,y) not in baseSet:
+					outPath.append((x,y))
+		return outPath
+
+	## Depth-first search method that uses the path locations to build a
+	#  list of paths, where each path starts at a starting path square (on the
+	#  edge of the board) and ends at the base.
+	#  TODO: make sure that paths end at a base
+	def findPaths(self):
+		paths = []
+		for direction in constants.DIRECTIONS:
+			start = self.startPos[direction]
+			if start:
+				self.findPathsRecurse([start], set([start]), paths)
+			else:
+				paths.append(None)
+		return paths
+
+	## The helper function to findPaths, it actually travels down the paths via a
+	#  depth first search and adds a completed path the the paths list when it
+	#  cannot go any farther.
+	def findPathsRecurse(self, pathStack, onStack, paths):
+		pathEnds = True
+		x,y = pathStack[-1]
+		for step in ((x, y+1), (x+1, y), (x, y-1), (x-1, y)):
+			if step not in onStack and step in self.pathSet:
+				pathEnds = False
+				pathStack.append(step)
+				onStack.add(step)
+				self.findPathsRecurse(pathStack, onStack, paths)
+
+		if pathEnds:
+			paths.append(pathStack[:])
+
+		onStack.discard(pathStack.pop())
+		return paths
+
+	## Builds the table of path squares each square of the board covers.
+	#  @param path The path locations
+	#  @return A dict mapping (position, tower range) to a tuple of the path
+	#  squares a tower with that range at that position can hit
+	@staticmethod
+	def buildCoverage(path, width=constants.BOARD_SIDE, height=constants.BOARD_SIDE):
+		coverage = {}
+		for towerRange in set(constants.TOWER_RANGE.itervalues()):
+			for x in range(width):
+				for y in range(height):
+					coverage[((x, y), towerRange)] = \
+							BoardLayout.coveredSquares(path, (x, y), towerRange)
+		return coverage
+
+	## The path squares within range of a position.
+	#  @param path The path locations
+	#  @param position The tuple location of the tower
+	#  @param towerRange How many squares out the tower reaches
+	@staticmethod
+	def coveredSquares(path, position, towerRange):
+		tX, tY = position
+		return tuple((x, y) for x, y in path
+				if abs(x - tX) <= towerRange and abs(y - tY) <= towerRange)
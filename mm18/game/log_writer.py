@@ -0,0 +1,195 @@
+#! /usr/bin/env python
+
+import gzip
+import json
+import os
+import threading
+import time
+import traceback
+import Queue
+
+import constants
+from binary_log import BinaryLogEncoder, BINARY_LOG_SUFFIX
+
+## @file log_writer.py
+
+
+# Queued by close to tell the writer thread to finish
+_CLOSE = object()
+
+## Encodes log entries as JSON, one line each.
+class JSONLogEncoder(object):
+
+	def encode(self, entries):
+		return ''.join([json.dumps(entry) + '\n' for entry in entries])
+
+	def flush(self):
+		return ''
+
+	def finish(self):
+		return ''
+
+## Writes a game's log on a thread of its own.
+#  The engine hands each entry over as a dict. Encoding it and writing it
+#  happen on the writer's thread, so the tick loop never waits on the disk.
+#  The writer takes every entry waiting each time it wakes and writes them
+#  in one go, one line of JSON per entry, the same lines the engine used to
+#  write itself, or as a binary log, see binary_log.py.
+#
+#  The queue between them is bounded. A disk so slow that the queue fills
+#  makes write wait for room rather than drop entries, since a log with
+#  holes in it can't be replayed. stalls counts how often that happened.
+class LogWriter(object):
+
+	## Opens a log and starts its writer thread.
+	#  @param log A file name, or an open file, which is flushed but left open
+	#  on close
+	#  @param compress Whether to gzip the log, by default if the file name
+	#  ends in .gz
+	#  @param binary Whether to write a binary log, by default if the file name
+	#  ends in BINARY_LOG_SUFFIX. Binary logs are read with mmap, so can't be
+	#  gzipped
+	#  @param fsync_interval Least seconds between fsyncs of the log, 0 to
+	#  fsync after every batch, or None to leave it to the OS
+	#  @param size Most entries waiting to be written
+	def __init__(self, log, compress=None, binary=None,
+			fsync_interval=constants.LOG_FSYNC_INTERVAL,
+			size=constants.LOG_QUEUE_SIZE):
+		if isinstance(log, basestring):
+			if compress is None:
+				compress = log.endswith('.gz')
+			if binary is None:
+				binary = log.endswith(BINARY_LOG_SUFFIX)
+		if compress and binary:
+			raise ValueError("Binary logs can't be gzipped")
+		if isinstance(log, basestring):
+			self._raw = open(log, 'wb')
+			self._owns_file = True
+		else:
+			self._raw = log
+			self._owns_file = False
+		if compress:
+			self._file = gzip.GzipFile(fileobj=self._raw, mode='wb')
+		else:
+			self._file = self._raw
+		self.compressed = bool(compress)
+		if binary:
+			self._encoder = BinaryLogEncoder()
+		else:
+			self._encoder = JSONLogEncoder()
+		self.fsync_interval = fsync_interval
+
+		self.closed = False
+		self.stalls = 0
+		# The first error writing the log, after which entries are dropped
+		self.error = None
+		self._last_sync = time.time()
+		self._queue = Queue.Queue(size)
+		self._close_lock = threading.Lock()
+
+		self.thread = threading.Thread(target=self._run, name='LogWriter')
+		self.thread.daemon = True
+		self.thread.start()
+
+	## Queues an entry to be written.
+	#  Entries written after the log is closed are dropped, as nothing in a
+	#  finished game is worth replaying.
+	#  @param entry A dict that can be encoded as JSON, and isn't changed
+	#  after it is written
+	def write(self, entry):
+		if self.closed:
+			return
+		try:
+			self._queue.put_nowait(entry)
+		except Queue.Full:
+			self.stalls += 1
+			self._queue.put(entry)
+
+	## How many entries are waiting to be written.
+	def queued(self):
+		return self._queue.qsize()
+
+	## Writes everything queued and closes the log, waiting until it is done.
+	#  Closing a closed log does nothing.
+	def close(self):
+		with self._close_lock:
+			if self.closed:
+				return
+			self.closed = True
+		self._queue.put(_CLOSE)
+		self.thread.join()
+
+	def _run(self):
+		while True:
+			entries = [self._queue.get()]
+			while True:
+				try:
+					entries.append(self._queue.get_nowait())
+				except Queue.Empty:
+					break
+
+			closing = entries[-1] is _CLOSE
+			if closing:
+				entries.pop()
+			if self.error is None:
+				try:
+					self._write(entries, closing)
+				except (IOError, OSError), e:
+					self.error = e
+					traceback.print_exc()
+			if closing:
+				break
+		self._finish()
+
+	def _write(self, entries, closing):
+		now = time.time()
+		sync = self.fsync_interval is not None and \
+				now - self._last_sync >= self.fsync_interval
+		data = self._encoder.encode(entries)
+		if closing:
+			data += self._encoder.finish()
+		elif sync:
+			data += self._encoder.flush()
+		if data:
+			self._file.write(data)
+		if sync or closing:
+			self._sync()
+			self._last_sync = now
+		elif not self.compressed:
+			# Flushing a gzip file ends its block, so compressed logs only
+			# flush when they are synced
+			self._file.flush()
+
+	def _sync(self):
+		self._file.flush()
+		if self._file is not self._raw:
+			self._raw.flush()
+		if self.fsync_interval is not None:
+			try:
+				os.fsync(self._raw.fileno())
+			except (AttributeError, ValueError):
+				# Not a real file, like a StringIO
+				pass
+
+	def _finish(self):
+		try:
+			if self._file is not self._raw:
+				self._file.close()
+			if self._owns_file:
+				self._raw.close()
+			else:
+				self._raw.flush()
+		except (IOError, OSError), e:
+			if self.error is None:
+				self.error = e
+			traceback.print_exc()
+
+## Opens a log for reading, whether it was gzipped or not.
+#  @param path The log's file name
+#  @return the open file
+def open_log(path):
+	with open(path, 'rb') as log:
+		magic = log.read(2)
+	if magic == '\x1f\x8b':
+		return gzip.open(path, 'rb')
+	return open(path, 'r')
@@ -0,0 +1,141 @@
+#! /usr/bin/env python
+
+from bisect import bisect_left
+
+import constants
+
+## @file metrics.py
+#  Timings of an engine's ticks, kept while the game plays.
+#
+#  Every tick records a handful of durations into histograms with fixed
+#  buckets, which takes a few microseconds, so the metrics are always on.
+#  They are served at /metrics while the game runs and written to a stats
+#  file next to the game log when it ends.
+
+# The stats file is named after the game log
+STATS_SUFFIX = '.stats.json'
+
+# Bucket bounds for durations in seconds, from 10us up to about 10s, each
+# bucket about 41% wider than the one before
+TIME_BOUNDS = tuple(0.00001 * 2 ** (i / 2.0) for i in range(41))
+# Bucket bounds for the number of commands waiting at the start of a tick
+DEPTH_BOUNDS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512,
+	constants.COMMAND_QUEUE_SIZE)
+
+## Counts of values by bucket, with their total and the largest.
+#  A value goes in the first bucket whose bound is at least the value, or in
+#  the last bucket if it is bigger than every bound.
+class Histogram(object):
+
+	## @param bounds The upper bounds of the buckets, ascending
+	def __init__(self, bounds):
+		self.bounds = bounds
+		self.counts = [0] * (len(bounds) + 1)
+		self.count = 0
+		self.total = 0
+		self.max = 0
+
+	def record(self, value):
+		self.counts[bisect_left(self.bounds, value)] += 1
+		self.count += 1
+		self.total += value
+		if value > self.max:
+			self.max = value
+
+	## Estimates a percentile, as the bound of the bucket it falls in.
+	#  @param fraction The percentile as a fraction, like .99
+	#  @return the estimate, which is never more than the largest value
+	def percentile(self, fraction):
+		if not self.count:
+			return 0
+		wanted = fraction * self.count
+		seen = 0
+		for bound, count in zip(self.bounds, self.counts):
+			seen += count
+			if seen >= wanted:
+				return min(bound, self.max)
+		return self.max
+
+	## The histogram as a dict for the stats.
+	#  @return a dict of the count, mean, maximum, 50th, 90th and 99th
+	#          percentiles, and the buckets used as [bound, count] pairs,
+	#          with None as the bound of the last bucket
+	def report(self):
+		bounds = list(self.bounds) + [None]
+		return {
+			'count': self.count,
+			'mean': self.total / float(self.count) if self.count else 0,
+			'max': self.max,
+			'p50': self.percentile(.5),
+			'p90': self.percentile(.9),
+			'p99': self.percentile(.99),
+			'buckets': [[bound, count] for bound, count in
+				zip(bounds, self.counts) if count],
+		}
+
+
+## The timings of an engine's ticks.
+class EngineMetrics(object):
+
+	## What a tick's time goes on, see Engine.step
+	PHASES = ('commands', 'supply', 'move', 'fire', 'check', 'publish')
+
+	## @param tick_time How long a tick may take before it counts as an
+	#  overrun
+	def __init__(self, tick_time=constants.TICK_TIME):
+		self.tick_time = tick_time
+		self.ticks = Histogram(TIME_BOUNDS)
+		self.overruns = 0
+		self.phases = dict((phase, Histogram(TIME_BOUNDS))
+			for phase in EngineMetrics.PHASES)
+		# Time each player's board takes to play a tick, by player name
+		self.boards = {}
+		self.queueDepth = Histogram(DEPTH_BOUNDS)
+		# Time the boards took moving units and firing towers this tick
+		self._moving = 0
+		self._firing = 0
+
+	## Records how long a whole tick took, along with the time all the
+	#  boards took on it.
+	def tick(self, seconds):
+		self.ticks.record(seconds)
+		if seconds > self.tick_time:
+			self.overruns += 1
+		self.phases['move'].record(self._moving)
+		self.phases['fire'].record(self._firing)
+		self._moving = 0
+		self._firing = 0
+
+	## Records how long a phase of a tick took.
+	#  @param phase One of PHASES
+	def phase(self, phase, seconds):
+		self.phases[phase].record(seconds)
+
+	## Records how long a player's board took to play a tick.
+	#  @param player_id The player's name
+	#  @param moving Seconds moving the units
+	#  @param firing Seconds firing the towers
+	def board(self, player_id, moving, firing):
+		histogram = self.boards.get(player_id)
+		if histogram is None:
+			histogram = self.boards[player_id] = Histogram(TIME_BOUNDS)
+		histogram.record(moving + firing)
+		self._moving += moving
+		self._firing += firing
+
+	## Records how many commands were waiting at the start of a tick.
+	def commands(self, depth):
+		self.queueDepth.record(depth)
+
+	## The metrics as a dict for the stats, see Engine.stats.
+	def report(self):
+		return {
+			'tick_time': self.tick_time,
+			'overruns': self.overruns,
+			'ticks': self.ticks.report(),
+			'phases': dict((phase, histogram.report())
+				for phase, histogram in self.phases.iteritems()),
+			'boards': dict((player_id, histogram.report())
+				for player_id, histogram in self.boards.iteritems()),
+			'queue_depth': self.queueDepth.report(),
+		}
@@ -11,6 +11,12 @@ class Path(object):
 			self.moving = deque([None for _ in path])
 		else:
 			self.moving=None
+		# The units in moving, nearest the base first, as (step the unit
+		# entered the path at, unit), so finding them doesn't mean looking
+		# at every square of the path. A unit that entered at step e is
+		# steps - e squares along from the entrance.
+		self.occupants = deque()
+		self.steps = 0
 
 	## Queue a unit at the entrance.
 	#  If not other units are waiting it will start moving
@@ -24,11 +30,48 @@ class Path(object):
 	def advance(self):
 		if self.moving is None:
 			return None
+		self.steps += 1
 		if len(self.waiting) > 0:
-			self.moving.append(self.waiting.popleft())
+			unit = self.waiting.popleft()
+			self.moving.append(unit)
+			self.occupants.append((self.steps, unit))
 		elif self.moving:
 			self.moving.append(None)
-		return self.moving.popleft()
+		unit = self.moving.popleft()
+		if unit is not None:
+			self.occupants.popleft()
+		return unit
+
+	## Takes a unit killed on the way off the path, so it is left out of
+	#  what is on the board from then on.
+	#  @param unit The unit to remove
+	def remove(self, unit):
+		offset = len(self.path) - 1 - self.steps
+		for index, (entered, occupant) in enumerate(self.occupants):
+			if occupant is unit:
+				del self.occupants[index]
+				self.moving[offset + entered] = None
+				return
+
+	## The units on the path, nearest the base first.
+	#  @return a list of pairs of position and unit
+	def units(self):
+		if not self.occupants:
+			return []
+		path = self.path
+		offset = len(path) - 1 - self.steps
+		return [(path[offset + entered], unit)
+				for entered, unit in self.occupants]
+
+	## Rebuilds occupants from moving, after moving was changed directly.
+	def placed(self):
+		self.occupants = deque()
+		if self.moving is None:
+			return
+		offset = len(self.path) - 1 - self.steps
+		for slot, unit in enumerate(self.moving):
+			if unit is not None:
+				self.occupants.append((slot - offset, unit))
 
 	## An iterator over positions along the path, producing
 	#  tuple of the unit or None and the position.
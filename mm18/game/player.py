@@ -1,5 +1,7 @@
 #! /usr/bin/env python
 
+import time
+
 import constants
 from tower import Tower
 from types import *
@@ -124,15 +126,20 @@ class Player:
 		self.resources += ammount
 	
 	## Advance the Player by playing a tick
+	#  @param metrics An optional EngineMetrics to time the board in
 	#  @return a dict summarizing all events that occurred
 	#          during the tick on this Player's Board
-	def advance(self):
+	def advance(self, metrics=None):
 		summary = {}
+		start = time.time()
 		summary['damages'] = self.moveUnits()
+		moved = time.time()
 		if not self.isDead():
 			attacks, deaths = self.board.fireTowers()
 			summary['attacks'] = attacks
 			summary['deaths'] = deaths
+		if metrics is not None:
+			metrics.board(self.name, moved - start, time.time() - moved)
 		return summary
 
 	## Move units, take damage
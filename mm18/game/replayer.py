@@ -1,18 +1,91 @@
 import json
+import os
+from itertools import islice
 
+import constants
 from engine import Engine
+from layout import BoardLayout
+from binary_log import BinaryLog, is_binary_log
+from log_writer import open_log
+
+# Checkpoints are saved next to the log, in a file named after it
+CHECKPOINT_SUFFIX = '.ckpt'
+# Changed whenever what a saved checkpoint holds does
+CHECKPOINT_FORMAT = 3
+
+class GameLog:
+	"""The actions in a game log, which can be read from any tick.
+
+	Binary logs are read from their index. JSON logs are read into memory
+	once, noting where each tick starts.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		if is_binary_log(path):
+			self._binary = BinaryLog(path)
+			return
+		self._binary = None
+		self._entries = []
+		self._ticks = {}
+		with open_log(path) as log:
+			for line in log:
+				if not line.strip():
+					continue
+				entry = json.loads(line)
+				self._entries.append(entry)
+				if entry['action'] == 'advance':
+					self._ticks[entry['tick']] = len(self._entries)
+
+	def actions(self, tick=0):
+		"""The actions after the game reached a tick, as entry dicts."""
+
+		if self._binary is not None:
+			return self._binary.entries(tick)
+		if tick == 0:
+			start = 0
+		else:
+			start = self._ticks.get(tick, len(self._entries))
+		# Replaying an action changes its entry, so hand out copies
+		return (dict(entry) for entry in islice(self._entries, start, None))
 
 class Replayer:
-	def __init__(self, actions):
+	"""Plays a game over again from its log.
+
+	A replayer made from a GameLog can also seek to any tick, backwards as
+	well as forwards. As it plays it keeps a checkpoint of the game every
+	checkpoint_interval ticks, and seeks by going back to the checkpoint
+	before the tick and playing forward from there. The checkpoints can be
+	saved next to the log, so the next replay of it can seek straight away.
+	"""
+
+	def __init__(self, actions, log=None,
+			checkpoint_interval=constants.CHECKPOINT_INTERVAL):
 		self.actions = actions
 		self.game = Engine()
+		self.log = log
+		self.checkpoint_interval = checkpoint_interval
+		# Engine snapshots by tick
+		self.checkpoints = {}
+
+	@staticmethod
+	def open(path, checkpoint_interval=constants.CHECKPOINT_INTERVAL):
+		"""Replay a log file, loading any checkpoints saved for it."""
+
+		log = GameLog(path)
+		replayer = Replayer(log.actions(), log, checkpoint_interval)
+		replayer.load_checkpoints()
+		return replayer
 
 	def next_action(self):
 		line = next(self.actions, None)
-		if line:
-			return json.loads(line)
-		else:
+		if not line:
 			return None
+		elif isinstance(line, dict):
+			# Already decoded, from a binary log
+			return line
+		else:
+			return json.loads(line)
 
 	def setup_game(self):
 		while True:
@@ -27,7 +100,9 @@ class Replayer:
 			if not action:
 				return None
 			elif action['action'] == 'advance':
-				return self.game.advance()
+				summary = self.game.advance()
+				self.checkpoint()
+				return summary
 			self.play_action(action)
 		return None
 
@@ -48,3 +123,119 @@ class Replayer:
 			getattr(self.game, actionType)(**entry)
 
 		return actionType
+
+	def seek(self, tick):
+		"""Play or rewind the game to just after a tick was played.
+
+		Returns the tick reached, which is the last one in the log if the
+		game ended before the tick.
+		"""
+
+		start = self._checkpoint_before(tick)
+		if tick < self.game.currTick or \
+				(start is not None and start > self.game.currTick):
+			if self.log is None:
+				raise ValueError("Only replays of a GameLog can seek back")
+			if start is None:
+				self.game = Engine()
+				self.actions = self.log.actions()
+				self.setup_game()
+			else:
+				self.restore(start)
+
+		while self.game.currTick < tick:
+			if self.play_tick() is None:
+				break
+		return self.game.currTick
+
+	def checkpoint(self):
+		"""Keep a checkpoint of the game if one is due at this tick."""
+
+		tick = self.game.currTick
+		if self.checkpoint_interval and tick % self.checkpoint_interval == 0 \
+				and tick not in self.checkpoints:
+			self.checkpoints[tick] = self.game.snapshot()
+
+	def restore(self, tick):
+		"""Go back to the checkpoint at a tick."""
+
+		self.game = Engine()
+		self.game.restore(self.checkpoints[tick])
+		self.actions = self.log.actions(tick)
+
+	def checkpoint_path(self):
+		return self.log.path + CHECKPOINT_SUFFIX
+
+	def save_checkpoints(self):
+		"""Save the checkpoints kept so far next to the log.
+
+		They are saved as JSON, so loading the checkpoints of a log from
+		anywhere can't run code the way unpickling them could.
+		"""
+
+		checkpoints = [(tick, _save_layouts(snapshot))
+			for tick, snapshot in sorted(self.checkpoints.iteritems())]
+		with open(self.checkpoint_path(), 'w') as checkpointFile:
+			json.dump({
+				'format': CHECKPOINT_FORMAT,
+				'log_size': os.path.getsize(self.log.path),
+				'interval': self.checkpoint_interval,
+				'checkpoints': checkpoints,
+			}, checkpointFile, separators=(',', ':'))
+
+	def load_checkpoints(self):
+		"""Load the checkpoints saved next to the log, if they are for it.
+
+		Returns whether there were any.
+		"""
+
+		try:
+			with open(self.checkpoint_path()) as checkpointFile:
+				saved = json.load(checkpointFile)
+			if saved.get('format') != CHECKPOINT_FORMAT or \
+					saved['log_size'] != os.path.getsize(self.log.path) or \
+					saved['interval'] != self.checkpoint_interval:
+				return False
+			checkpoints = dict((tick, _load_layouts(_tuples(snapshot)))
+				for tick, snapshot in saved['checkpoints'])
+		except (IOError, ValueError, KeyError, TypeError, AttributeError):
+			return False
+		self.checkpoints.update(checkpoints)
+		return True
+
+	def _checkpoint_before(self, tick):
+		ticks = [checkpoint for checkpoint in self.checkpoints
+			if checkpoint <= tick]
+		return max(ticks) if ticks else None
+
+# Board layouts loaded from files are shared by every board using them, so
+# saved checkpoints refer to them by name rather than keeping copies
+
+def _save_layouts(snapshot):
+	players = []
+	for player in snapshot[-1]:
+		layout = player[1]
+		if layout.name is None:
+			raise ValueError("Only boards loaded from files can be saved")
+		players.append((player[0], layout.name) + player[2:])
+	return snapshot[:-1] + (tuple(players),)
+
+def _load_layouts(snapshot):
+	players = []
+	for player in snapshot[-1]:
+		name = player[1]
+		if os.path.basename(name) != name:
+			# Only the boards in this package
+			raise ValueError("Not a board file: %s" % name)
+		players.append((player[0], BoardLayout.load(name)) + player[2:])
+	return snapshot[:-1] + (tuple(players),)
+
+def _tuples(value):
+	"""Decoded JSON as a snapshot has it, with lists as tuples and text as
+	str."""
+
+	if isinstance(value, list):
+		return tuple(_tuples(item) for item in value)
+	elif isinstance(value, unicode):
+		return str(value)
+	return value
@@ -0,0 +1,32 @@
+#! /usr/bin/env python
+
+import threading
+
+## @file response_cache.py
+
+
+## Encoded responses to requests, kept until what they were built from changes.
+#  Each response is stored under a key along with a generation, such as the
+#  tick for responses that only change when a tick is played or a board's
+#  version for responses about a board. Asking for the key with a different
+#  generation builds the response again, so nothing has to invalidate the
+#  cache when the game changes.
+class ResponseCache(object):
+
+	def __init__(self):
+		self._responses = {}
+		self._lock = threading.Lock()
+
+	## Gets a response, building it if the cached one is out of date.
+	#  @param key What the response is for, such as the API call
+	#  @param generation Changes whenever the response would
+	#  @param build A function building the response
+	#  @return the response
+	def get(self, key, generation, build):
+		entry = self._responses.get(key)
+		if entry is not None and entry[0] == generation:
+			return entry[1]
+		response = build()
+		with self._lock:
+			self._responses[key] = (generation, response)
+		return response
@@ -0,0 +1,140 @@
+#! /usr/bin/env python
+
+import ctypes
+import ctypes.util
+import os
+import sys
+import time
+
+import constants
+
+## @file scheduler.py
+#  Paces a realtime game's ticks on a monotonic clock.
+#
+#  Tick n is due TICK_TIME * n after the first, so a tick that runs long
+#  doesn't push back every tick after it the way sleeping out the rest of
+#  each tick did. When a tick does run past when the next was due, the
+#  policy decides what happens to the time lost:
+#
+#  - CATCH_UP plays the late ticks back to back until the game is back on
+#    time, but no more than MAX_CATCH_UP of them, dropping the rest.
+#  - SKIP drops every tick that is already late, and waits for the next one
+#    still to come.
+#  - DEGRADE slows the game down to the pace its ticks are taking, and
+#    speeds it back up to TICK_TIME as they get quicker.
+
+def _clock_gettime():
+	if not sys.platform.startswith('linux'):
+		return None
+
+	class timespec(ctypes.Structure):
+		_fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+	try:
+		librt = ctypes.CDLL(ctypes.util.find_library('rt') or
+				ctypes.util.find_library('c'), use_errno=True)
+		clock_gettime = librt.clock_gettime
+	except (OSError, AttributeError, TypeError):
+		return None
+	clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+	# CLOCK_MONOTONIC on Linux
+	CLOCK_MONOTONIC = 1
+	now = timespec()
+
+	def monotonic():
+		if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(now)) != 0:
+			errno = ctypes.get_errno()
+			raise OSError(errno, os.strerror(errno))
+		return now.tv_sec + now.tv_nsec * 1e-9
+
+	try:
+		monotonic()
+	except OSError:
+		return None
+	return monotonic
+
+## Seconds on a clock that never goes backwards, for measuring time rather
+#  than telling it. Falls back to time.time where there is no monotonic
+#  clock.
+monotonic = getattr(time, 'monotonic', None) or _clock_gettime() or time.time
+
+# Weight of the latest tick in DEGRADE's running average of tick times
+_DEGRADE_WEIGHT = .2
+
+## Decides when each tick of a realtime game starts.
+class TickScheduler(object):
+
+	## @param period Seconds between ticks
+	#  @param policy What to do about late ticks, one of TICK_POLICIES
+	#  @param max_catch_up Most late ticks CATCH_UP plays back to back
+	#  @param clock A function giving the time in seconds
+	#  @param sleep A function sleeping for some seconds
+	def __init__(self, period=constants.TICK_TIME,
+			policy=constants.TICK_POLICY,
+			max_catch_up=constants.MAX_CATCH_UP, clock=monotonic,
+			sleep=time.sleep):
+		if policy not in constants.TICK_POLICIES:
+			raise ValueError("Unknown tick policy: %s" % policy)
+		self.period = period
+		self.policy = policy
+		self.max_catch_up = max_catch_up
+		self.clock = clock
+		self.sleep = sleep
+		# Ticks that ran past when the next tick was due
+		self.late = 0
+		# Ticks dropped to get back on time
+		self.skipped = 0
+		# Seconds between ticks, which DEGRADE stretches
+		self.pace = period
+		# When the next tick is due, and when the last one started
+		self.due = None
+		self._started = None
+
+	## Starts timing, with the first tick due now.
+	def start(self):
+		self.due = self._started = self.clock()
+
+	## Waits until the next tick is due, after playing one.
+	#  @return whether the tick played ran past when the next was due
+	def wait(self):
+		if self.due is None:
+			self.start()
+		now = self.clock()
+		if self.policy == constants.DEGRADE:
+			late = now > self._started + self.pace
+			self._degrade(now - self._started)
+			self.due = max(self._started + self.pace, now)
+		else:
+			self.due += self.period
+			late = now > self.due
+			if late:
+				# Further ticks that are already due as well
+				behind = int((now - self.due) / self.period)
+				if self.policy == constants.SKIP:
+					self._skip(behind + 1)
+				elif behind > self.max_catch_up:
+					self._skip(behind - self.max_catch_up)
+		if late:
+			self.late += 1
+
+		if self.due > now:
+			self.sleep(self.due - now)
+		self._started = max(self.due, now)
+		return late
+
+	## The scheduler as a dict for the engine's stats.
+	def report(self):
+		return {
+			'policy': self.policy,
+			'late': self.late,
+			'skipped': self.skipped,
+			'pace': self.pace,
+		}
+
+	def _skip(self, ticks):
+		self.skipped += ticks
+		self.due += ticks * self.period
+
+	def _degrade(self, seconds):
+		average = self.pace + _DEGRADE_WEIGHT * (seconds - self.pace)
+		self.pace = max(self.period, average)
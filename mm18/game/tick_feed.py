@@ -0,0 +1,80 @@
+#! /usr/bin/env python
+
+import json
+import threading
+from collections import deque
+from itertools import islice
+
+import constants
+from commands import CommandFuture
+
+## @file tick_feed.py
+
+
+## The ticks an engine has played, for clients following the game.
+#  Each tick is kept as a compact delta of what happened on every board,
+#  encoded to JSON once when it is published, however many clients read it.
+#  Only the last few ticks are kept, in a ring buffer.
+#
+#  Nothing is recorded until the first client subscribes, so games nobody
+#  follows don't pay for it.
+class TickFeed(object):
+
+	## Creates an empty feed.
+	#  @param size How many ticks to keep
+	def __init__(self, size=constants.TICK_FEED_SIZE):
+		self.ticks = deque(maxlen=size)
+		self.subscribed = False
+		self.closed = False
+		self._lock = threading.Lock()
+		self._waiting = []
+
+	## Records a tick and hands it to everyone waiting for it.
+	#  @param tick The tick number, one more than the last one published
+	#  @param delta The delta for the tick, see Engine.tick_delta
+	def publish(self, tick, delta):
+		encoded = json.dumps(delta, separators=(',', ':'))
+		with self._lock:
+			self.ticks.append((tick, encoded))
+			waiting = self._waiting
+			self._waiting = []
+		for after, future in waiting:
+			future.set_result(self.since(after))
+
+	## The ticks published after a tick.
+	#  @param after The last tick the client has seen
+	#  @return a tuple of whether ticks after it were already dropped from the
+	#          feed and the list of the encoded ticks still kept
+	def since(self, after):
+		with self._lock:
+			if not self.ticks:
+				return (False, [])
+			start = after + 1 - self.ticks[0][0]
+			missed = start < 0
+			return (missed, [encoded for tick, encoded in
+					islice(self.ticks, max(start, 0), None)])
+
+	## Waits for ticks after a tick.
+	#  @param after The last tick the client has seen
+	#  @return a CommandFuture for what since returns, done straight away if
+	#          there are already newer ticks or the feed is closed, otherwise
+	#          once the next tick is published
+	def subscribe(self, after):
+		future = CommandFuture(self.since, (after,))
+		with self._lock:
+			self.subscribed = True
+			if not self.closed and \
+					(not self.ticks or self.ticks[-1][0] <= after):
+				self._waiting.append((after, future))
+				return future
+		future.run()
+		return future
+
+	## Stops waiting for ticks, once the game is over.
+	def close(self):
+		with self._lock:
+			self.closed = True
+			waiting = self._waiting
+			self._waiting = []
+		for after, future in waiting:
+			future.set_result(self.since(after))
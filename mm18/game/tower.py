@@ -21,6 +21,10 @@ class Tower:
 		self.cost = constants.TOWER_BASE_COST
 		self.owner = player
 		self.ID = ID
+		# The Board hitList buckets this tower sits in, and where it comes
+		# in them, see Board.addToHitList
+		self.hitBuckets = []
+		self.hitOrder = None
 
 	## Upgrades the tower.
 	#  @param player The player upgrading the tower
@@ -9,13 +9,17 @@ class MMAuthenticator():
 	# Constant value for the bits in the token
 	_token_size = 32
 
-	def __init__(self):
+	def __init__(self, issued=None):
 		"""Set up an MMAuthenticator
 
-		max_clients - The maximum number of clients that can join the server
+		issued - An optional set of tokens already handed out, shared between
+		authenticators so no two of them hand out the same token
 		"""
 
 		self._client_tokens = {}
+		if issued is None:
+			issued = set()
+		self._issued = issued
 		random.seed()
 
 	def add_client(self, client_id):
@@ -41,7 +45,16 @@ class MMAuthenticator():
 		return client_id in self._client_tokens \
 				and self._client_tokens[client_id] == token
 
+	def tokens(self):
+		"""Get every auth token handed out by this authenticator"""
+
+		return self._client_tokens.values()
+
 	def _generate_token(self):
 		"""Generate an auth token for a client to use"""
 
-		return str(random.getrandbits(self._token_size))
+		token = str(random.getrandbits(self._token_size))
+		while token in self._issued:
+			token = str(random.getrandbits(self._token_size))
+		self._issued.add(token)
+		return token
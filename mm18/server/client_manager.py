@@ -9,9 +9,9 @@ class MMClientManager():
 	for the clients.
 	"""
 
-	def __init__(self, max_clients=4):
+	def __init__(self, max_clients=4, issued_tokens=None):
 		self.clients = []
-		self.auth = MMAuthenticator()
+		self.auth = MMAuthenticator(issued_tokens)
 		self._max_clients = max_clients
 		self._run_lock = threading.Lock()
 		self.game_condition = threading.Condition(self._run_lock)
@@ -0,0 +1,248 @@
+"""Wire formats for requests and responses.
+
+A codec encodes response dictionaries and decodes request bodies. Clients
+pick one with the Content-Type of their request, and may ask for a different
+one for the response with Accept. JSON is the default, and is what every
+client spoke before. MessagePack is more compact, and is the same data, so
+any call can be made with either.
+"""
+
+import struct
+
+# Use the fastest JSON library there is
+try:
+	import ujson as fast_json
+except ImportError:
+	try:
+		import simplejson as fast_json
+	except ImportError:
+		import json as fast_json
+
+class JSONCodec():
+	"""JSON, with whichever library is fastest."""
+
+	name = 'json'
+	content_type = 'application/json'
+
+	def encode(self, data):
+		return fast_json.dumps(data)
+
+	def decode(self, body):
+		"""Decode a request body. Raises ValueError on a bad body."""
+
+		return fast_json.loads(body)
+
+class MessagePackCodec():
+	"""MessagePack, see http://msgpack.org/
+
+	Everything the API sends fits in the basic MessagePack types: nil,
+	booleans, integers, doubles, strings, arrays and maps. Strings are sent
+	as UTF-8 and decoded to unicode, like JSON strings.
+	"""
+
+	name = 'msgpack'
+	content_type = 'application/x-msgpack'
+
+	def encode(self, data):
+		return pack(data)
+
+	def decode(self, body):
+		"""Decode a request body. Raises ValueError on a bad body."""
+
+		return unpack(body)
+
+JSON = JSONCodec()
+MSGPACK = MessagePackCodec()
+
+CODECS = {
+	JSON.content_type: JSON,
+	MSGPACK.content_type: MSGPACK,
+	'application/msgpack': MSGPACK,
+}
+
+def for_content_type(content_type):
+	"""Find the codec for a Content-Type header, JSON if there is none."""
+
+	if not content_type:
+		return JSON
+	return CODECS.get(content_type.split(';', 1)[0].strip().lower(), JSON)
+
+def negotiate(content_type, accept):
+	"""Pick the codecs for a request and its response.
+
+	content_type -- the request's Content-Type header, or None
+	accept -- the request's Accept header, or None
+
+	Returns a two-tuple of the codec to decode the request with and the codec
+	to encode the response with, which is the first known one in Accept, or
+	the same as the request's.
+	"""
+
+	request_codec = for_content_type(content_type)
+	if accept:
+		for media_type in accept.split(','):
+			codec = CODECS.get(media_type.split(';', 1)[0].strip().lower())
+			if codec is not None:
+				return (request_codec, codec)
+	return (request_codec, request_codec)
+
+# MessagePack encoding
+
+_double = struct.Struct('>Bd')
+
+def pack(obj):
+	"""Encode an object as MessagePack."""
+
+	chunks = []
+	_pack(obj, chunks.append)
+	return ''.join(chunks)
+
+def _pack(obj, write):
+	if obj is None:
+		write('\xc0')
+	elif obj is True:
+		write('\xc3')
+	elif obj is False:
+		write('\xc2')
+	elif isinstance(obj, (int, long)):
+		_pack_int(obj, write)
+	elif isinstance(obj, float):
+		write(_double.pack(0xcb, obj))
+	elif isinstance(obj, basestring):
+		if isinstance(obj, unicode):
+			obj = obj.encode('utf-8')
+		_pack_header(len(obj), 0xa0, 32, 0xd9, 0xda, 0xdb, write)
+		write(obj)
+	elif isinstance(obj, (list, tuple)):
+		_pack_header(len(obj), 0x90, 16, None, 0xdc, 0xdd, write)
+		for item in obj:
+			_pack(item, write)
+	elif isinstance(obj, dict):
+		_pack_header(len(obj), 0x80, 16, None, 0xde, 0xdf, write)
+		for key, value in obj.iteritems():
+			_pack(key, write)
+			_pack(value, write)
+	else:
+		raise TypeError("Can't encode %r as MessagePack" % (obj,))
+
+def _pack_int(obj, write):
+	if 0 <= obj < 0x80:
+		write(chr(obj))
+	elif -0x20 <= obj < 0:
+		write(chr(obj & 0xff))
+	elif 0 <= obj <= 0xffffffff:
+		if obj <= 0xff:
+			write(struct.pack('>BB', 0xcc, obj))
+		elif obj <= 0xffff:
+			write(struct.pack('>BH', 0xcd, obj))
+		else:
+			write(struct.pack('>BI', 0xce, obj))
+	elif 0 <= obj <= 0xffffffffffffffff:
+		write(struct.pack('>BQ', 0xcf, obj))
+	elif -0x80 <= obj:
+		write(struct.pack('>Bb', 0xd0, obj))
+	elif -0x8000 <= obj:
+		write(struct.pack('>Bh', 0xd1, obj))
+	elif -0x80000000 <= obj:
+		write(struct.pack('>Bi', 0xd2, obj))
+	elif -0x8000000000000000 <= obj:
+		write(struct.pack('>Bq', 0xd3, obj))
+	else:
+		raise TypeError("Integer %d is too big for MessagePack" % obj)
+
+def _pack_header(length, fix, fix_limit, code8, code16, code32, write):
+	if length < fix_limit:
+		write(chr(fix | length))
+	elif code8 is not None and length <= 0xff:
+		write(struct.pack('>BB', code8, length))
+	elif length <= 0xffff:
+		write(struct.pack('>BH', code16, length))
+	else:
+		write(struct.pack('>BI', code32, length))
+
+# MessagePack decoding
+
+# Fixed size types, by type byte, as (struct format, size)
+_FIXED = {
+	0xca: ('>f', 4), 0xcb: ('>d', 8),
+	0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4), 0xcf: ('>Q', 8),
+	0xd0: ('>b', 1), 0xd1: ('>h', 2), 0xd2: ('>i', 4), 0xd3: ('>q', 8),
+}
+# Strings and binary with their length in front, as the length's format
+_SIZED = {
+	0xc4: ('>B', 1), 0xc5: ('>H', 2), 0xc6: ('>I', 4),
+	0xd9: ('>B', 1), 0xda: ('>H', 2), 0xdb: ('>I', 4),
+}
+_ARRAYS = {0xdc: ('>H', 2), 0xdd: ('>I', 4)}
+_MAPS = {0xde: ('>H', 2), 0xdf: ('>I', 4)}
+
+def unpack(data):
+	"""Decode MessagePack. Raises ValueError if data isn't one whole object."""
+
+	try:
+		obj, offset = _unpack(data, 0)
+	except (IndexError, struct.error, UnicodeDecodeError, TypeError), e:
+		raise ValueError("Bad MessagePack: %s" % e)
+	if offset != len(data):
+		raise ValueError("Bad MessagePack: extra data")
+	return obj
+
+def _unpack(data, offset):
+	code = ord(data[offset])
+	offset += 1
+	if code < 0x80:
+		return (code, offset)
+	if code >= 0xe0:
+		return (code - 0x100, offset)
+	if code <= 0x8f:
+		return _unpack_map(data, offset, code & 0x0f)
+	if code <= 0x9f:
+		return _unpack_array(data, offset, code & 0x0f)
+	if code <= 0xbf:
+		return _unpack_string(data, offset, code & 0x1f)
+	if code == 0xc0:
+		return (None, offset)
+	if code == 0xc2:
+		return (False, offset)
+	if code == 0xc3:
+		return (True, offset)
+	if code in _FIXED:
+		fmt, size = _FIXED[code]
+		return (_read(fmt, data, offset, size), offset + size)
+	if code in _SIZED:
+		fmt, size = _SIZED[code]
+		return _unpack_string(data, offset + size,
+			_read(fmt, data, offset, size))
+	if code in _ARRAYS:
+		fmt, size = _ARRAYS[code]
+		return _unpack_array(data, offset + size,
+			_read(fmt, data, offset, size))
+	if code in _MAPS:
+		fmt, size = _MAPS[code]
+		return _unpack_map(data, offset + size,
+			_read(fmt, data, offset, size))
+	raise ValueError("Unsupported MessagePack type 0x%02x" % code)
+
+def _read(fmt, data, offset, size):
+	return struct.unpack(fmt, data[offset:offset + size])[0]
+
+def _unpack_string(data, offset, length):
+	end = offset + length
+	if end > len(data):
+		raise IndexError("string runs past the end")
+	return (data[offset:end].decode('utf-8'), end)
+
+def _unpack_array(data, offset, length):
+	items = []
+	for i in xrange(length):
+		item, offset = _unpack(data, offset)
+		items.append(item)
+	return (items, offset)
+
+def _unpack_map(data, offset, length):
+	items = {}
+	for i in xrange(length):
+		key, offset = _unpack(data, offset)
+		value, offset = _unpack(data, offset)
+		items[key] = value
+	return (items, offset)
@@ -0,0 +1,336 @@
+from BaseHTTPServer import BaseHTTPRequestHandler
+from collections import deque
+
+import errno
+import fcntl
+import os
+import select
+import socket
+import threading
+import traceback
+
+from server import encode_response, handle_request, respond_when_done, \
+	is_connect, connect_client
+from codec import JSON, negotiate
+
+# Longest request head we buffer before giving up on a client
+MAX_HEADER_SIZE = 65536
+# Stop reading from a client while this much output is waiting for it
+MAX_PENDING_OUTPUT = 1 << 20
+
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+class _Reply():
+	"""A response slot, kept in the order the requests came in."""
+
+	def __init__(self, keep_alive, codec=JSON):
+		self.keep_alive = keep_alive
+		self.codec = codec
+		self.output = None
+
+class _Connection():
+	"""A client connection and its buffers."""
+
+	def __init__(self, sock, address):
+		self.sock = sock
+		self.address = address
+		self.input = ''
+		self.output = ''
+		self.replies = deque()
+		# No more requests are read once the client hung up or asked us to
+		self.done_reading = False
+		self.closed = False
+
+class EventLoopHTTPServer():
+	"""A single threaded HTTP server for Mechmania.
+
+	Serves every connection from one thread with poll, instead of a thread
+	per connection like ThreadedHTTPServer. Connections are kept alive
+	between requests (HTTP/1.1 keep-alive, or HTTP/1.0 with a keep-alive
+	header), and pipelined requests are answered in the order they were
+	sent. Requests are handled by the same handle_request and connect_client
+	as MMHandler, so the two servers behave the same.
+
+	A client connecting to a game isn't answered until the game fills up,
+	and a call queued for the engine isn't answered until the engine runs it.
+	Neither holds up the loop: the response slot just stays empty until the
+	callback comes.
+	"""
+
+	request_queue_size = 128
+	allow_reuse_address = True
+
+	def __init__(self, server_address):
+		self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		if self.allow_reuse_address:
+			self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.socket.bind(server_address)
+		self.server_address = self.socket.getsockname()
+		self.socket.listen(self.request_queue_size)
+		self.socket.setblocking(0)
+
+		# Other threads wake the loop up by writing to this pipe
+		self._wake_read, self._wake_write = os.pipe()
+		for fd in (self._wake_read, self._wake_write):
+			_set_nonblocking(fd)
+
+		self._poll = select.poll()
+		self._connections = {}
+		self._calls = deque()
+		self._running = False
+		self._stopped = threading.Event()
+		self._thread = None
+
+	def serve_forever(self):
+		"""Handle requests until shutdown is called."""
+
+		self._thread = threading.current_thread()
+		self._running = True
+		self._stopped.clear()
+		self._poll.register(self.socket.fileno(), select.POLLIN)
+		self._poll.register(self._wake_read, select.POLLIN)
+		try:
+			while self._running:
+				try:
+					events = self._poll.poll()
+				except select.error, e:
+					if e.args[0] == errno.EINTR:
+						continue
+					raise
+				for fd, event in events:
+					if fd == self.socket.fileno():
+						self._accept()
+					elif fd == self._wake_read:
+						self._drain_wake_pipe()
+					elif fd in self._connections:
+						self._handle_event(self._connections[fd], event)
+				self._run_calls()
+		finally:
+			for conn in self._connections.values():
+				self._close(conn)
+			self._poll.unregister(self.socket.fileno())
+			self._poll.unregister(self._wake_read)
+			self._thread = None
+			self._stopped.set()
+
+	def shutdown(self):
+		"""Stop serve_forever and wait for it to finish.
+
+		Like SocketServer's shutdown, this must be called from another thread
+		while serve_forever is running, or it will wait forever.
+		"""
+
+		self.call_soon(self._stop)
+		self._stopped.wait()
+
+	def server_close(self):
+		"""Close the listening socket."""
+
+		self.socket.close()
+		os.close(self._wake_read)
+		os.close(self._wake_write)
+
+	def call_soon(self, func, *args):
+		"""Run a function on the loop thread. Safe to call from any thread."""
+
+		self._calls.append((func, args))
+		if threading.current_thread() is not self._thread:
+			try:
+				os.write(self._wake_write, 'x')
+			except OSError, e:
+				# The pipe is full, so the loop will wake up anyway
+				if e.errno not in _WOULD_BLOCK:
+					raise
+
+	def _stop(self):
+		self._running = False
+
+	def _run_calls(self):
+		while self._calls:
+			func, args = self._calls.popleft()
+			func(*args)
+
+	def _drain_wake_pipe(self):
+		try:
+			while os.read(self._wake_read, 4096):
+				pass
+		except OSError, e:
+			if e.errno not in _WOULD_BLOCK:
+				raise
+
+	def _accept(self):
+		while True:
+			try:
+				sock, address = self.socket.accept()
+			except socket.error, e:
+				if e.args[0] in _WOULD_BLOCK or e.args[0] == errno.ECONNABORTED:
+					return
+				raise
+			sock.setblocking(0)
+			# Responses are small and sent in one go, don't hold them back
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			conn = _Connection(sock, address)
+			self._connections[sock.fileno()] = conn
+			self._poll.register(sock.fileno(), select.POLLIN)
+
+	def _handle_event(self, conn, event):
+		if event & select.POLLIN:
+			self._read(conn)
+		if event & (select.POLLHUP | select.POLLERR | select.POLLNVAL):
+			# Nobody is left to answer
+			self._close(conn)
+		elif not conn.closed and event & select.POLLOUT:
+			self._write(conn)
+
+	def _read(self, conn):
+		try:
+			data = conn.sock.recv(65536)
+		except socket.error, e:
+			if e.args[0] not in _WOULD_BLOCK:
+				self._close(conn)
+			return
+		if not data:
+			# The client hung up, answer what it already sent and close
+			conn.done_reading = True
+			self._write(conn)
+			return
+		conn.input += data
+		self._parse(conn)
+		self._write(conn)
+
+	def _parse(self, conn):
+		"""Handle every complete request in the connection's input."""
+
+		while not conn.done_reading:
+			end = conn.input.find('\r\n\r\n')
+			if end < 0:
+				if len(conn.input) > MAX_HEADER_SIZE:
+					self._reject(conn, 'Request header too large')
+				return
+
+			lines = conn.input[:end].split('\r\n')
+			request = lines[0].split()
+			if len(request) != 3:
+				self._reject(conn, 'Bad request line')
+				return
+			method, path, version = request
+
+			headers = {}
+			for line in lines[1:]:
+				name, _, value = line.partition(':')
+				headers[name.strip().lower()] = value.strip()
+			if 'transfer-encoding' in headers:
+				self._reject(conn, 'Chunked requests are not supported')
+				return
+			try:
+				length = int(headers.get('content-length', 0))
+			except ValueError:
+				length = -1
+			if length < 0:
+				self._reject(conn, 'Bad Content-Length')
+				return
+
+			start = end + 4
+			if len(conn.input) < start + length:
+				return
+			body = conn.input[start:start + length]
+			conn.input = conn.input[start + length:]
+
+			connection = headers.get('connection', '').lower()
+			if version == 'HTTP/1.1':
+				keep_alive = connection != 'close'
+			else:
+				keep_alive = connection == 'keep-alive'
+			if not keep_alive:
+				conn.done_reading = True
+
+			request_codec, codec = negotiate(headers.get('content-type'),
+				headers.get('accept'))
+			reply = _Reply(keep_alive, codec)
+			conn.replies.append(reply)
+			self._dispatch(conn, reply, method, path, body, request_codec)
+
+	def _reject(self, conn, error):
+		"""Answer a request we couldn't parse and close the connection."""
+
+		conn.done_reading = True
+		reply = _Reply(False)
+		conn.replies.append(reply)
+		self._finish(conn, reply, 400, {'error': error})
+
+	def _dispatch(self, conn, reply, method, path, body, codec):
+		try:
+			if method == 'GET':
+				output = {'error': 'GET request received but not expected'}
+				self._finish(conn, reply, 405, output)
+			elif method != 'POST':
+				self._finish(conn, reply, 501, {'error': 'Unsupported method'})
+			elif is_connect(path):
+				connect_client(lambda status, data:
+						self._finish(conn, reply, status, data))
+			else:
+				respond_when_done(handle_request(path, body, codec),
+					lambda status, data: self._finish(conn, reply, status, data))
+		except Exception:
+			# Don't let one bad request take down every connection
+			traceback.print_exc()
+			self._finish(conn, reply, 500, {'error': 'Internal server error'})
+
+	def _finish(self, conn, reply, status_code, data):
+		"""Fill in a response slot and send whatever is ready, in order."""
+
+		if threading.current_thread() is not self._thread:
+			self.call_soon(self._finish, conn, reply, status_code, data)
+			return
+		if conn.closed:
+			return
+
+		body = encode_response(status_code, data, reply.codec)
+		head = ['HTTP/1.1 %d %s' % (int(status_code),
+				BaseHTTPRequestHandler.responses.get(int(status_code), ('',))[0]),
+			'Content-Type: %s' % reply.codec.content_type,
+			'Content-Length: %d' % len(body)]
+		if not reply.keep_alive:
+			head.append('Connection: close')
+		reply.output = '\r\n'.join(head) + '\r\n\r\n' + body
+
+		while conn.replies and conn.replies[0].output is not None:
+			conn.output += conn.replies.popleft().output
+		self._write(conn)
+
+	def _write(self, conn):
+		if conn.closed:
+			return
+		if conn.output:
+			try:
+				sent = conn.sock.send(conn.output)
+			except socket.error, e:
+				if e.args[0] not in _WOULD_BLOCK:
+					self._close(conn)
+					return
+				sent = 0
+			conn.output = conn.output[sent:]
+
+		if conn.done_reading and not conn.output and not conn.replies:
+			self._close(conn)
+			return
+
+		events = 0
+		if not conn.done_reading and len(conn.output) < MAX_PENDING_OUTPUT:
+			events |= select.POLLIN
+		if conn.output:
+			events |= select.POLLOUT
+		self._poll.modify(conn.sock.fileno(), events)
+
+	def _close(self, conn):
+		if conn.closed:
+			return
+		conn.closed = True
+		fd = conn.sock.fileno()
+		self._poll.unregister(fd)
+		del self._connections[fd]
+		conn.sock.close()
+
+def _set_nonblocking(fd):
+	flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+	fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
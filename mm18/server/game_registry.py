@@ -0,0 +1,151 @@
+from client_manager import MMClientManager
+from mm18.game.game_controller import forget_game
+
+import os.path
+import threading
+import time
+
+class MMGame():
+	"""A game hosted by the server
+
+	Holds the id of the game, the client manager for its players, when it
+	started and finished, and the clients waiting for it to start as
+	(respond, reply) pairs.
+	"""
+
+	def __init__(self, game_id, client_manager):
+		self.id = game_id
+		self.client_manager = client_manager
+		self.started = False
+		self.finished_at = None
+		self.waiting = []
+
+class MMGameRegistry():
+	"""Mechmania Game Registry
+
+	Keeps track of every game on the server by game id. Connecting clients
+	are put in the lobby, the game that is still filling up, and a new
+	lobby opens once it is full. Requests are routed back to their game by
+	game id, or by auth token for clients that don't send one, which is
+	why auth tokens are unique across every game on the server.
+	"""
+
+	# Seconds a finished game is kept around to answer its clients
+	_finished_linger = 60
+
+	def __init__(self, players_per_game=4, max_games=1):
+		"""Set up an MMGameRegistry
+
+		players_per_game - The number of clients that fill a game
+		max_games - The number of games the server hosts before it shuts
+		down, or None to host games forever
+		"""
+
+		self.players_per_game = players_per_game
+		self.max_games = max_games
+		self.games = {}
+		self._lock = threading.Lock()
+		self._lobby = None
+		self._next_id = 1
+		self._issued_tokens = set()
+		self._games_by_token = {}
+
+	def lobby(self):
+		"""Get the game clients are currently joining.
+
+		Opens a new game if the last one filled up. Returns None once the
+		server has opened max_games games.
+		"""
+
+		with self._lock:
+			return self._current_lobby()
+
+	def _current_lobby(self):
+		if self._lobby is not None and not self._lobby.client_manager.is_full():
+			return self._lobby
+		if self.max_games is not None and self._next_id > self.max_games:
+			return None
+
+		self._reap()
+		manager = MMClientManager(self.players_per_game, self._issued_tokens)
+		self._lobby = MMGame(self._next_id, manager)
+		self.games[self._lobby.id] = self._lobby
+		self._next_id += 1
+		return self._lobby
+
+	def join(self):
+		"""Add a new client to the lobby.
+
+		Returns a tuple of the game and the (client_id, auth_token) tuple
+		from the client manager, or None if no game can take the client.
+		"""
+
+		with self._lock:
+			game = self._current_lobby()
+			if game is None:
+				return None
+			client = game.client_manager.add_client()
+			if client is None:
+				return None
+			self._games_by_token[client[1]] = game
+			return (game, client)
+
+	def find(self, client_id, token, game_id=None):
+		"""Find the game an authorized client plays in.
+
+		client_id - The id the client was given on connecting
+		token - The auth token the client was given on connecting
+		game_id - The game id the client was given, if it sent one
+
+		Returns the game, or None if the client isn't authorized.
+		"""
+
+		with self._lock:
+			if game_id is not None:
+				game = self.games.get(game_id)
+			else:
+				game = self._games_by_token.get(token)
+		if game is None:
+			return None
+		if not game.client_manager.auth.authorize_client(client_id, token):
+			return None
+		return game
+
+	def finish(self, game):
+		"""Mark a game as finished.
+
+		Returns True if the server has no more games to host, so it can shut
+		down.
+		"""
+
+		with self._lock:
+			if game.finished_at is None:
+				game.finished_at = time.time()
+			if self.max_games is None or self._next_id <= self.max_games:
+				return False
+			return all(other.finished_at is not None
+					for other in self.games.itervalues())
+
+	def game_log(self, game_log, game):
+		"""Get the log file name for a game.
+
+		A server hosting one game writes to game_log itself. Otherwise each
+		game gets its own file with the game id before the extension.
+		"""
+
+		if not game_log or self.max_games == 1:
+			return game_log
+		root, ext = os.path.splitext(game_log)
+		return "%s-%d%s" % (root, game.id, ext)
+
+	def _reap(self):
+		"""Forget games that finished a while ago. Needs the lock."""
+
+		now = time.time()
+		for game_id, game in self.games.items():
+			if game.finished_at is not None and \
+					now - game.finished_at > self._finished_linger:
+				del self.games[game_id]
+				for token in game.client_manager.auth.tokens():
+					self._games_by_token.pop(token, None)
+				forget_game(game_id)
@@ -0,0 +1,65 @@
+import re
+
+# Characters that make a URL pattern more than a plain path
+_REGEX_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+class Router():
+	"""Maps request paths to the handlers in urlpatterns.
+
+	Built once from a list of (pattern, method, handler) tuples like
+	urlpatterns. Patterns without any regex in them, like /game/status, are
+	looked up in a dict. The rest are joined into one compiled regex, with
+	each pattern in its own named group so the group that matched says which
+	handler to call.
+
+	Patterns match the whole path, ignoring any query string, so the order of
+	urlpatterns doesn't matter: /tower/(?P<id>\d+) can't match
+	/tower/1/upgrade.
+	"""
+
+	def __init__(self, patterns):
+		self._literal = {}
+		self._routes = {}
+		alternatives = []
+		for index, (pattern, method, handler) in enumerate(patterns):
+			if not _REGEX_CHARS.intersection(pattern):
+				self._literal.setdefault(pattern, handler)
+				continue
+
+			# Group names must be unique across the combined regex, so
+			# prefix them with the route and map them back after matching
+			route = '_r%d' % index
+			names = re.compile(pattern).groupindex.keys()
+			renamed = pattern
+			for name in names:
+				renamed = renamed.replace('(?P<%s>' % name,
+					'(?P<%s_%s>' % (route, name))
+			self._routes[route] = (handler,
+				[('%s_%s' % (route, name), name) for name in names])
+			alternatives.append('(?P<%s>%s)' % (route, renamed))
+
+		if alternatives:
+			self._regex = re.compile('(?:%s)\Z' % '|'.join(alternatives))
+		else:
+			self._regex = None
+
+	def match(self, path):
+		"""Find the handler for a path.
+
+		Returns a two-tuple of the handler and the dictionary of named groups
+		from its pattern, or None if no pattern matches.
+		"""
+
+		path = path.split('?', 1)[0]
+		handler = self._literal.get(path)
+		if handler is not None:
+			return (handler, {})
+		if self._regex is None:
+			return None
+
+		match = self._regex.match(path)
+		if match is None:
+			return None
+		handler, names = self._routes[match.lastgroup]
+		return (handler, dict((name, match.group(group))
+			for group, name in names))
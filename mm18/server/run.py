@@ -1,27 +1,77 @@
 #!/usr/bin/env python
 
 import server
+from event_server import EventLoopHTTPServer
+from game_registry import MMGameRegistry
 import logging
 import sys
+import argparse
+
+from mm18.game import constants
+
+THREADED_SERVER = 'threaded'
+EVENT_SERVER = 'event'
 
 def Main(**kwargs):
 	"""Run the MechMania server
 
 	Contains settings for the server logging function. Starts server logging
 	function. Starts server on port 6969 and serves forever.
+
+	The server is the threaded server unless server='event' is given, which
+	serves every connection from one thread and keeps connections alive.
 	"""
 	
 	if 'game_log' in kwargs:
 		server.game_log = kwargs['game_log']
-	serve = server.ThreadedHTTPServer(('localhost', 6969), server.MMHandler)
-	# This prevents errors where the socket is still bound
-	serve.allow_reuse_address = True
+	if 'mode' in kwargs:
+		server.engine_mode = kwargs['mode']
+	if 'policy' in kwargs:
+		server.tick_policy = kwargs['policy']
+	if 'games' in kwargs:
+		# Zero games means keep hosting games until killed
+		server.game_registry = MMGameRegistry(max_games=kwargs['games'] or None)
+	if kwargs.get('server') == EVENT_SERVER:
+		serve = EventLoopHTTPServer(('localhost', 6969))
+	else:
+		serve = server.ThreadedHTTPServer(('localhost', 6969), server.MMHandler)
+		# This prevents errors where the socket is still bound
+		serve.allow_reuse_address = True
 	server.server_instance = serve
 	print "Server starting on port 6969"
 	serve.serve_forever()
 
 if __name__ == '__main__':
-	if len(sys.argv) > 1:
-		Main(game_log=sys.argv[1])
+	parser = argparse.ArgumentParser(
+		description='Runs the MechMania 18 server.')
+	parser.add_argument('game_log', nargs='?', default=None,
+		help='File to write the game log to, gzipped if it ends in .gz or '
+			'in the binary log format if it ends in .mmlog')
+	parser.add_argument('--mode', choices=constants.ENGINE_MODES,
+		default=constants.REALTIME,
+		help='How the engine paces ticks: realtime plays one every tick time, '
+			'turbo runs as fast as possible, lockstep waits for every '
+			'client to acknowledge a tick')
+	parser.add_argument('--tick-policy', choices=constants.TICK_POLICIES,
+		default=constants.TICK_POLICY,
+		help='What realtime mode does when ticks run late: catchup plays '
+			'the late ticks back to back, skip drops them, degrade slows the '
+			'game down to the pace the ticks are taking')
+	parser.add_argument('--games', type=int, default=1,
+		help='Number of games to host, side by side, before shutting '
+			'down, or 0 to host games forever. With more than one game each '
+			'game logs to its own file, numbered after the game log name')
+	parser.add_argument('--server', choices=(THREADED_SERVER, EVENT_SERVER),
+		default=THREADED_SERVER,
+		help='How connections are served: threaded handles each request '
+			'on a new connection in its own thread, event serves every '
+			'connection from one thread and keeps them alive between '
+			'requests, including pipelined ones')
+	args = parser.parse_args()
+
+	if args.game_log:
+		Main(game_log=args.game_log, mode=args.mode, games=args.games,
+			server=args.server, policy=args.tick_policy)
 	else:
-		Main()
+		Main(mode=args.mode, games=args.games, server=args.server,
+			policy=args.tick_policy)
@@ -1,100 +1,250 @@
 from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 from SocketServer import ThreadingMixIn
 
-import re
-import json
-import time
+import threading
+import Queue
 
-from urls import urlpatterns
-from client_manager import MMClientManager
-from mm18.game.game_controller import init_game, game_running
+from urls import router
+from codec import JSON, negotiate
+from game_registry import MMGameRegistry
+from mm18.game.commands import CommandFuture
+from mm18.game.game_controller import init_game, game_running, command_result, \
+	EncodedJSON
+from mm18.game.constants import REALTIME, TICK_POLICY
 
 server_instance = None
-global_client_manager = MMClientManager()
+game_registry = MMGameRegistry()
 game_log = ""
+engine_mode = REALTIME
+tick_policy = TICK_POLICY
+
+def encode_response(status_code, data, codec=JSON):
+	"""Encodes the body of a response.
+
+	status_code -- HTTP status code of the response.
+	data -- dictionary to encode, or an EncodedJSON to send as is
+	codec -- the codec to encode it with, see codec.py
+
+	Returns the encoded string.
+	"""
+
+	if isinstance(data, EncodedJSON):
+		if codec is JSON:
+			return data.json
+		return data.encoded_as(codec)
+
+	# API defines status as being a part of the JSON going out
+	if 'status' not in data:
+		data['status'] = status_code
+	if int(status_code) == 404:
+		# Clear out any error that wasn't an empty string, and set one
+		# in case one wasn't already set
+		data['error'] = ''
+	return codec.encode(data)
+
+def handle_request(path, body, codec=JSON):
+	"""Handles a request for any path but /connect.
+
+	Looks up the function in urlpatterns from urls.py for the given path
+	with the router and calls it, so expect side effects from the game
+	controller.  It also handles deserialization of the body and will send a
+	400 error if given an invalid one.  Wil send a 404 if no matching URL is
+	found.
+
+	This does not depend on how the request came in, so every server front
+	end shares it.
+
+	path -- the path the request was made to
+	body -- the raw POST body
+	codec -- the codec the body is encoded with, see codec.py
+
+	Returns a two-tuple of the status code and the dictionary to respond with,
+	or a CommandFuture for it if the call was queued for the engine. Pass it
+	to respond_when_done to respond with either.
+	"""
+
+	# Get the data from the method
+	try:
+		data = codec.decode(body)
+	except ValueError:
+		# Invalid JSON
+		return (400, {'error': 'Invalid or non-JSON POST data recieved'})
+
+	# Every call but connect requires authorization
+	game, error = validate_client(data)
+	if game is None:
+		return error
+
+	# Check that the game is running
+	if not game_running(game.id):
+		print "Game done"
+		if game_registry.finish(game):
+			spin_down()
+		return (404, {'error': 'Game has ended'})
+
+	# Tell the game controller which game the request is for
+	data['game'] = game.id
+
+	route = router.match(path)
+	if route is None:
+		# no url match found, send 404
+		return (404, {'error': 'API call not found'})
+
+	# The handler is called with the group dictionary from the url pattern
+	# and the unrolled JSON data as keyworded arguments. A two-tuple is
+	# returned, which is passed back to be responded with
+	handler, groups = route
+	return handler(groups, **data)
+
+def respond_when_done(response, respond):
+	"""Respond with what handle_request returned.
+
+	respond -- called with the status code and the dictionary to respond
+	with, straight away or from the engine thread once a queued call has run.
+	"""
+
+	if isinstance(response, CommandFuture):
+		response.add_done_callback(
+			lambda future: respond(*command_result(future)))
+	else:
+		respond(*response)
+
+def is_connect(path):
+	"""Whether a path is the connect call, which handle_request doesn't do."""
+
+	# Special case connection. Shut up I know it's ugly.
+	return path.split('?', 1)[0] == '/connect'
+
+def connect_client(respond):
+	"""Connect a new client to a game.
+
+	When a client attempts to connect we put them in the game that is
+	filling up, if the server still takes games. The client isn't answered
+	until its game starts, so rather than waiting this takes a callback.
+
+	respond -- called with the status code and the dictionary to respond with
+	once the client can be answered. It may be called from the thread
+	connecting a different client.
+	"""
+
+	print "Connecting client"
+	joined = game_registry.join()
+	if joined is None:
+		# Server is full, no connection for you!
+		respond(403, {'error': 'Server is full'})
+		return
+
+	# Prepare the dictionary to send back to the user
+	game, client = joined
+	reply = {}
+	reply['id'] = client[0]
+	reply['auth'] = client[1]
+	reply['game'] = game.id
+
+	# Get the run lock on the client manager
+	client_manager = game.client_manager
+	with client_manager.game_condition:
+		if game.started:
+			# Another client filled the game and started it already
+			waiting = []
+		elif client_manager.is_full():
+			print "Game", game.id, "is full, starting"
+			# Start the game and let everyone know we started it
+			_start_game(game)
+			waiting = game.waiting
+			game.waiting = []
+		else:
+			print "Game", game.id, "is still not full, waiting on more players"
+			# Whoever fills up the game answers us
+			game.waiting.append((respond, reply))
+			return
+
+	# TODO: Game has started, add any info given in start
+	for waiting_respond, waiting_reply in waiting:
+		waiting_respond(200, waiting_reply)
+	respond(200, reply)
+
+def validate_client(json):
+	"""Validate a client's request to proceed.
+
+	Checks with the game registry that a client is who they say they are.
+	Kicks anyone out who doesn't meet the bouncer's minimum requirements.
+
+	Returns a two-tuple of the client's game and None, or None and the
+	status code and dictionary to respond with if they were kicked out.
+	"""
+
+	try:
+		client_id = json['id']
+		token = json['auth']
+	except:
+		status = {'error': 'Valid JSON but missing required input keys'}
+		return (None, (400, status))
+
+	game = game_registry.find(client_id, token, json.get('game'))
+	if game is not None:
+		return (game, None)
+	else:
+		# Bad call to client, bail us out
+		return (None, (401, {'error': 'Bad id or auth code'}))
+
+def _start_game(game):
+	init_game(game.client_manager, game_registry.game_log(game_log, game),
+		engine_mode, game.id, tick_policy)
+	game.started = True
+
+def spin_down():
+	"""Shut down the server in five seconds, once the last game is over."""
+
+	# So let's wait for five seconds, then shut down the server
+	timer = threading.Timer(5, _shut_down)
+	timer.daemon = True
+	timer.start()
+
+def _shut_down():
+	if server_instance is not None:
+		server_instance.shutdown()
+	else:
+		# Don't know what server we're on, we're pretty fucked
+		print "The server should have shut down now, but it wasn't set up"
+		print "You'll probably need to type 'killall python' to fix this"
 
 class MMHandler(BaseHTTPRequestHandler):
-	"""HTTP request handler for Mechmania"""
+	"""HTTP request handler for Mechmania
+
+	Used by ThreadedHTTPServer, which handles each connection in its own
+	thread and closes it after one request.
+	"""
+
+	# The codec responses are encoded with, picked for each request
+	codec = JSON
 
 	def respond(self, status_code, data):
 		"""
-		Responds by sending JSON data back.
+		Responds by sending the encoded data back.
 
 		status_code -- string containting HTTP status code.
-		data -- dictionary to encode to JSON
+		data -- dictionary to encode
 		"""
 
+		output = encode_response(status_code, data, self.codec)
 		self.send_response(int(status_code))
-		# API defines status as being a part of the JSON going out
-		if 'status' not in data:
-			data['status'] = status_code
-		if int(status_code) == 404:
-			# Clear out any error that wasn't an empty string, and set one
-			# in case one wasn't already set
-			data['error'] = ''
-		print data
-		output = json.dumps(data)
-		self.send_header("Content-type", "application/json")
+		self.send_header("Content-type", self.codec.content_type)
 		self.end_headers()
 		self.wfile.write(output)
 
 	def match_path(self):
-		"""Tries to match a path with every url in urlpatterns.
-
-		Searches through the urlpatterns to find a URL matching the given path.
-		If it finds one, it tries to call it.  Then it breaks out, so it will
-		only call the first pattern it matches.  This method calls the
-		corresponding function in urlpatterns from urls.py, so expect side
-		effects from the game controller.  It also handles serializtion of JSON
-		and will send a 400 error if given invalid JSON.  Wil send a 404 if no
-		matching URL is found.
-		"""
+		"""Handles the request, see handle_request and connect_client."""
 
-		# Special case connection. Shut up I know it's ugly.
-		connect_match = re.match(r'/connect', self.path)
-		if connect_match:
+		request_codec, self.codec = negotiate(
+			self.headers.get('Content-Type'), self.headers.get('Accept'))
+		if is_connect(self.path):
 			self._connect_client()
 			return
 
-		# Get the data from the method
-		try:
-			data = self._process_POST_data()
-		except ValueError:
-			# Invalid JSON
-			output = {'error': 'Invalid or non-JSON POST data recieved'}
-			self.respond(400, output)
-			return
-
-		# Every call but connect requires authorization
-		if not self._validate_client(data):
-			return
-
-		# Check that the game is running
-		if not game_running():
-			print "Game done"
-			output = {'error': 'Game has ended'}
-			self.respond(404, output)
-			self._spin_down()
-			return
-
-		for url in urlpatterns:
-			match = re.match(url[0], self.path)
-
-			# check if match is found
-			if match:
-
-				# url[2] is the function referenced in the url to call
-				# It is called with the group dictionary from the regex
-				# and the unrolled JSON data as keyworded arguments
-				# A two-tuple is returned, which is unrolled and passed as
-				# arguments to respond
-				self.respond(*url[2](match.groupdict(), **data))
-				return
-
-		# no url match found, send 404
-		output = {'error': 'API call not found'}
-		self.respond(404, output)
-		return
+		response = handle_request(self.path, self._read_POST_data(),
+			request_codec)
+		self._wait_for(lambda respond: respond_when_done(response, respond))
 
 	def do_GET(self):
 		"""Handle all GET requests.
@@ -112,103 +262,23 @@ class MMHandler(BaseHTTPRequestHandler):
 
 		self.match_path()
 
-	def _process_POST_data(self):
-		"""Processes the POST data from a request. Private method.
-
-		Reads in a request and returns a dictionary based on whether or not the
-		request is a POST request and what POST data the request contains if it
-		is.
-		
-		Throws ValueError on invalid JSON.
-
-		Returns POST data in a dictionary.
-		"""
+	def _read_POST_data(self):
+		"""Reads the raw POST data from a request. Private method."""
 
 		length = int(self.headers['Content-Length'])
-		input = self.rfile.read(length)
-		data = json.loads(input)
-
-		return data
+		return self.rfile.read(length)
 
 	def _connect_client(self):
-		"""Connect a new client to the game.
-
-		When a client attempts to connect we connect them to the game if
-		allowed (not already connected, server is not full).
-		"""
-
-		print "Connecting client"
-		client = global_client_manager.add_client()
-		if client is None:
-			# Server is full, no connection for you!
-			self.respond(403, {'error': 'Server is full'})
-			return
-
-		# Prepare the dictionary to send back to the user
-		reply = {}
-		reply['id'] = client[0]
-		reply['auth'] = client[1]
-		self._wait_for_game_init(reply)
+		"""Connects the client and waits for its game to start."""
 
-	def _wait_for_game_init(self, reply):
-		"""Wait for the game to start before returning to the client.
+		self._wait_for(connect_client)
 
-		After a client has joined the game, we wait for the game to start
-		before sending them back information about the game.
-		"""
-		# Get the run lock on the client manager
-		global_client_manager.game_condition.acquire()
-		if global_client_manager.is_full():
-			print "Game is full, starting"
-			# Start the game and let everyone know we started it
-			self._start_game()
-			global_client_manager.game_condition.notify_all()
-			# Release the run lock
-			global_client_manager.game_condition.release()
-		else:
-			print "Game is still not full, waiting on more players"
-			# Spin waiting for the server to fill up. This releases the
-			# run lock and waits for the game to start
-			global_client_manager.game_condition.wait()
-			global_client_manager.game_condition.release()
-
-		# TODO: Game has started, add any info given in start
-		self.respond(200, reply)
-
-	def _validate_client(self, json):
-		"""Validate a client's request to proceed.
+	def _wait_for(self, func):
+		"""Calls func with a respond callback and waits for it to be called."""
 
-		Checks with the client manager that a client is who they say they are.
-		Kicks anyone out who doesn't meet the bouncer's minimum requirements.
-		"""
-
-		try:
-			client_id = json['id']
-			token = json['auth']
-		except:
-			status = {'error': 'Valid JSON but missing required input keys'}
-			self.respond(400, status)
-			return False
-
-		if global_client_manager.auth.authorize_client(client_id, token):
-			return True
-		else:
-			# Bad call to client, bail us out
-			self.respond(401, {'error': 'Bad id or auth code'})
-			return False
-
-	def _start_game(self):
-		init_game(global_client_manager, game_log)
-
-	def _spin_down(self):
-		# So let's wait for five seconds, then shut down the server
-		time.sleep(5)
-		if server_instance is not None:
-			server_instance.shutdown()
-		else:
-			# Don't know what server we're on, we're pretty fucked
-			print "The server should have shut down now, but it wasn't set up"
-			print "You'll probably need to type 'killall python' to fix this"
+		replies = Queue.Queue()
+		func(lambda status, data: replies.put((status, data)))
+		self.respond(*replies.get())
 
 class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
 	"""A basic threaded HTTP server."""
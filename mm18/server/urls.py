@@ -1,16 +1,20 @@
 """URL Patterns for mapping URLs to the appropriate functions."""
 
 from mm18.game.game_controller import *
+from router import Router
 
 urlpatterns = [
 	# Commands for overall game
 	(r'/game/status', 'POST', get_game_status),
+	(r'/game/ack', 'POST', game_ack),
+	(r'/game/subscribe', 'POST', game_subscribe),
 
 	# Commands for player control, status, etc
 	(r'/player/(?P<id>\d+)', 'POST', get_player_status),
 
 	# Commands for retrieving representation details
 	(r'/board/(?P<id>\d+)', 'POST', board_get),
+	(r'/board/(?P<id>\d+)/layout', 'POST', board_layout),
 
 	# Tower API
 	(r'/tower/(?P<id>\d+)/upgrade', 'POST', tower_upgrade),
@@ -25,8 +29,17 @@ urlpatterns = [
 	# Constants API
 	(r'/constants', 'POST', constants_get),
 
+	# Metrics API, the engine's tick timings
+	(r'/metrics', 'POST', get_metrics),
+
+	# Batch API, runs a list of the calls above in one request
+	(r'/batch', 'POST', batch_handler(lambda path: router.match(path))),
+
 	# Connection API
 	# This exists, but is implemented in server. Leave it here to document.
 	# I'm aware it's not the prettiest of solutions.
 	#(r'/connect', 'POST', connect),
 ]
+
+# Built once, requests are routed through this
+router = Router(urlpatterns)
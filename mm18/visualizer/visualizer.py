@@ -1,10 +1,10 @@
 import os
 import pyglet
 from pyglet.gl import *
+from pyglet.window import key
 
 from mm18.game import constants
 from mm18.game.board import Board
-from mm18.game.replayer import Replayer
 
 TILE_SIZE = 32
 PADDING = TILE_SIZE
@@ -13,6 +13,8 @@ FRAMES_PER_SECOND = 10
 TICKS_PER_FRAME = TICKS_PER_SECOND / FRAMES_PER_SECOND
 BOARD_ROWS = 2
 BOARD_COLS = 2
+# Ticks the arrow keys skip backwards and forwards
+SEEK_TICKS = 100
 
 resources_path = os.path.join(os.path.dirname(__file__), 'resources')
 pyglet.resource.path.append(resources_path)
@@ -29,8 +31,8 @@ tex_explosion = pyglet.resource.image('explosion.png')
 
 class Visualizer:
 
-	def __init__(self, actions, player_ids=None):
-		self.replayer = Replayer(actions)
+	def __init__(self, replayer, player_ids=None):
+		self.replayer = replayer
 		self.replayer.setup_game()
 		self.game = self.replayer.game
 		if player_ids:
@@ -46,6 +48,7 @@ class Visualizer:
 			height=rows * (TILE_SIZE * constants.BOARD_SIDE + PADDING),
 		)
 		self.window.set_handler('on_draw', self.draw)
+		self.window.set_handler('on_key_press', self.on_key_press)
 		pyglet.clock.schedule_interval(self.update, 1.0 / TICKS_PER_SECOND)
 		glClearColor(1, 1, 1, 1)
 		glEnable(GL_BLEND)
@@ -59,6 +62,20 @@ class Visualizer:
 			if self.tick_summary == None:
 				pyglet.clock.unschedule(self.update)
 
+	def on_key_press(self, symbol, modifiers):
+		# Left and right skip through the game, from checkpoints
+		if symbol == key.LEFT:
+			tick = self.game.currTick - SEEK_TICKS
+		elif symbol == key.RIGHT:
+			tick = self.game.currTick + SEEK_TICKS
+		else:
+			return
+		self.replayer.seek(max(tick, 0))
+		self.game = self.replayer.game
+		self.tick_summary = None
+		pyglet.clock.unschedule(self.update)
+		pyglet.clock.schedule_interval(self.update, 1.0 / TICKS_PER_SECOND)
+
 	def draw(self):
 		self.window.clear()
 
@@ -0,0 +1,247 @@
+#! /usr/bin/env python
+
+"""Runs the benchmarks, and fails if they got slower than the baseline.
+
+Run it from the top of the repository with
+
+	python -m mmbench.bench [names...]
+
+Each benchmark is timed over several runs, each at least MIN_TIME long,
+and given as the median of their calls a second. Machines differ in speed,
+so every run also times a fixed piece of plain Python the same way, and
+the median speed relative to that is what is compared with the baseline. Each benchmark also counts the objects a call
+allocates that are still alive when it returns, what it returns included,
+from the count the garbage collector keeps, which doesn't depend on the
+machine at all.
+
+The results are written as JSON. They are compared with the baseline saved
+in baseline.json, and any benchmark slower or allocating more than the
+tolerances allow is a regression, which makes the exit status 1. After a
+change that is meant to make something slower, save new results as the
+baseline with --save-baseline.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+from contextlib import contextmanager
+
+from mm18.game.scheduler import monotonic
+
+from mmbench.benchmarks import BENCHMARKS
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+	'baseline.json')
+# Runs of each benchmark, the median of which counts
+REPEAT = 7
+# Seconds of calls timed in each run, setting the benchmark up again as
+# often as it takes
+MIN_TIME = .05
+# Calls of the calibration on one setup
+CALIBRATION_CALLS = 200
+# Most a benchmark may slow down relative to the baseline, as a fraction
+TOLERANCE = .25
+# Benchmarks whose calls took less than FAST_CALL seconds in the baseline are
+# timed as much for the loop calling them as for what they do, and vary
+# more from run to run, so they may slow down by FAST_TOLERANCE
+FAST_CALL = .00001
+FAST_TOLERANCE = .5
+# Most the allocations of a call may grow relative to the baseline, as a
+# fraction, on top of half an object for rounding
+ALLOCATION_TOLERANCE = .1
+
+def _calibration_work():
+	counts = {}
+	total = 0
+	for i in xrange(1000):
+		key = i % 37
+		counts[key] = counts.get(key, 0) + i
+		total += len(counts)
+	return total
+
+@contextmanager
+def calibration():
+	"""Plain Python the benchmarks are measured against."""
+
+	yield _calibration_work
+
+def _rate(setup, number, min_time):
+	"""Calls a second, timing number calls on a fresh setup at a time until
+	min_time seconds of calls have been timed."""
+
+	calls = 0
+	elapsed = 0
+	while not calls or elapsed < min_time:
+		with setup() as func:
+			gc.collect()
+			start = monotonic()
+			for call in xrange(number):
+				func()
+			elapsed += monotonic() - start
+		calls += number
+	return calls / max(elapsed, 1e-9)
+
+def _median(values):
+	values = sorted(values)
+	middle = len(values) // 2
+	if len(values) % 2:
+		return values[middle]
+	return (values[middle - 1] + values[middle]) / 2.0
+
+def measure(setup, number=100, repeat=REPEAT, min_time=MIN_TIME):
+	"""Times a benchmark.
+
+	setup -- the benchmark's setup, see benchmarks.py
+	number -- most calls to make on one setup
+	repeat -- runs to time
+	min_time -- seconds of calls to time in each run
+
+	Returns a dict of the median calls a second, the median of the same
+	relative to the calibration, and the objects allocated by a call in
+	another run.
+	"""
+
+	# The calibration is timed along with every run, so both are timed
+	# while the machine is as busy
+	rates = []
+	relatives = []
+	for run in range(repeat):
+		calibrated = _rate(calibration, CALIBRATION_CALLS, min_time)
+		rate = _rate(setup, number, min_time)
+		rates.append(rate)
+		relatives.append(rate / calibrated)
+
+	# The collector counts objects it tracks as they are allocated and
+	# freed, so with it stopped the count goes up by the objects still
+	# alive, and the results are kept alive to count them too
+	with setup() as func:
+		gc.collect()
+		gc.disable()
+		try:
+			kept = []
+			before = gc.get_count()[0]
+			for call in xrange(number):
+				kept.append(func())
+			allocated = gc.get_count()[0] - before
+		finally:
+			gc.enable()
+		del kept
+
+	return {
+		'ops_per_sec': _median(rates),
+		'relative': _median(relatives),
+		'allocations': allocated / float(number),
+		'number': number,
+		'repeat': repeat,
+		'min_time': min_time,
+	}
+
+def run(names=None, repeat=REPEAT, min_time=MIN_TIME, out=None):
+	"""Runs the benchmarks.
+
+	names -- only run the benchmarks with one of these in their name, or
+	every benchmark if None
+	repeat -- runs of each benchmark to time
+	min_time -- seconds of calls to time in each run
+	out -- a file to print each result to as it comes in
+
+	Returns the results as a dict, as written to the results file.
+	"""
+
+	results = {
+		'python': platform.python_version(),
+		'benchmarks': {},
+	}
+	for name, setup, number in BENCHMARKS:
+		if names and not any(part in name for part in names):
+			continue
+		result = measure(setup, number, repeat, min_time)
+		results['benchmarks'][name] = result
+		if out is not None:
+			print >>out, "%-45s %12.1f/s %10.5f %8.1f objects" % (name,
+				result['ops_per_sec'], result['relative'],
+				result['allocations'])
+	return results
+
+def compare(results, baseline, tolerance=TOLERANCE,
+		allocation_tolerance=ALLOCATION_TOLERANCE):
+	"""Compares results with a baseline.
+
+	Benchmarks that aren't in both are left out. Those with calls quicker
+	than FAST_CALL in the baseline may slow down by FAST_TOLERANCE, if that
+	is more than tolerance.
+
+	Returns a list of strings describing each regression.
+	"""
+
+	regressions = []
+	for name, result in sorted(results['benchmarks'].iteritems()):
+		base = baseline['benchmarks'].get(name)
+		if base is None:
+			continue
+		allowed = tolerance
+		if base['ops_per_sec'] * FAST_CALL > 1:
+			allowed = max(tolerance, FAST_TOLERANCE)
+		slower = 1 - result['relative'] / base['relative']
+		if slower > allowed:
+			regressions.append("%s is %d%% slower" % (name, slower * 100))
+		allowed = base['allocations'] * (1 + allocation_tolerance) + .5
+		if result['allocations'] > allowed:
+			regressions.append("%s allocates %.1f objects a call, up from %.1f"
+				% (name, result['allocations'], base['allocations']))
+	return regressions
+
+def load(path):
+	with open(path) as resultsFile:
+		return json.load(resultsFile)
+
+def save(results, path):
+	with open(path, 'w') as resultsFile:
+		json.dump(results, resultsFile, indent=2, sort_keys=True)
+
+def main():
+	parser = argparse.ArgumentParser(
+		description='Benchmarks the MechMania 18 engine and server.')
+	parser.add_argument('names', nargs='*',
+		help='Only run the benchmarks with one of these in their name')
+	parser.add_argument('--repeat', type=int, default=REPEAT,
+		help='Runs of each benchmark, the median of which counts')
+	parser.add_argument('--min-time', type=float, default=MIN_TIME,
+		help='Seconds of calls to time in each run')
+	parser.add_argument('--output',
+		help='File to write the results to as JSON')
+	parser.add_argument('--baseline', default=BASELINE,
+		help='Results to compare with, by default mmbench/baseline.json')
+	parser.add_argument('--save-baseline', action='store_true',
+		help='Write the results to the baseline instead of comparing')
+	parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+		help='Fraction a benchmark may slow down before it fails')
+	args = parser.parse_args()
+
+	results = run(args.names, repeat=args.repeat, min_time=args.min_time,
+		out=sys.stdout)
+	if args.output:
+		save(results, args.output)
+	if args.save_baseline:
+		save(results, args.baseline)
+		print "Saved the baseline to", args.baseline
+		return 0
+
+	try:
+		baseline = load(args.baseline)
+	except IOError:
+		print "No baseline at", args.baseline
+		return 0
+	regressions = compare(results, baseline, args.tolerance)
+	for regression in regressions:
+		print "REGRESSION:", regression
+	if regressions:
+		return 1
+	print "No regressions against", args.baseline
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,140 @@
+#! /usr/bin/env python
+
+"""The benchmarks, each timing one of the engine's hot paths.
+
+A benchmark is a name, a setup and how many calls can be made on one setup
+of it while it still measures the same thing. The setup is a context manager
+which sets up whatever the benchmark needs and gives the function to call,
+then cleans up after it. Benchmarks of a board run on player 1's board of a scenario.
+"""
+
+import httplib
+import itertools
+import json
+import threading
+from contextlib import contextmanager
+from functools import partial
+
+from mm18.game import constants
+from mm18.game import game_controller
+from mm18.game.layout import BoardLayout
+from mm18.server import server
+from mm18.server.event_server import EventLoopHTTPServer
+from mm18.server.game_registry import MMGameRegistry
+from mmbench import scenarios
+from mmbench.scenarios import SCENARIOS
+
+BOARD_FILE = 'board2.json'
+
+@contextmanager
+def advance(scenario):
+	"""Engine.advance, playing a tick of every player's board."""
+
+	engine = scenario()
+	yield engine.advance
+
+@contextmanager
+def fire_towers(scenario):
+	"""Board.fireTowers, on units too tough to die, so every call fires the
+	same shots."""
+
+	board = scenario().get_player(1).board
+	for position, unit in board.units():
+		unit.health = scenarios.HEALTH
+	board.unitsPlaced()
+	yield board.fireTowers
+
+@contextmanager
+def hit_list(scenario):
+	"""Board.removeFromHitList and addToHitList, taking each tower out of
+	the hitList and putting it back in turn."""
+
+	board = scenario().get_player(1).board
+	towers = itertools.cycle(sorted(board.getTowers().items()))
+	def refresh():
+		position, tower = next(towers)
+		board.refreshHitList(tower, position)
+	yield refresh
+
+@contextmanager
+def units(scenario):
+	"""Board.units, listing the units on the board."""
+
+	board = scenario().get_player(1).board
+	yield board.units
+
+@contextmanager
+def order_path_squares():
+	"""BoardLayout.orderPathSquaresByClosest on the game's board."""
+
+	layout = BoardLayout.load(BOARD_FILE)
+	yield partial(BoardLayout.orderPathSquaresByClosest, layout.base,
+		layout.pathSet)
+
+@contextmanager
+def find_paths():
+	"""BoardLayout.findPaths on the game's board."""
+
+	yield BoardLayout.load(BOARD_FILE).findPaths
+
+@contextmanager
+def board_requests():
+	"""Requests for a board over HTTP, one at a time on a kept alive
+	connection to the event loop server, in a lockstep game no client
+	acknowledges so it barely advances."""
+
+	saved = (server.game_registry, server.engine_mode, server.game_log)
+	server.game_registry = MMGameRegistry(players_per_game=2, max_games=None)
+	server.engine_mode = constants.LOCKSTEP
+	server.game_log = ""
+	httpServer = EventLoopHTTPServer(('localhost', 0))
+	thread = threading.Thread(target=httpServer.serve_forever)
+	thread.daemon = True
+	thread.start()
+	# A game needs two players, and neither is answered until both connect
+	connection, opponent = [httplib.HTTPConnection('localhost',
+		httpServer.server_address[1]) for player in range(2)]
+	client = None
+	try:
+		connection.request('POST', '/connect', '{}')
+		opponent.request('POST', '/connect', '{}')
+		opponent.getresponse().read()
+		client = json.loads(connection.getresponse().read())
+		body = json.dumps({'id': client['id'], 'auth': client['auth'],
+			'game': client['game']})
+		path = '/board/%d' % client['id']
+		def request():
+			connection.request('POST', path, body)
+			return connection.getresponse().read()
+		yield request
+	finally:
+		connection.close()
+		opponent.close()
+		if client is not None:
+			engine = game_controller.get_engine(client['game'])
+			if engine is not None:
+				with engine.lock:
+					engine.endGame()
+				engine.thread.join()
+			game_controller.forget_game(client['game'])
+		httpServer.shutdown()
+		httpServer.server_close()
+		server.game_registry, server.engine_mode, server.game_log = saved
+
+def _scenarios(name, setup, number, names):
+	return [('%s/%s' % (name, scenarioName), partial(setup, scenario), number)
+		for scenarioName, scenario in SCENARIOS if scenarioName in names]
+
+ALL_SCENARIOS = [scenarioName for scenarioName, scenario in SCENARIOS]
+TOWER_SCENARIOS = ['saturated_towers', 'late_game']
+
+# As (name, setup, most calls on one setup), in the order they are run
+BENCHMARKS = \
+	_scenarios('Engine.advance', advance, 200, ALL_SCENARIOS) + \
+	_scenarios('Board.fireTowers', fire_towers, 200, TOWER_SCENARIOS) + \
+	_scenarios('Board.hitList', hit_list, 20000, TOWER_SCENARIOS) + \
+	_scenarios('Board.units', units, 5000, ALL_SCENARIOS) + [
+	('BoardLayout.orderPathSquaresByClosest', order_path_squares, 2000),
+	('BoardLayout.findPaths', find_paths, 2000),
+	('server.board', board_requests, 500),
+]
@@ -0,0 +1,125 @@
+#! /usr/bin/env python
+
+"""Games set up to benchmark in, each in a known state.
+
+Every scenario is a four player game on the board every game is played on,
+built the same way every time, so the benchmarks measure the same work on
+every run. The players are given more health and resources than any game
+would, so nobody dies and every purchase succeeds while a benchmark runs.
+"""
+
+import random
+
+from mm18.game import constants
+from mm18.game.engine import Engine
+from mm18.game.units import Unit
+
+PLAYERS = 4
+# Enough that no player dies however long a benchmark plays
+HEALTH = 10 ** 9
+RESOURCES = 10 ** 9
+# Units queued at the entrance of each path by the scenarios that fill them,
+# more than any benchmark advances the game
+WAITING_UNITS = 1000
+
+def new_game():
+	"""A game with PLAYERS players, at the start with nothing built."""
+
+	engine = Engine(mode=constants.TURBO)
+	for player_id in range(1, PLAYERS + 1):
+		player = engine.add_player(player_id)
+		player.health = HEALTH
+		player.resources = RESOURCES
+		player.allowedUpgrade = constants.MAX_UPGRADE
+	return engine
+
+def tower_squares(board):
+	"""Every square a tower can go on that is next to the board's path."""
+
+	squares = set()
+	for x, y in board.path:
+		for position in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+			if board.validPosition(position):
+				squares.add(position)
+	return sorted(squares)
+
+def fill_paths(engine, player, rng=None, waiting=WAITING_UNITS):
+	"""Put a unit on every square of every path on a player's board.
+
+	The units are sent by the other players, level 0 unless rng is given to
+	pick levels and specialisations, and waiting more are queued at each
+	path's entrance so the paths stay full as the game advances.
+	"""
+
+	senders = [engine.players[name] for name in sorted(engine.players)
+		if name != player.name]
+	def unit(index):
+		sender = senders[index % len(senders)]
+		if rng is None:
+			return Unit(0, 0, sender)
+		return Unit(rng.randint(0, constants.MAX_UPGRADE),
+			rng.randint(-1, 1), sender)
+
+	board = player.board
+	for path in board.paths.itervalues():
+		if path.moving is None:
+			continue
+		for index in range(len(path.moving)):
+			path.moving[index] = unit(index)
+		for index in range(waiting):
+			path.start(unit(index))
+	board.unitsPlaced()
+
+def empty_board():
+	"""No towers and no units anywhere."""
+
+	return new_game()
+
+def saturated_towers():
+	"""Every player has a tower on every square next to their path, and a
+	unit on every square of it."""
+
+	engine = new_game()
+	for player_id, player in sorted(engine.players.iteritems()):
+		for position in tower_squares(player.board):
+			engine.tower_create(player_id, position)
+		fill_paths(engine, player)
+	return engine
+
+def full_paths():
+	"""No towers, with a unit on every square of all four paths of every
+	board and a long queue behind each."""
+
+	engine = new_game()
+	for player in engine.players.itervalues():
+		fill_paths(engine, player)
+	return engine
+
+def late_game():
+	"""A game well into its second half, with towers of every level on about
+	half the squares next to each path and units of every level on them."""
+
+	rng = random.Random('late_game')
+	engine = new_game()
+	for player_id, player in sorted(engine.players.iteritems()):
+		for position in tower_squares(player.board):
+			if rng.random() < .5:
+				continue
+			tower = engine.tower_create(player_id, position)
+			for upgrade in range(rng.randint(0, constants.MAX_UPGRADE)):
+				engine.tower_upgrade(tower.ID, player_id)
+			if tower.upgrade:
+				engine.tower_specialize(tower.ID, player_id,
+					rng.choice((-1, 1)))
+		fill_paths(engine, player, rng)
+		player.sentUnits = constants.UPGRADE_INCREASE * constants.MAX_UPGRADE
+	engine.currTick = constants.MAX_RUNTIME * 3 / 4
+	return engine
+
+# By name, in the order they are benchmarked
+SCENARIOS = [
+	('empty_board', empty_board),
+	('saturated_towers', saturated_towers),
+	('full_paths', full_paths),
+	('late_game', late_game),
+]
@@ -1,4 +1,11 @@
 import unittest
+import json
+import os
+import shutil
+import tempfile
+import threading
+import Queue
+from functools import partial
 import mm18.game.constants
 from mm18.game.tower import Tower
 from mm18.game.units import Unit
@@ -6,6 +13,15 @@ from mm18.game.board import Board
 from mm18.game.player import Player
 from mm18.game.path import Path
 from mm18.game.engine import Engine
+from mm18.game.commands import EngineStopped
+from mm18.game.tick_feed import TickFeed
+from mm18.game.log_writer import LogWriter, open_log
+from mm18.game.binary_log import BinaryLog
+from mm18.game.replayer import Replayer
+from mm18.game.metrics import Histogram
+from mm18.game.scheduler import TickScheduler
+from mm18.game import batch
+from mmbench import bench, benchmarks, scenarios
 
 """Tests for the game code go here"""
 class TestGame(unittest.TestCase):
@@ -103,6 +119,25 @@ class TestGame(unittest.TestCase):
 		self.testBoard.addToHitList(tower, (0,0))
 		print self.testBoard.hitList
 
+	def testLayoutShared(self):
+		board1 = Board.jsonLoad("board2.json")
+		board2 = Board.jsonLoad("board2.json")
+		self.assertTrue(board1.layout is board2.layout)
+		self.assertTrue(board1.coverage is board2.coverage)
+		board1.addItem(Tower(self.testPlayer, 1), (1, 1))
+		self.assertEquals(len(board2.tower), 0)
+		self.assertFalse(board1.paths[0] is board2.paths[0])
+
+	def testRemoveFromHitList(self):
+		tower = Tower(self.testPlayer, 1)
+		self.testBoard.addItem(tower, (2, 2))
+		self.assertTrue(tower in self.testBoard.hitList[(1, 2)])
+		self.testBoard.refreshHitList(tower, (2, 2))
+		self.assertEquals(self.testBoard.hitList[(1, 2)].count(tower), 1)
+		self.testBoard.removeItem((2, 2))
+		for bucket in self.testBoard.hitList.itervalues():
+			self.assertFalse(tower in bucket)
+
 	def testValidMovement(self):
 		testUnit=Unit.purchaseUnit(1,0,self.testPlayer)
 		paths=self.testBoard.findPaths()
@@ -144,6 +179,47 @@ class TestGame(unittest.TestCase):
 		 self.assertEquals(list(p.entries()),
 						   [(None, 1), (None, 3), (None, 2)])
 
+	def testPathUnits(self):
+		p = Path([1, 3, 2, 5])
+		def scanned():
+			return [(square, unit) for unit, square in p.entries() if unit]
+		for step, unit in enumerate('AB' + 5 * ' ' + 'CDE' + 'F'):
+			if unit != ' ':
+				p.start(unit)
+			p.advance()
+			self.assertEquals(p.units(), scanned())
+		self.assertEquals(p.units(), [(1, 'C'), (3, 'D'), (2, 'E'), (5, 'F')])
+		p.moving[0] = 'G'
+		p.moving[2] = None
+		p.placed()
+		self.assertEquals(p.units(), [(1, 'G'), (3, 'D'), (5, 'F')])
+		self.assertEquals(p.advance(), 'G')
+		self.assertEquals(p.units(), scanned())
+		p.remove('D')
+		self.assertEquals(p.units(), scanned())
+		self.assertEquals([unit for square, unit in p.units()], ['F'])
+		self.assertEquals(Path(None).units(), [])
+
+	def testKilledUnitsLeavePath(self):
+		engine = Engine()
+		engine.add_player(1)
+		engine.add_player(2)
+		board = engine.board_get(1)
+		engine.tower_create(1, scenarios.tower_squares(board)[0])
+		for direction, path in board.paths.iteritems():
+			if path.moving is None:
+				continue
+			for slot in range(len(path.moving)):
+				path.moving[slot] = Unit(0, 0, engine.get_player(2))
+				path.moving[slot].health = .1
+		board.unitsPlaced()
+		count = len(board.units())
+		attacks, deaths = board.fireTowers()
+		self.assertEquals(len(deaths), 1)
+		self.assertEquals(len(board.units()), count - 1)
+		self.assertTrue(deaths[0]['unit'] not in
+			[unit for position, unit in board.units()])
+
 
 
 	"""Unit Tests"""
@@ -286,6 +362,424 @@ class TestGame(unittest.TestCase):
 		self.assertEquals(self.player2.isDead(),True)
 		
 
+	def testUpgradeThenSell(self):
+		self.testEngine.add_player(1)
+		player = self.testEngine.get_player(1)
+		player.allowedUpgrade = 1
+		tower = self.testEngine.tower_create(1, (1, 1))
+		self.testEngine.tower_upgrade(tower.ID, 1)
+		self.assertEquals(tower.upgrade, 1)
+		self.testEngine.tower_sell(tower.ID, 1)
+		for bucket in player.board.hitList.itervalues():
+			self.assertFalse(tower in bucket)
+
+	def testTowerRegistry(self):
+		self.testEngine.add_player(1)
+		self.testEngine.add_player(2)
+		tower = self.testEngine.tower_create(1, (1, 1))
+		self.assertEquals(self.testEngine.tower_get(tower.ID), tower)
+		self.assertEquals(self.testEngine.tower_get(tower.ID, 1), tower)
+		self.assertEquals(self.testEngine.tower_get(tower.ID, 2), None)
+		board = self.testEngine.board_get(1)
+		self.assertEquals(board.getTowerPosition(tower.ID), (1, 1))
+		self.testEngine.tower_sell(tower.ID, 1)
+		self.assertEquals(self.testEngine.tower_get(tower.ID), None)
+		self.assertEquals(board.getTowerPosition(tower.ID), None)
+
+	def test_runTurbo(self):
+		engine = Engine(mode=mm18.game.constants.TURBO)
+		engine.add_player(1)
+		engine.add_player(2)
+		for i in range(0,120) :
+			engine.unit_create(1,0,1,2,1)
+		engine.run()
+		self.assertFalse(engine.running)
+		self.assertTrue(engine.get_player(2).isDead())
+
+	def testInvalidMode(self):
+		with self.assertRaises(ValueError):
+			Engine(mode="warp")
+
+	def testLockstepAck(self):
+		engine = Engine(mode=mm18.game.constants.LOCKSTEP)
+		engine.add_player(1)
+		engine.add_player(2)
+		engine.advance()
+		self.assertTrue(engine.ack(1))
+		self.assertFalse(engine._all_acked())
+		self.assertTrue(engine.ack(2, engine.currTick))
+		self.assertTrue(engine._all_acked())
+		engine.wait_for_acks()
+		# Acknowledged after the wait but before the tick advanced
+		self.assertTrue(engine.ack(1))
+		engine.advance()
+		self.assertFalse(engine._all_acked())
+		self.assertTrue(engine.ack(2))
+		self.assertFalse(engine._all_acked())
+		self.assertFalse(engine.ack(1, engine.currTick - 1))
+		self.assertFalse(engine.ack(1, engine.currTick + 100))
+		self.assertFalse(engine.ack(2, engine.currTick + 1))
+		self.assertFalse(engine._all_acked())
+
+	def testCommandQueue(self):
+		engine = Engine()
+		engine.add_player(1)
+		engine.add_player(2)
+		engine.thread = threading.Thread()
+		order = []
+		first = engine.submit(order.append, 1)
+		second = engine.submit(order.append, 2)
+		self.assertFalse(first.done())
+		engine.step()
+		self.assertEquals(order, [1, 2])
+		self.assertTrue(second.done())
+
+		callbacks = []
+		failed = engine.submit(int, 'x')
+		failed.add_done_callback(callbacks.append)
+		engine.run_commands()
+		self.assertEquals(callbacks, [failed])
+		self.assertRaises(ValueError, failed.result)
+
+	def testCommandQueueFull(self):
+		engine = Engine()
+		engine.thread = threading.Thread()
+		for i in range(mm18.game.constants.COMMAND_QUEUE_SIZE):
+			engine.submit(int)
+		self.assertRaises(Queue.Full, engine.submit, int)
+		engine.endGame()
+		self.assertTrue(engine.commands.empty())
+		self.assertRaises(EngineStopped, engine.submit(int).result)
+
+	def testOutOfTime(self):
+		engine = Engine()
+		engine.add_player(1)
+		engine.add_player(2)
+		engine.players['1'].addResources(100)
+		engine.currTick = mm18.game.constants.MAX_RUNTIME + 1
+		engine.check_running()
+		self.assertFalse(engine.running)
+		self.assertEquals(engine.results, {3: '1', 4: '2'})
+
+	def testCommandWithoutThread(self):
+		engine = Engine()
+		self.assertEquals(engine.submit(int, '3').result(), 3)
+
+	def testBoardVersion(self):
+		engine = Engine()
+		engine.add_player(1)
+		engine.add_player(2)
+		engine.get_player(1).resources = 100
+		engine.get_player(1).allowedUpgrade = 3
+		board = engine.board_get(1)
+		engine.step()
+		self.assertEquals(board.version, 0)
+		tower = engine.tower_create(1, (1, 1))
+		built = board.version
+		self.assertEquals(board.towerVersions[tower.ID], built)
+		engine.tower_upgrade(tower.ID, 1)
+		self.assertTrue(board.towerVersions[tower.ID] > built)
+		engine.tower_sell(tower.ID, 1)
+		self.assertEquals(board.removedTowers[tower.ID], board.version)
+		self.assertFalse(tower.ID in board.towerVersions)
+
+		version = board.version
+		engine.step()
+		self.assertEquals(board.version, version)
+		engine.unit_create(2, 0, 0, 1, 0)
+		engine.step()
+		self.assertEquals(board.unitsVersion, board.version)
+		self.assertTrue(board.version > version)
+
+	def testTickFeed(self):
+		engine = Engine()
+		engine.add_player(1)
+		engine.add_player(2)
+		engine.step()
+		self.assertEquals(len(engine.feed.ticks), 0)
+		future = engine.feed.subscribe(engine.currTick)
+		self.assertFalse(future.done())
+		engine.unit_create(1, 0, 0, 2, 0)
+		engine.step()
+		missed, ticks = future.result()
+		self.assertFalse(missed)
+		delta = json.loads(ticks[0])
+		self.assertEquals(delta['tick'], 2)
+		self.assertEquals(delta['boards']['2']['spawns'], [[0, '1', 0, 0]])
+		self.assertTrue(engine.feed.subscribe(1).done())
+
+	def testTickFeedMissed(self):
+		feed = TickFeed(size=2)
+		for tick in range(1, 5):
+			feed.publish(tick, {'tick': tick})
+		self.assertEquals(feed.since(3), (False, ['{"tick":4}']))
+		self.assertEquals(feed.since(1)[0], True)
+		feed.close()
+		self.assertEquals(feed.subscribe(4).result(), (False, []))
+
+	def testLogWriter(self):
+		directory = tempfile.mkdtemp()
+		try:
+			for name in ['game.log', 'game.log.gz']:
+				path = os.path.join(directory, name)
+				log = LogWriter(path, fsync_interval=0)
+				for tick in range(100):
+					log.write({'action': 'advance', 'tick': tick})
+				log.close()
+				log.close()
+				log.write({'action': 'advance', 'tick': 100})
+				self.assertEquals(log.compressed, name.endswith('.gz'))
+				with open_log(path) as logFile:
+					lines = logFile.readlines()
+				self.assertEquals(len(lines), 100)
+				self.assertEquals(json.loads(lines[-1]),
+						{'action': 'advance', 'tick': 99})
+		finally:
+			shutil.rmtree(directory)
+
+	def testBinaryLog(self):
+		entries = [{'action': 'add_player', 'id': '1'},
+				{'action': 'start', 'tick': 0}]
+		for tick in range(1, 300):
+			entries.append({'action': 'advance', 'tick': tick})
+			if tick % 50 == 0:
+				entries.append({'action': 'tower_create', 'owner_id': '1',
+						'coords': [tick % 11, 2]})
+				entries.append({'action': 'unit_create', 'owner_id': '1',
+						'level': 0, 'spec': -1, 'target_id': '2',
+						'direction': 3})
+		entries.append({'action': 'surprise', 'tick': 299})
+		directory = tempfile.mkdtemp()
+		try:
+			path = os.path.join(directory, 'game.mmlog')
+			log = LogWriter(path)
+			for entry in entries:
+				log.write(dict(entry))
+			log.close()
+			binaryLog = BinaryLog(path)
+			self.assertTrue(binaryLog.complete)
+			self.assertEquals(list(binaryLog.entries()), entries)
+			after = entries.index({'action': 'advance', 'tick': 150}) + 1
+			self.assertEquals(list(binaryLog.entries(150)), entries[after:])
+			self.assertTrue(os.path.getsize(path) <
+					len(''.join(json.dumps(entry) for entry in entries)) / 10)
+			binaryLog.close()
+
+			# A log cut short is read up to its last whole record
+			with open(path, 'rb') as logFile:
+				data = logFile.read()
+			with open(path, 'wb') as logFile:
+				logFile.write(data[:len(data) / 2])
+			binaryLog = BinaryLog(path)
+			self.assertFalse(binaryLog.complete)
+			read = list(binaryLog.entries())
+			self.assertTrue(0 < len(read) < len(entries))
+			self.assertEquals(read, entries[:len(read)])
+			binaryLog.close()
+		finally:
+			shutil.rmtree(directory)
+
+	def testHistogram(self):
+		histogram = Histogram((1, 2, 4, 8))
+		for value in [0.5, 1, 1.5, 3, 3, 3, 7, 20]:
+			histogram.record(value)
+		self.assertEquals(histogram.counts, [2, 1, 3, 1, 1])
+		self.assertEquals(histogram.percentile(.5), 4)
+		self.assertEquals(histogram.percentile(.99), 20)
+		self.assertEquals(Histogram((1,)).percentile(.5), 0)
+		report = histogram.report()
+		self.assertEquals(report['max'], 20)
+		self.assertEquals(report['buckets'][-1], [None, 1])
+
+	def testStatsFile(self):
+		directory = tempfile.mkdtemp()
+		try:
+			path = os.path.join(directory, 'game.stats.json')
+			engine = Engine(stats_file=path)
+			engine.add_player(1)
+			engine.add_player(2)
+			for tick in range(5):
+				engine.step()
+			engine.endGame()
+			with open(path) as statsFile:
+				stats = json.load(statsFile)
+			self.assertEquals(stats['tick'], 5)
+			self.assertFalse(stats['running'])
+			self.assertEquals(stats['ticks']['count'], 5)
+			self.assertEquals(stats['overruns'], 0)
+		finally:
+			shutil.rmtree(directory)
+
+	def testTickScheduler(self):
+		now = [0]
+		def clock():
+			return now[0]
+		def sleep(seconds):
+			now[0] += seconds
+		def tick(scheduler, seconds):
+			now[0] += seconds
+			return scheduler.wait()
+
+		catchUp = TickScheduler(1, mm18.game.constants.CATCH_UP, 2, clock, sleep)
+		catchUp.start()
+		self.assertFalse(tick(catchUp, .5))
+		self.assertEquals(now[0], 1)
+		# Four ticks due by then, one more than can be caught up on
+		self.assertTrue(tick(catchUp, 4.5))
+		self.assertTrue(tick(catchUp, 0))
+		self.assertTrue(tick(catchUp, 0))
+		self.assertFalse(tick(catchUp, 0))
+		# Back on time, with no drift
+		self.assertEquals(now[0], 6)
+		self.assertEquals((catchUp.late, catchUp.skipped), (3, 1))
+
+		now[0] = 0
+		skip = TickScheduler(1, mm18.game.constants.SKIP, 2, clock, sleep)
+		skip.start()
+		self.assertTrue(tick(skip, 2.5))
+		self.assertEquals(now[0], 3)
+		self.assertEquals((skip.late, skip.skipped), (1, 2))
+
+		now[0] = 0
+		degrade = TickScheduler(1, mm18.game.constants.DEGRADE, 2, clock,
+			sleep)
+		degrade.start()
+		self.assertTrue(tick(degrade, 2))
+		self.assertAlmostEquals(degrade.pace, 1.2)
+		self.assertEquals(now[0], 2)
+		self.assertFalse(tick(degrade, 0))
+		self.assertEquals(degrade.pace, 1)
+		self.assertEquals(now[0], 3)
+		self.assertEquals((degrade.late, degrade.skipped), (1, 0))
+
+		self.assertRaises(ValueError, TickScheduler, 1, 'sometimes')
+
+	def testBenchmarks(self):
+		engine = scenarios.late_game()
+		board = engine.get_player(1).board
+		self.assertEquals(len(board.units()), 52)
+		self.assertTrue(board.getTowers())
+		result = bench.measure(partial(benchmarks.units, scenarios.full_paths),
+			number=50, repeat=1, min_time=0)
+		self.assertTrue(result['ops_per_sec'] > 0)
+		# The list of units, and a tuple for each
+		self.assertAlmostEquals(result['allocations'], 53, delta=1)
+
+		def results(relative, allocations, ops_per_sec=1000):
+			return {'benchmarks': {'units': {'relative': relative,
+				'allocations': allocations, 'ops_per_sec': ops_per_sec}}}
+		baseline = results(1.0, 10)
+		self.assertEquals(bench.compare(results(.9, 10), baseline), [])
+		self.assertEquals(len(bench.compare(results(.5, 10), baseline)), 1)
+		self.assertEquals(len(bench.compare(results(.5, 20), baseline)), 2)
+		# Calls this quick may vary more
+		baseline = results(1.0, 10, 10 ** 6)
+		self.assertEquals(bench.compare(results(.6, 10), baseline), [])
+		self.assertEquals(len(bench.compare(results(.4, 10), baseline)), 1)
+
+	def testSnapshot(self):
+		engine = Engine()
+		for player in range(1, 5):
+			engine.add_player(player)
+		engine.get_player(1).allowedUpgrade = 3
+		for tick in range(200):
+			if tick % 20 == 0:
+				tower = engine.tower_create(1, (tick % 11, 2))
+				if tower is not None and tick % 40 == 0:
+					engine.tower_upgrade(tower.ID, 1)
+			if tick % 3 == 0:
+				engine.unit_create(2, 0, 0, 1, tick % 4)
+			engine.advance()
+		snapshot = engine.snapshot()
+
+		restored = Engine()
+		restored.restore(snapshot)
+		self.assertEquals(restored.snapshot(), snapshot)
+		self.assertEquals(sorted(restored.towers), sorted(engine.towers))
+		for tick in range(100):
+			for game in [engine, restored]:
+				if tick % 5 == 0:
+					game.unit_create(2, 0, 1, 1, 0)
+			attacks = [[(attack['tower'].ID, attack['unit'].health)
+					for attack in game.advance()['1'].get('attacks', [])]
+					for game in [engine, restored]]
+			self.assertEquals(attacks[0], attacks[1])
+		self.assertEquals(restored.snapshot(), engine.snapshot())
+
+	def testReplayerSeek(self):
+		directory = tempfile.mkdtemp()
+		try:
+			path = os.path.join(directory, 'game.mmlog')
+			engine = Engine(LogWriter(path))
+			for player in range(1, 5):
+				engine.add_player(player)
+			engine.log_start()
+			for tick in range(300):
+				if tick % 40 == 0:
+					engine.tower_create(1, (tick % 11, 2))
+				if tick % 7 == 0:
+					engine.unit_create(2, 0, 0, 1, tick % 4)
+				engine.advance()
+			engine.endGame()
+
+			def state(replayer):
+				return [(player.name, player.health, player.resources,
+						sorted(player.board.tower),
+						[unit.health for unit, coords in
+							player.board.paths[0].entries() if unit])
+						for name, player in sorted(replayer.game.players.items())]
+
+			replayer = Replayer.open(path, checkpoint_interval=50)
+			replayer.setup_game()
+			expected = {}
+			while replayer.play_tick() is not None:
+				expected[replayer.game.currTick] = state(replayer)
+			self.assertEquals(sorted(replayer.checkpoints),
+					[50, 100, 150, 200, 250, 300])
+			for tick in [120, 299, 49, 250, 300]:
+				self.assertEquals(replayer.seek(tick), tick)
+				self.assertEquals(state(replayer), expected[tick])
+
+			replayer.save_checkpoints()
+			checkpoints = replayer.checkpoints
+			replayer = Replayer.open(path, checkpoint_interval=50)
+			self.assertEquals(replayer.checkpoints, checkpoints)
+			replayer.setup_game()
+			replayer.seek(260)
+			self.assertEquals(state(replayer), expected[260])
+
+			# Anything else saved there isn't loaded, let alone run
+			with open(replayer.checkpoint_path(), 'wb') as checkpointFile:
+				checkpointFile.write("cos\nsystem\n(S'exit 1'\ntR.")
+			replayer = Replayer.open(path, checkpoint_interval=50)
+			self.assertEquals(replayer.checkpoints, {})
+		finally:
+			shutil.rmtree(directory)
+
+	def testEngineLogClosedAtEnd(self):
+		directory = tempfile.mkdtemp()
+		try:
+			path = os.path.join(directory, 'game.log')
+			engine = Engine(LogWriter(path))
+			engine.add_player(1)
+			engine.add_player(2)
+			engine.step()
+			engine.endGame()
+			self.assertTrue(engine.log_file.closed)
+			with open(path) as logFile:
+				actions = [json.loads(line)['action'] for line in logFile]
+			self.assertEquals(actions, ['add_player', 'add_player', 'advance'])
+		finally:
+			shutil.rmtree(directory)
+
+	def testRunBatch(self):
+		strategies = [batch.random_attacker, batch.tower_builder]
+		rows = batch.run_batch(strategies, [1, 2], max_ticks=500)
+		self.assertEquals(len(rows), 2)
+		self.assertEquals(rows[0]['players']['2']['strategy'], 'tower_builder')
+		self.assertTrue(rows[0]['ticks'] <= 500)
+		self.assertEquals(batch.run_batch(strategies, [1], max_ticks=500), rows[:1])
+
 	def testboard_get(self):
 		self.testEngine.add_player(1)
 		self.assertTrue(self.testEngine.board_get(1) != None)
@@ -0,0 +1,450 @@
+import unittest
+import httplib
+import imp
+import json
+import os
+import re
+import socket
+import threading
+from mm18.server.event_server import EventLoopHTTPServer
+from mm18.server.game_registry import MMGameRegistry
+from mm18.server.router import Router
+from mm18.server import codec
+from mm18.server.urls import router
+from mm18.game import game_controller
+import mm18.game.constants
+from mm18.game.engine import Engine
+import loadgen
+
+def decoded(response):
+	"""The dictionary of a response, encoded or not."""
+	if isinstance(response, game_controller.EncodedJSON):
+		return json.loads(response.json)
+	return response
+
+"""Tests for the server code go here"""
+class TestServer(unittest.TestCase):
+
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.testRegistry = MMGameRegistry(players_per_game=2, max_games=None)
+
+	"""GAME REGISTRY TESTS"""
+# =============================================================================
+	def testJoinFillsLobby(self):
+		game1, client1 = self.testRegistry.join()
+		game2, client2 = self.testRegistry.join()
+		game3, client3 = self.testRegistry.join()
+		self.assertTrue(game1 is game2)
+		self.assertFalse(game1 is game3)
+		self.assertEquals(client1[0], 1)
+		self.assertEquals(client3[0], 1)
+
+	def testFindByToken(self):
+		game1, client1 = self.testRegistry.join()
+		self.testRegistry.join()
+		game2, client2 = self.testRegistry.join()
+		self.assertTrue(self.testRegistry.find(client1[0], client1[1]) is game1)
+		self.assertTrue(self.testRegistry.find(client2[0], client2[1]) is game2)
+		self.assertTrue(self.testRegistry.find(client2[0], client2[1], game2.id) is game2)
+		self.assertEquals(self.testRegistry.find(client2[0], client1[1], game2.id), None)
+		self.assertEquals(self.testRegistry.find(1, 'bogus'), None)
+
+	def testMaxGames(self):
+		registry = MMGameRegistry(players_per_game=1, max_games=1)
+		game, client = registry.join()
+		self.assertEquals(registry.join(), None)
+		self.assertTrue(registry.finish(game))
+
+	def testGameLog(self):
+		game, client = self.testRegistry.join()
+		self.assertEquals(self.testRegistry.game_log("game.log", game), "game-1.log")
+		self.assertEquals(MMGameRegistry().game_log("game.log", game), "game.log")
+
+	"""ROUTER TESTS"""
+# =============================================================================
+	def testRouterLiteral(self):
+		self.assertEquals(router.match('/game/status'),
+			(game_controller.get_game_status, {}))
+		self.assertEquals(router.match('/tower/create?x=1'),
+			(game_controller.tower_create, {}))
+
+	def testRouterGroups(self):
+		self.assertEquals(router.match('/tower/12/upgrade'),
+			(game_controller.tower_upgrade, {'id': '12'}))
+		self.assertEquals(router.match('/tower/12'),
+			(game_controller.tower_get, {'id': '12'}))
+		self.assertEquals(router.match('/board/3'),
+			(game_controller.board_get, {'id': '3'}))
+
+	def testRouterUnmatched(self):
+		self.assertEquals(router.match('/tower/12/explode'), None)
+		self.assertEquals(router.match('/tower/abc'), None)
+		self.assertEquals(router.match('/game/statusfoo'), None)
+		self.assertEquals(Router([]).match('/game/status'), None)
+
+	"""BATCH TESTS"""
+# =============================================================================
+	def testBatch(self):
+		engine = Engine()
+		engine.add_player(1)
+		engine.add_player(2)
+		engine.get_player(1).resources = 100
+		engine.get_player(1).allowedUpgrade = 3
+		game_controller._engines[-1] = engine
+		self.addCleanup(game_controller.forget_game, -1)
+		handler, regex = router.match('/batch')
+		future = handler(regex, id=1, auth='token', game=-1, actions=[
+			{'call': '/tower/create', 'position': [1, 1]},
+			{'call': '/tower/0/upgrade', 'id': 2},
+			{'call': '/unit/create', 'level': 0, 'spec': 0},
+			{'call': '/tower/0/explode'},
+			{'call': '/unit/create', 'level': 0, 'spec': 0, 'target_id': 2,
+				'path': 1}])
+		code, output = game_controller.command_result(future)
+		self.assertEquals(code, 200)
+		statuses = [result['status'] for result in output['results']]
+		self.assertEquals(statuses, [200, 200, 400, 404, 200])
+		self.assertEquals(output['results'][0]['towerID'], 0)
+		self.assertEquals(output['results'][1]['towerUpgrade'], 1)
+		self.assertEquals(output['results'][4]['playerTargetID'], 2)
+		self.assertEquals(engine.tower_get(0).upgrade, 1)
+
+	def testBatchInvalidAction(self):
+		engine = Engine()
+		engine.add_player(1)
+		engine.add_player(2)
+		engine.get_player(1).resources = 100
+		game_controller._engines[-1] = engine
+		self.addCleanup(game_controller.forget_game, -1)
+		handler, regex = router.match('/batch')
+		future = handler(regex, id=1, auth='token', game=-1, actions=[
+			{'call': '/tower/create', 'position': [1, 1]},
+			{'call': '/tower/create', 'position': 5},
+			{'call': '/unit/create', 'level': 0, 'spec': 0, 'target_id': 2,
+				'path': 1}])
+		code, output = game_controller.command_result(future)
+		self.assertEquals(code, 200)
+		statuses = [result['status'] for result in output['results']]
+		self.assertEquals(statuses, [200, 400, 200])
+		self.assertNotEquals(engine.tower_get(0), None)
+		self.assertEquals(engine.tower_get(1), None)
+
+	def testArenaScoresByRank(self):
+		arena = imp.load_source('arena', os.path.join(
+			os.path.dirname(__file__), os.pardir, 'arena', 'arena.py'))
+		teams = ['1', '2', '3', '4']
+		standings = dict((team, {'points': 0, 'wins': 0, 'games': 0})
+			for team in teams)
+
+		# Two teams running out of time are placed 3rd and 4th
+		engine = Engine()
+		engine.add_player(1)
+		engine.add_player(2)
+		engine.players['1'].addResources(100)
+		engine.currTick = mm18.game.constants.MAX_RUNTIME + 1
+		engine.check_running()
+		arena.score_match(standings, ['1', '2'], engine.results)
+		self.assertEquals(standings['1'], {'points': 3, 'wins': 1, 'games': 1})
+		self.assertEquals(standings['2'], {'points': 2, 'wins': 0, 'games': 1})
+
+		arena.score_match(standings, ['3', '4', '1'], {2: '4', 3: '1', 4: '3'})
+		self.assertEquals(standings['4'], {'points': 3, 'wins': 1, 'games': 1})
+		self.assertEquals(standings['1'], {'points': 5, 'wins': 1, 'games': 2})
+		self.assertEquals(standings['3'], {'points': 1, 'wins': 0, 'games': 1})
+
+	def testBatchNotBatchable(self):
+		engine = Engine()
+		engine.add_player(1)
+		game_controller._engines[-1] = engine
+		self.addCleanup(game_controller.forget_game, -1)
+		handler, regex = router.match('/batch')
+		future = handler(regex, id=1, auth='token', game=-1, actions=[
+			{'call': '/game/subscribe'},
+			{'call': '/batch', 'actions': [{'call': '/game/status'}]},
+			{'call': '/game/status'}])
+		code, output = game_controller.command_result(future)
+		statuses = [result['status'] for result in output['results']]
+		self.assertEquals(statuses, [400, 400, 200])
+		self.assertFalse(engine.feed.subscribed)
+
+	def testBatchNotList(self):
+		game_controller._engines[-1] = Engine()
+		self.addCleanup(game_controller.forget_game, -1)
+		handler, regex = router.match('/batch')
+		for actions in [{'actions': {}}, {}]:
+			future = handler(regex, id=1, auth='token', game=-1, **actions)
+			self.assertEquals(game_controller.command_result(future)[0], 400)
+
+	def testQueuedCommand(self):
+		engine = Engine()
+		engine.add_player(1)
+		engine.add_player(2)
+		engine.thread = threading.Thread()
+		game_controller._engines[-1] = engine
+		self.addCleanup(game_controller.forget_game, -1)
+		handler, regex = router.match('/tower/create')
+		future = handler(regex, id=1, auth='token', game=-1, position=[1, 1])
+		self.assertFalse(future.done())
+		self.assertEquals(engine.tower_get(0), None)
+		engine.step()
+		self.assertEquals(game_controller.command_result(future)[0], 200)
+		self.assertNotEquals(engine.tower_get(0), None)
+
+		future = handler(regex, id=1, auth='token', game=-1, position=[1, 2])
+		engine.endGame()
+		self.assertEquals(game_controller.command_result(future),
+			game_controller.respond_for_done_game())
+
+	def testQueuedRead(self):
+		engine = Engine()
+		engine.add_player(1)
+		engine.add_player(2)
+		engine.thread = threading.Thread()
+		game_controller._engines[-1] = engine
+		self.addCleanup(game_controller.forget_game, -1)
+		# A tick in progress on another thread doesn't hold the read up
+		ticking = threading.Event()
+		done = threading.Event()
+		def tick():
+			with engine.lock:
+				ticking.set()
+				done.wait(5)
+		thread = threading.Thread(target=tick)
+		thread.start()
+		self.addCleanup(thread.join)
+		self.addCleanup(done.set)
+		ticking.wait(5)
+		handler, regex = router.match('/board/1')
+		future = handler(regex, id=1, auth='token', game=-1)
+		self.assertFalse(future.done())
+		done.set()
+		thread.join()
+		engine.step()
+		self.assertEquals(game_controller.command_result(future)[0], 200)
+
+	"""BOARD TESTS"""
+# =============================================================================
+	def testBoardSince(self):
+		engine = Engine()
+		engine.add_player(1)
+		engine.add_player(2)
+		engine.get_player(1).resources = 100
+		game_controller._engines[-1] = engine
+		self.addCleanup(game_controller.forget_game, -1)
+		handler, regex = router.match('/board/1')
+		def board(**json):
+			return game_controller.command_result(handler(regex, id=1,
+				auth='token', game=-1, **json))
+		first = engine.tower_create(1, (1, 1))
+		code, full = board()
+		full = decoded(full)
+		self.assertEquals(code, 200)
+		self.assertEquals(full['towers'], [[first.ID, [1, 1]]])
+		self.assertTrue(len(full['paths']) > 0)
+
+		code, output = board(since=full['version'])
+		self.assertEquals(output, {'error': '', 'version': full['version'],
+			'unchanged': True})
+
+		second = engine.tower_create(1, (6, 1))
+		engine.tower_sell(first.ID, 1)
+		code, output = board(since=full['version'])
+		self.assertEquals(output['towers'], [(second.ID, (6, 1))])
+		self.assertEquals(output['removed'], [first.ID])
+		self.assertFalse('units' in output)
+
+		code, output = board(since=1000)
+		self.assertTrue('paths' in decoded(output))
+
+	def testBoardLayout(self):
+		engine = Engine()
+		engine.add_player(1)
+		game_controller._engines[-1] = engine
+		self.addCleanup(game_controller.forget_game, -1)
+		handler, regex = router.match('/board/1/layout')
+		code, output = handler(regex, id=1, auth='token', game=-1)
+		output = decoded(output)
+		self.assertEquals(code, 200)
+		self.assertEquals(output['paths'],
+			[list(square) for square in engine.board_get(1).path])
+		self.assertEquals(len(output['routes']), 4)
+		handler, regex = router.match('/board/7/layout')
+		self.assertEquals(handler(regex, id=1, auth='token', game=-1)[0], 409)
+
+	def testMetrics(self):
+		engine = Engine()
+		engine.add_player(1)
+		engine.add_player(2)
+		for tick in range(10):
+			engine.step()
+		game_controller._engines[-1] = engine
+		self.addCleanup(game_controller.forget_game, -1)
+		handler, regex = router.match('/metrics')
+		code, output = game_controller.command_result(
+			handler(regex, id=1, auth='token', game=-1))
+		self.assertEquals(code, 200)
+		self.assertEquals(output['tick'], 10)
+		self.assertEquals(output['ticks']['count'], 10)
+		self.assertEquals(sorted(output['boards']), ['1', '2'])
+		self.assertEquals(output['phases']['move']['count'], 10)
+		json.dumps(output)
+
+	def testLoadgenReport(self):
+		self.assertEquals(loadgen.parse_mix('polling'), [('board', 1.0)])
+		self.assertEquals(loadgen.parse_mix('units=3,board'),
+			[('units', 3.0), ('board', 1.0)])
+		self.assertRaises(ValueError, loadgen.parse_mix, 'explode=1')
+		self.assertRaises(ValueError, loadgen.parse_mix, 'units=0')
+
+		recorder = loadgen.Recorder()
+		for i in range(1, 101):
+			recorder.record('board', i / 1000.0, 200)
+		recorder.record('units', .01, 409)
+		recorder.record('units', .01, 500)
+		recorder.fail('units', 1)
+		recorder.metrics[1] = {'ticks': {'count': 100}, 'overruns': 5}
+		report = recorder.report(2)
+		self.assertEquals(report['requests'], 103)
+		self.assertEquals(report['actions']['board']['p50'], .051)
+		self.assertEquals(report['actions']['board']['p99'], .099)
+		self.assertEquals(report['actions']['units']['error_rate'], 2 / 3.0)
+		self.assertEquals(report['overrun_rate'], .05)
+
+	def testResponseCache(self):
+		engine = Engine()
+		engine.add_player(1)
+		engine.add_player(2)
+		engine.get_player(1).resources = 100
+		game_controller._engines[-1] = engine
+		self.addCleanup(game_controller.forget_game, -1)
+		def call(path, player=1):
+			handler, regex = router.match(path)
+			return game_controller.command_result(handler(regex, id=player,
+				auth='token', game=-1))
+		first = call('/game/status')[1]
+		self.assertTrue(call('/game/status', 2)[1] is first)
+		engine.step()
+		self.assertFalse(call('/game/status')[1] is first)
+
+		first = call('/board/1')[1]
+		engine.step()
+		self.assertTrue(call('/board/1')[1] is first)
+		engine.tower_create(1, (1, 1))
+		self.assertEquals(len(decoded(call('/board/1')[1])['towers']), 1)
+
+		constants, regex = router.match('/constants')
+		output = decoded(constants(regex, id=1, auth='token', game=-1)[1])
+		self.assertEquals(output['TICK_TIME'], mm18.game.constants.TICK_TIME)
+		self.assertFalse('status' in mm18.game.constants.CONSTANTS_DICT)
+
+	"""SUBSCRIBE TESTS"""
+# =============================================================================
+	def testSubscribe(self):
+		engine = Engine()
+		engine.add_player(1)
+		engine.add_player(2)
+		game_controller._engines[-1] = engine
+		self.addCleanup(game_controller.forget_game, -1)
+		handler, regex = router.match('/game/subscribe')
+		future = handler(regex, id=1, auth='token', game=-1)
+		self.assertFalse(future.done())
+		engine.step()
+		engine.step()
+		code, output = game_controller.command_result(future)
+		self.assertEquals(code, 200)
+		output = json.loads(output.json)
+		self.assertEquals(output['missed'], False)
+		self.assertEquals([tick['tick'] for tick in output['ticks']], [1])
+
+		future = handler(regex, id=1, auth='token', game=-1, tick=0)
+		output = json.loads(game_controller.command_result(future)[1].json)
+		self.assertEquals([tick['tick'] for tick in output['ticks']], [1, 2])
+
+		for tick in ['abc', [1], 1.5]:
+			self.assertEquals(handler(regex, id=1, auth='token', game=-1,
+				tick=tick), (400, {'error': "Tick must be an integer"}))
+
+	"""CODEC TESTS"""
+# =============================================================================
+	def testMessagePack(self):
+		self.assertEquals(codec.pack({'a': 1}), '\x81\xa1a\x01')
+		self.assertEquals(codec.pack([None, True, -1, 1.5]),
+			'\x94\xc0\xc3\xff\xcb\x3f\xf8\x00\x00\x00\x00\x00\x00')
+		data = {u'id': 1, u'auth': u'12345', u'players': [[u'1', 100.5]],
+			u'big': 1 << 40, u'small': -1 << 40, u'long': u'x' * 300,
+			u'list': range(20), u'nothing': None, u'no': False}
+		self.assertEquals(codec.unpack(codec.pack(data)), data)
+		self.assertEquals(codec.unpack(codec.pack((1, 2))), [1, 2])
+
+	def testMessagePackInvalid(self):
+		self.assertRaises(ValueError, codec.unpack, '')
+		self.assertRaises(ValueError, codec.unpack, '\x92\x01')
+		self.assertRaises(ValueError, codec.unpack, '\x01\x02')
+		self.assertRaises(ValueError, codec.unpack, '\xc1')
+		self.assertRaises(TypeError, codec.pack, object())
+
+	def testNegotiate(self):
+		self.assertEquals(codec.negotiate(None, None), (codec.JSON, codec.JSON))
+		self.assertEquals(codec.negotiate('application/x-msgpack', '*/*'),
+			(codec.MSGPACK, codec.MSGPACK))
+		self.assertEquals(codec.negotiate('application/json; charset=utf-8',
+			'application/msgpack'), (codec.JSON, codec.MSGPACK))
+
+	def testEncodedResponseAs(self):
+		response = game_controller.encoded(200, {'error': ''})
+		packed = response.encoded_as(codec.MSGPACK)
+		self.assertEquals(codec.unpack(packed), {'error': '', 'status': 200})
+		self.assertTrue(response.encoded_as(codec.MSGPACK) is packed)
+
+	"""EVENT LOOP SERVER TESTS"""
+# =============================================================================
+	def startEventServer(self):
+		server = EventLoopHTTPServer(('localhost', 0))
+		thread = threading.Thread(target=server.serve_forever)
+		thread.daemon = True
+		thread.start()
+		self.addCleanup(server.server_close)
+		self.addCleanup(server.shutdown)
+		return server.server_address[1]
+
+	def testEventServerKeepAlive(self):
+		connection = httplib.HTTPConnection('localhost', self.startEventServer())
+		connection.request('POST', '/game/status', '{}')
+		response = connection.getresponse()
+		self.assertEquals(response.status, 400)
+		self.assertEquals(json.loads(response.read())['status'], 400)
+		sock = connection.sock
+		connection.request('POST', '/game/status', 'not json')
+		response = connection.getresponse()
+		self.assertEquals(response.status, 400)
+		response.read()
+		self.assertTrue(connection.sock is sock)
+		connection.close()
+
+	def testEventServerPipelining(self):
+		sock = socket.create_connection(('localhost', self.startEventServer()))
+		def request(body, headers=''):
+			return 'POST /game/status HTTP/1.1\r\nContent-Length: %d\r\n%s\r\n%s' % \
+				(len(body), headers, body)
+		sock.sendall(request('{}') + 'GET / HTTP/1.1\r\n\r\n' +
+			request('{"id": 1, "auth": "bogus"}', 'Connection: close\r\n'))
+		output = ''
+		while True:
+			data = sock.recv(4096)
+			if not data:
+				break
+			output += data
+		sock.close()
+		statuses = re.findall(r'HTTP/1.1 (\d+)', output)
+		self.assertEquals(statuses, ['400', '405', '401'])
+
+	def testEventServerMessagePack(self):
+		connection = httplib.HTTPConnection('localhost', self.startEventServer())
+		connection.request('POST', '/game/status', codec.pack({'id': 1}),
+			{'Content-Type': codec.MSGPACK.content_type})
+		response = connection.getresponse()
+		self.assertEquals(response.getheader('Content-Type'),
+			codec.MSGPACK.content_type)
+		self.assertEquals(codec.unpack(response.read())['status'], 400)
+		connection.close()
@@ -1,10 +1,14 @@
 #! /usr/bin/env python
 
 from mmtest.game_tests import *
+from mmtest.server_tests import *
 import unittest
 
 def get_suite():
-	suite = unittest.TestLoader().loadTestsFromTestCase(TestGame)
+	loader = unittest.TestLoader()
+	suite = unittest.TestSuite()
+	suite.addTests(loader.loadTestsFromTestCase(TestGame))
+	suite.addTests(loader.loadTestsFromTestCase(TestServer))
 	return suite
 
 def run_suite():